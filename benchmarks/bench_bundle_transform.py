@@ -0,0 +1,101 @@
+"""Time and allocations of tagging external search bundles
+
+Adds the "found" identifier to every Patient of a ``--entries`` entry
+bundle, comparing the previous deep copy with the transform pipeline's
+structural sharing and in-place modes.  Allocations are peak bytes traced
+by ``tracemalloc`` during the transformation.
+
+    python benchmarks/bench_bundle_transform.py [--entries 10000]
+"""
+
+import argparse
+from copy import deepcopy
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from patientsearch.models.bundle_transform import (  # noqa: E402
+    tag_identifiers,
+    transform_bundle,
+)
+
+FOUND = {"system": "https://github.com/uwcirg/script-fhir-facade", "value": "found"}
+
+
+def previous_add_identifier(bundle, resource_type, identifier):
+    """Previous implementation: deep copy, linear identifier scan"""
+    result = deepcopy(bundle)
+    for entry in result["entry"]:
+        resource = entry["resource"]
+        if resource.get("resourceType") != resource_type:
+            continue
+        identifiers = resource.get("identifier", [])
+        found = False
+        for i in identifiers:
+            if (
+                i.get("system", "") == identifier["system"]
+                and i.get("value", "") == identifier["value"]
+            ):
+                found = True
+                break
+        if not found:
+            identifiers.append(identifier)
+            resource["identifier"] = identifiers
+    return result
+
+
+def large_bundle(entries):
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "entry": [
+            {
+                "fullUrl": f"http://example.org/Patient/{i}",
+                "resource": {
+                    "resourceType": "Patient",
+                    "id": str(i),
+                    "name": [{"family": f"family{i}", "given": [f"given{i}"]}],
+                    "birthDate": "1977-01-12",
+                    "identifier": [
+                        {"system": f"http://example.org/{n}", "value": str(i)}
+                        for n in range(5)
+                    ],
+                    "address": [{"line": [f"{i} Main St"], "city": "Seattle"}],
+                },
+            }
+            for i in range(entries)
+        ],
+    }
+
+
+def measure(label, fn, entries):
+    bundle = large_bundle(entries)
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(bundle)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>10}: {elapsed * 1000:8.1f} ms  peak {peak / 2**20:7.2f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=10000)
+    args = parser.parse_args()
+
+    tag = tag_identifiers("Patient", FOUND)
+    measure(
+        "deepcopy",
+        lambda b: previous_add_identifier(b, "Patient", FOUND),
+        args.entries,
+    )
+    measure("shared", lambda b: transform_bundle(b, tag), args.entries)
+    measure("in place", lambda b: transform_bundle(b, tag, in_place=True), args.entries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Compare per-call connections with the pooled upstream session
+
+Issues the same sequence of HAPI style GETs against a local stand-in, first
+with module level ``requests.get`` (a new connection per call, as
+``HAPI_request`` used to) and then through ``upstream_session``.
+
+    python benchmarks/bench_http_pool.py [--calls 500] [--threads 4]
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.standins import StandInServer  # noqa: E402
+from patientsearch.models.http_client import (  # noqa: E402
+    close_sessions,
+    connection_stats,
+    upstream_session,
+)
+
+
+def run(label, get, url, calls, threads):
+    def one(_):
+        resp = get(
+            url + "Patient",
+            headers={"Cache-Control": "no-cache"},
+            params={"family": "skywalker"},
+            timeout=30,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(calls)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:>10}: {calls} calls in {elapsed:.3f}s "
+        f"({calls / elapsed:.0f}/s, {elapsed / calls * 1000:.2f} ms/call)"
+    )
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    with StandInServer() as standin:
+        run("unpooled", requests.get, standin.url, args.calls, args.threads)
+        unpooled_connections = standin.connections
+
+        standin.connections = 0
+        close_sessions()
+        session = upstream_session("MAP_API", config={})
+        run("pooled", session.get, standin.url, args.calls, args.threads)
+        print(
+            f"stand-in connections: unpooled={unpooled_connections} "
+            f"pooled={standin.connections}"
+        )
+        print(f"pool stats: {connection_stats()['MAP_API']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Microbenchmark of the JSON backends over the test fixture bundles
+
+Each fixture bundle under ``tests/test_sync`` and ``tests/test_columnconfig``
+is scaled up to ``--entries`` entries (by repeating its entries with new
+ids), then decoded and encoded with each available backend.
+
+    python benchmarks/bench_json.py [--entries 5000] [--rounds 10]
+"""
+
+import argparse
+from copy import deepcopy
+import glob
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from patientsearch import jsoncodec  # noqa: E402
+
+
+def scaled(bundle, entries):
+    """Copy of bundle with its entries repeated to the requested count"""
+    source = bundle.get("entry") or [{"resource": bundle}]
+    result = deepcopy(bundle)
+    result["entry"] = []
+    for i in range(entries):
+        entry = deepcopy(source[i % len(source)])
+        entry.get("resource", {})["id"] = f"scaled-{i}"
+        result["entry"].append(entry)
+    result["total"] = entries
+    return result
+
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    fixtures = sorted(
+        glob.glob(os.path.join(ROOT, "tests", "test_sync", "*.json"))
+        + glob.glob(os.path.join(ROOT, "tests", "test_columnconfig", "*.json"))
+    )
+    backends = ["stdlib"] + (["orjson"] if jsoncodec.orjson else [])
+    print(f"{'fixture':40} {'backend':>8} {'decode ms':>10} {'encode ms':>10}")
+    for path in fixtures:
+        with open(path) as fixture:
+            bundle = scaled(json.load(fixture), args.entries)
+        raw = json.dumps(bundle).encode("utf-8")
+        for backend in backends:
+            jsoncodec.configure(backend)
+            decode = timed(lambda: jsoncodec.loads(raw), args.rounds)
+            encode = timed(lambda: jsoncodec.dumpb(bundle, sort_keys=True), args.rounds)
+            name = os.path.relpath(path, os.path.join(ROOT, "tests"))
+            print(f"{name:40} {backend:>8} {decode:10.2f} {encode:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Request thread latency of audit logging against a slow log server
+
+Emits audit events while the stand-in log server takes ``--latency``
+seconds per POST; compares the previous synchronous POST per event with the
+queued, batched ``LogServerHandler``.
+
+    python benchmarks/bench_logserver.py [--events 50] [--latency 0.2]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.standins import StandInServer  # noqa: E402
+from patientsearch.logserverhandler import LogServerHandler  # noqa: E402
+
+
+class SynchronousHandler(LogServerHandler):
+    """Previous behavior: one blocking POST per event, in the caller's thread"""
+
+    def emit(self, record):
+        log_entry = {"event": json.loads(self.format(record))}
+        requests.post(url=self.url, json=log_entry, timeout=30).raise_for_status()
+
+
+def measure(label, handler, events):
+    logger = logging.getLogger(f"bench.{label}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    latencies = []
+    for i in range(events):
+        start = time.perf_counter()
+        logger.info("search", extra={"tags": ["search"], "user": {"DEA": i}})
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    handler.flush()
+    drained = time.perf_counter() - start
+    logger.removeHandler(handler)
+
+    latencies.sort()
+    print(
+        f"{label:>12}: per-event p50 {statistics.median(latencies) * 1000:8.3f} ms"
+        f"  p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:8.3f} ms"
+        f"  total {sum(latencies):6.2f} s  (flush {drained:.2f} s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with StandInServer(body={}, latency=args.latency) as logserver:
+        url = logserver.url.rstrip("/")
+        measure("synchronous", SynchronousHandler(url=url, jwt="x"), args.events)
+        sync_posts = logserver.requests
+
+        queued = LogServerHandler(url=url, jwt="x")
+        measure("queued", queued, args.events)
+        print(
+            f"log server POSTs: synchronous={sync_posts} "
+            f"queued={logserver.requests - sync_posts}; stats {queued.stats()}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Patient search param extraction: per-call JMESPath vs compiled rules
+
+Compares the previous ``patient_as_search_params`` (six ``jmespath.search``
+calls, re-parsing each expression per call) with the compiled match rules
+over ``--patients`` synthetic Patients.
+
+    python benchmarks/bench_match_rules.py [--patients 5000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from jmespath import search as json_search
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from patientsearch.models.match_rules import (  # noqa: E402
+    DEFAULT_MATCH_RULES,
+    MatchRules,
+)
+
+
+def previous_search_params(patient):
+    """Previous implementation, with hard-coded paths"""
+    search_params = {}
+    for path, queryterm, compstr in DEFAULT_MATCH_RULES:
+        match = json_search(path, patient)
+        if match and isinstance(match, str):
+            search_params[queryterm] = compstr + match
+    return search_params
+
+
+def synthetic_patients(count):
+    return [
+        {
+            "resourceType": "Patient",
+            "id": str(i),
+            "name": [{"family": f"family{i}", "given": [f"given{i}", "middle"]}],
+            "birthDate": f"19{i % 100:02d}-01-{i % 28 + 1:02d}",
+            "gender": "female" if i % 2 else "male",
+            "identifier": [{"system": "http://example.org", "value": str(i)}],
+        }
+        for i in range(count)
+    ]
+
+
+def timed(label, fn, patients):
+    start = time.perf_counter()
+    results = [fn(p) for p in patients]
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:>10}: {elapsed * 1000:8.1f} ms total"
+        f"  {elapsed / len(patients) * 1e6:6.1f} us/patient"
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--patients", type=int, default=5000)
+    args = parser.parse_args()
+
+    patients = synthetic_patients(args.patients)
+    rules = MatchRules(DEFAULT_MATCH_RULES)
+    previous = timed("previous", previous_search_params, patients)
+    compiled = timed("compiled", rules.search_params, patients)
+    assert previous == compiled
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Time and peak memory of relaying a large bundle: parse vs passthrough
+
+Serves a searchset of ``--entries`` Patients from a local stand-in HAPI and
+fetches it through ``/fhir/Patient`` with ``FHIR_PASSTHROUGH`` off, then on.
+
+    python benchmarks/bench_passthrough.py [--entries 5000] [--requests 20]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.standins import StandInServer, search_bundle  # noqa: E402
+from patientsearch import create_app  # noqa: E402
+
+
+def measure(client, label, requests):
+    client.get("/fhir/Patient").data  # warm up
+    start = time.perf_counter()
+    for _ in range(requests):
+        size = len(client.get("/fhir/Patient").data)
+    elapsed = (time.perf_counter() - start) / requests
+
+    tracemalloc.start()
+    client.get("/fhir/Patient").data
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:>12}: {elapsed * 1000:8.2f} ms/request, "
+        f"peak {peak / 2**20:7.2f} MiB, body {size / 2**20:.2f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app(testing=True)
+    logging.getLogger().setLevel(logging.WARNING)
+    with StandInServer(body=search_bundle(args.entries)) as hapi, mock.patch(
+        "patientsearch.api.validate_auth", return_value="token"
+    ):
+        app.config["MAP_API"] = hapi.url
+        client = app.test_client()
+        app.config["FHIR_PASSTHROUGH"] = False
+        measure(client, "parse", args.requests)
+        app.config["FHIR_PASSTHROUGH"] = True
+        measure(client, "passthrough", args.requests)
+
+
+if __name__ == "__main__":
+    main()
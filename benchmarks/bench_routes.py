@@ -0,0 +1,166 @@
+"""Latency and throughput of the API routes against upstream stand-ins
+
+Runs the app on a local threaded server, configured as deployed but with
+stand-ins for HAPI, the PDMP facade, Keycloak and the log server, and
+drives each route with ``--concurrency`` clients, reporting p50/p95/p99
+latency and throughput.  Upstream latency and error injection are
+configurable, to baseline behavior with slow or failing dependencies.
+
+Only the browser login is bypassed: the access token comes from the
+request's ``Authorization`` header, and user info from the stand-in's
+userinfo endpoint.
+
+    python benchmarks/bench_routes.py [--latency 0.01] [--pdmp-latency 0.1]
+        [--error-rate 0] [--concurrency 8] [--requests 200]
+        [--routes fhir external_search validate_token]
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import sys
+import threading
+from unittest import mock
+
+from flask import request
+import jwt
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import report, run_load  # noqa: E402
+from benchmarks.standins import (  # noqa: E402
+    hapi_standin,
+    logserver_standin,
+    oidc_client_secrets,
+    oidc_standin,
+    pdmp_standin,
+    STANDIN_USER,
+)
+
+SEARCH = {
+    "subject:Patient.name.given": "luke",
+    "subject:Patient.name.family": "skywalker",
+    "subject:Patient.birthdate": "eq1977-01-12",
+}
+
+ROUTES = {
+    "fhir": (
+        "GET /fhir/Patient",
+        lambda session, url: session.get(
+            url + "fhir/Patient", params={"family": "skywalker"}, timeout=60
+        ),
+    ),
+    "external_search": (
+        "PUT /external_search/Patient",
+        lambda session, url: session.put(
+            url + "external_search/Patient", params=SEARCH, timeout=60
+        ),
+    ),
+    "validate_token": (
+        "GET /validate_token",
+        lambda session, url: session.get(url + "validate_token", timeout=60),
+    ),
+}
+
+
+def access_token():
+    now = datetime.utcnow()
+    claims = dict(
+        STANDIN_USER,
+        iat=now.timestamp(),
+        exp=(now + timedelta(hours=1)).timestamp(),
+        realm_access={"roles": []},
+    )
+    token = jwt.encode(claims, "standin", algorithm="HS256")
+    return token.decode("utf-8") if isinstance(token, bytes) else token
+
+
+def bearer_token():
+    """Access token of the request, in place of the browser login session"""
+    return request.headers["Authorization"].split()[-1]
+
+
+def standin_user_info(userinfo_uri):
+    from patientsearch.models.bearer_auth import BearerAuth
+    from patientsearch.models.http_client import upstream_session
+
+    def lookup_user_info():
+        info = (
+            upstream_session("OIDC")
+            .get(userinfo_uri, auth=BearerAuth(bearer_token()), timeout=30)
+            .json()
+        )
+        return {"username": info["preferred_username"], "DEA": info["DEA"]}
+
+    return lookup_user_info
+
+
+def bench_app(hapi, pdmp, oidc, logserver):
+    """App configured, via its environment, to use the given stand-ins"""
+    secrets = oidc_client_secrets(oidc.url)
+    os.environ.update(
+        SECRET_KEY="standin",
+        MAP_API=hapi.url,
+        EXTERNAL_FHIR_API=pdmp.url,
+        LOGSERVER_URL=logserver.url,
+        LOGSERVER_TOKEN="standin",
+        LOG_LEVEL="WARNING",
+        OIDC_CLIENT_SECRETS=json.dumps(secrets),
+    )
+    from patientsearch import create_app
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    return app, secrets["web"]["userinfo_uri"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--pdmp-latency", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    args = parser.parse_args()
+
+    upstream = {"latency": args.latency, "error_rate": args.error_rate}
+    with hapi_standin(**upstream) as hapi, pdmp_standin(
+        latency=args.pdmp_latency, error_rate=args.error_rate
+    ) as pdmp, oidc_standin(latency=args.latency) as oidc, logserver_standin(
+        latency=args.latency
+    ) as logserver:
+        app, userinfo_uri = bench_app(hapi, pdmp, oidc, logserver)
+        from patientsearch.extensions import oidc as oidc_extension
+
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.port}/"
+        headers = {"Authorization": f"Bearer {access_token()}"}
+
+        with mock.patch.object(
+            oidc_extension, "get_access_token", side_effect=bearer_token
+        ), mock.patch.object(
+            oidc_extension, "get_refresh_token", side_effect=bearer_token
+        ), mock.patch(
+            "patientsearch.api.lookup_user_info",
+            side_effect=standin_user_info(userinfo_uri),
+        ):
+            for name in args.routes:
+                label, call = ROUTES[name]
+
+                def send(session):
+                    session.headers.update(headers)
+                    return call(session, url)
+
+                run_load(send, args.concurrency, args.concurrency)  # warm up
+                print(report(label, run_load(send, args.concurrency, args.requests)))
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
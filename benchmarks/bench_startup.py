@@ -0,0 +1,98 @@
+"""Startup time: importing the app and ``create_app``, as each worker does
+
+Runs ``--runs`` fresh interpreters, each importing ``patientsearch`` and
+creating the app with a production-like environment (no ``REDIS_URL``),
+and reports the median time of each step.  Exits non-zero, for use as a
+regression check, if the median total exceeds ``--max-seconds`` or if any
+of the deferred imports (Redis clients, migration commands) were loaded.
+
+    python benchmarks/bench_startup.py [--runs 10] [--max-seconds 1.0]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.standins import oidc_client_secrets  # noqa: E402
+
+# Modules only needed with REDIS_URL, or by the `flask` command
+DEFERRED = ("redis", "redis_dict", "distutils", "fhir_migrations")
+
+CHILD = f"""
+import json, sys, time
+start = time.perf_counter()
+import patientsearch
+imported = time.perf_counter()
+patientsearch.create_app()
+created = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "create_app": created - imported,
+    "deferred": [name for name in {DEFERRED!r} if name in sys.modules],
+}}))
+"""
+
+
+def startup():
+    """Times of one fresh interpreter's import and create_app"""
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in ("REDIS_URL", "FLASK_RUN_FROM_CLI")
+    }
+    env.update(
+        SECRET_KEY="standin",
+        LOG_LEVEL="WARNING",
+        OIDC_CLIENT_SECRETS=json.dumps(oidc_client_secrets("http://127.0.0.1:1/")),
+        PYTHONPATH=os.pathsep.join(filter(None, (ROOT, os.getenv("PYTHONPATH")))),
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        # not the checkout; filesystem sessions create their directory there
+        cwd=tempfile.gettempdir(),
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    runs = [startup() for _ in range(args.runs)]
+    medians = {
+        step: statistics.median(run[step] for run in runs)
+        for step in ("import", "create_app")
+    }
+    total = sum(medians.values())
+    for step, median in medians.items():
+        print(f"{step:>12}: {median * 1000:7.1f} ms")
+    print(
+        f"{'total':>12}: {total * 1000:7.1f} ms (limit {args.max_seconds * 1000:.0f})"
+    )
+
+    failed = False
+    deferred = sorted({name for run in runs for name in run["deferred"]})
+    if deferred:
+        print(f"imported at startup, but should be deferred: {', '.join(deferred)}")
+        failed = True
+    if total > args.max_seconds:
+        print("startup slower than limit")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
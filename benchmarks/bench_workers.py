@@ -0,0 +1,115 @@
+"""Throughput of gunicorn worker classes against a slow upstream
+
+Runs the app under gunicorn (with the shipped ``gunicorn.conf.py``) once per
+worker class, in front of a local stand-in HAPI answering after
+``--latency`` seconds, and drives ``/fhir/Patient`` with ``--concurrency``
+clients.  With sync workers each slow HAPI call holds a whole process; with
+gthread workers it holds one of ``--threads`` threads.
+
+    python benchmarks/bench_workers.py [--workers 2] [--threads 8]
+        [--latency 0.1] [--concurrency 32] [--requests 400]
+"""
+
+import argparse
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from unittest import mock
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.load import report, run_load  # noqa: E402
+from benchmarks.standins import StandInServer  # noqa: E402
+
+
+def bench_app():
+    """App factory for the gunicorn workers: no auth, HAPI from BENCH_MAP_API"""
+    from patientsearch import create_app
+
+    mock.patch("patientsearch.api.validate_auth", return_value="token").start()
+    app = create_app(testing=True)
+    app.config["MAP_API"] = os.environ["BENCH_MAP_API"]
+    logging.getLogger().setLevel(logging.WARNING)
+    app.logger.setLevel(logging.WARNING)
+    return app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(worker_class, workers, threads, hapi_url):
+    port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        WEB_CONCURRENCY=str(workers),
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_THREADS=str(threads if worker_class != "sync" else 1),
+        BENCH_MAP_API=hapi_url,
+        PYTHONPATH=os.pathsep.join(filter(None, (ROOT, os.getenv("PYTHONPATH")))),
+    )
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from gunicorn.app.wsgiapp import run; run()",
+            "--config",
+            "gunicorn.conf.py",
+            "--log-level",
+            "warning",
+            "benchmarks.bench_workers:bench_app()",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}/"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            requests.get(url + "stats", timeout=5)
+            return process, url
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"gunicorn ({worker_class}) didn't start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--worker-classes", nargs="+", default=["sync", "gthread"])
+    args = parser.parse_args()
+
+    with StandInServer(latency=args.latency) as hapi:
+        for worker_class in args.worker_classes:
+            process, url = start_gunicorn(
+                worker_class, args.workers, args.threads, hapi.url
+            )
+
+            def send(session):
+                return session.get(url + "fhir/Patient", timeout=60)
+
+            try:
+                run_load(send, args.concurrency, args.concurrency)  # warm up
+                result = run_load(send, args.concurrency, args.requests)
+            finally:
+                process.terminate()
+                process.wait()
+            print(report(worker_class, result))
+
+
+if __name__ == "__main__":
+    main()
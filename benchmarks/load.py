@@ -0,0 +1,66 @@
+"""HTTP load driver shared by the benchmarks
+
+Sends a fixed number of requests from a number of concurrent clients, each
+on its own keep-alive session, and summarizes latency percentiles and
+throughput.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import math
+import threading
+import time
+
+import requests
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted, non empty list"""
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def run_load(send, concurrency, count):
+    """Call ``send(session)`` count times, from concurrency threads
+
+    :param send: callable issuing one request on the given
+      ``requests.Session``, returning the response
+    :returns: dict of ``requests``, ``errors`` (non 2xx replies and
+      exceptions), ``throughput`` (per second) and ``p50``, ``p95``,
+      ``p99`` latencies (seconds)
+
+    """
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            ok = send(local.session).ok
+        except requests.exceptions.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(count)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": count,
+        "errors": sum(not ok for _, ok in results),
+        "throughput": count / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def report(label, result):
+    """One line summary of a ``run_load`` result"""
+    return (
+        f"{label:>28}: {result['throughput']:8.1f} requests/s, "
+        f"p50 {result['p50'] * 1000:7.1f} ms, p95 {result['p95'] * 1000:7.1f} ms, "
+        f"p99 {result['p99'] * 1000:7.1f} ms, errors {result['errors']}"
+    )
@@ -0,0 +1,275 @@
+"""Local stand-ins for upstream services, used by the benchmarks
+
+Serve FHIR style JSON over keep-alive HTTP/1.1 from a background thread,
+with optional added latency and injected errors, so benchmarks can exercise
+real sockets without depending on a deployed HAPI, PDMP, Keycloak or log
+server.
+
+``StandInServer`` replies to every request with a fixed body, or with
+whatever its ``responder`` returns; ``hapi_standin``, ``pdmp_standin``,
+``oidc_standin`` and ``logserver_standin`` build servers answering as the
+respective service does, for the requests this app makes.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Claims of the user the OIDC stand-in vouches for
+STANDIN_USER = {
+    "sub": "standin-subject",
+    "preferred_username": "standin",
+    "email": "standin@example.org",
+    "DEA": "AB1234567",
+}
+
+
+def patient(patient_id=None, family="Skywalker", given="Luke"):
+    """Minimal Patient resource"""
+    resource = {
+        "resourceType": "Patient",
+        "name": [{"family": family, "given": [given]}],
+        "birthDate": "1977-01-12",
+    }
+    if patient_id is not None:
+        resource["id"] = str(patient_id)
+        resource["meta"] = {"versionId": "1"}
+    return resource
+
+
+def search_bundle(total=1):
+    """Minimal searchset Bundle, as returned by HAPI"""
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": total,
+        "entry": [{"resource": patient(i)} for i in range(total)],
+    }
+
+
+def operation_outcome(status):
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [
+            {"severity": "error", "code": "exception", "diagnostics": f"{status}"}
+        ],
+    }
+
+
+class StandInServer:
+    """Threaded HTTP server standing in for an upstream service
+
+    :param body: JSON serializable body of every reply, unless a responder
+      is given
+    :param latency: seconds to sleep before each reply
+    :param jitter: up to this many seconds more, uniformly distributed
+    :param error_rate: fraction of requests answered with ``error_status``
+    :param error_status: HTTP status of injected errors
+    :param responder: optional callable ``(method, path, query, payload)``
+      returning the reply body, or a ``(status, body)`` tuple; ``payload``
+      is the parsed JSON request body, or None
+
+    Latency and error settings are plain attributes, and may be changed
+    while the server runs.
+    """
+
+    def __init__(
+        self,
+        body=None,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        error_status=503,
+        responder=None,
+    ):
+        if body is None:
+            body = search_bundle()
+        self.body = json.dumps(body).encode("utf-8")
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.responder = responder
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/"
+
+    def _respond(self, method, path, payload):
+        """Status and encoded body replying to a request"""
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            status = self.error_status
+            return status, json.dumps(operation_outcome(status)).encode("utf-8")
+        if self.responder is None:
+            return 200, self.body
+        parts = urlsplit(path)
+        reply = self.responder(method, parts.path, parts.query, payload)
+        status, body = reply if isinstance(reply, tuple) else (200, reply)
+        return status, json.dumps(body).encode("utf-8")
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # reply headers and body are written separately; avoid Nagle delays
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                standin.connections += 1
+
+            def _reply(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = self.rfile.read(length) if length else None
+                if payload and "json" in self.headers.get("Content-Type", ""):
+                    payload = json.loads(payload)
+                standin.requests += 1
+                delay = standin.latency + random.uniform(0, standin.jitter)
+                if delay:
+                    time.sleep(delay)
+                status, body = standin._respond(self.command, self.path, payload)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/fhir+json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _reply
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _hapi_responder(matches):
+    def respond(method, path, query, payload):
+        parts = [part for part in path.split("/") if part]
+        if method in ("PUT", "POST") and isinstance(payload, dict):
+            if payload.get("resourceType") == "Bundle":
+                return {
+                    "resourceType": "Bundle",
+                    "type": "transaction-response",
+                    "entry": [
+                        {
+                            "response": {"status": "200 OK"},
+                            "resource": dict(
+                                entry.get("resource", {}),
+                                id=str(i),
+                                meta={"versionId": "2"},
+                            ),
+                        }
+                        for i, entry in enumerate(payload.get("entry", []))
+                    ],
+                }
+            resource_id = parts[-1] if method == "PUT" else "1"
+            return (201 if method == "POST" else 200), dict(
+                payload, id=resource_id, meta={"versionId": "2"}
+            )
+        if method == "GET" and len(parts) >= 2 and parts[-2] == "Patient":
+            return patient(parts[-1])
+        return search_bundle(matches)
+
+    return respond
+
+
+def hapi_standin(matches=1, **kwargs):
+    """HAPI (``MAP_API``): searches find ``matches`` Patients, writes echo back
+
+    Reads by id return a Patient with that id; PUT and POST return the
+    resource sent, with an id and version added; transaction Bundles get a
+    transaction-response.
+    """
+    return StandInServer(responder=_hapi_responder(matches), **kwargs)
+
+
+def pdmp_standin(matches=1, **kwargs):
+    """PDMP facade (``EXTERNAL_FHIR_API``): searches find ``matches`` Patients"""
+
+    def respond(method, path, query, payload):
+        bundle = search_bundle(matches)
+        for entry in bundle["entry"]:
+            # external resources carry no local id
+            del entry["resource"]["id"], entry["resource"]["meta"]
+        return bundle
+
+    return StandInServer(responder=respond, **kwargs)
+
+
+def oidc_standin(**kwargs):
+    """Keycloak: token introspection, userinfo, token and logout endpoints
+
+    Every token is active, and belongs to ``STANDIN_USER``.
+    """
+
+    def respond(method, path, query, payload):
+        if path.endswith("/introspect"):
+            return dict(
+                STANDIN_USER,
+                active=True,
+                exp=int(time.time()) + 300,
+                client_id="cosri-patientsearch",
+                scope="openid email",
+            )
+        if path.endswith("/userinfo"):
+            return STANDIN_USER
+        if path.endswith("/token"):
+            return {
+                "access_token": "standin-access",
+                "refresh_token": "standin-refresh",
+                "token_type": "bearer",
+                "expires_in": 300,
+            }
+        return {}
+
+    return StandInServer(responder=respond, **kwargs)
+
+
+def oidc_client_secrets(base_url):
+    """``OIDC_CLIENT_SECRETS`` pointing flask-oidc at an ``oidc_standin``"""
+    realm = base_url + "auth/realms/standin/protocol/openid-connect/"
+    return {
+        "web": {
+            "auth_uri": realm + "auth",
+            "client_id": "cosri-patientsearch",
+            "client_secret": "standin",
+            "issuer": base_url + "auth/realms/standin",
+            "redirect_uris": ["http://localhost:8000/oidc_callback"],
+            "userinfo_uri": realm + "userinfo",
+            "token_uri": realm + "token",
+            "token_introspection_uri": realm + "token/introspect",
+        }
+    }
+
+
+def logserver_standin(**kwargs):
+    """Log server: accepts every POSTed event"""
+    return StandInServer(body={}, **kwargs)
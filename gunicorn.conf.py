@@ -0,0 +1,46 @@
+"""gunicorn settings, overridable from the environment
+
+Workers default to the threaded ``gthread`` class: each worker process
+serves ``GUNICORN_THREADS`` requests at once, so a slow HAPI or PDMP call
+blocks one thread rather than the whole process.  Set
+``GUNICORN_WORKER_CLASS`` to ``sync`` for one request per process.  Other
+worker classes aren't supported: greenlet based ones (gevent, eventlet)
+don't suit the app's asyncio upstream fan out or its sampling profiler.
+The number of processes comes from ``WEB_CONCURRENCY``, as gunicorn's
+default.
+
+Also sets up prometheus_client's multiprocess mode, so ``/metrics`` reports
+all workers.
+"""
+
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class not in ("gthread", "sync"):
+    raise RuntimeError(f"unsupported GUNICORN_WORKER_CLASS: {worker_class}")
+# gunicorn switches sync workers to gthread when given more than one thread
+threads = int(os.getenv("GUNICORN_THREADS", "8" if worker_class == "gthread" else "1"))
+
+# Metrics of all workers are aggregated through files in this directory,
+# prometheus_client's multiprocess mode
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "patientsearch-metrics"),
+)
+
+
+def on_starting(server):
+    """Start without metrics left by a previous run"""
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    """Fold the metrics of an exited worker into the totals"""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -4,10 +4,14 @@ import logging
 from logging import config as logging_config
 import os
 
-from fhir_migrations import commands as migration_commands
 from patientsearch.api import api_blueprint
 from patientsearch.audit import audit_entry, audit_log_init
 from patientsearch.extensions import oidc
+from patientsearch.jsoncodec import AppJSONDecoder, AppJSONEncoder, configure
+from patientsearch.metrics import init_metrics
+from patientsearch.models.cache import RedisStore, redis_connection
+from patientsearch.models.match_rules import init_match_rules
+from patientsearch.profiling import init_profiling
 
 session = Session()
 
@@ -20,6 +24,7 @@ def create_app(testing=False):
     else:
         app = Flask(__name__)
     app.config.from_object("patientsearch.config")
+    configure_redis(app)
     session.init_app(app)
 
     if testing is True:
@@ -44,16 +49,44 @@ def create_app(testing=False):
     if not app.config["SECRET_KEY"]:
         raise RuntimeError("SECRET_KEY not defined; can't continue")
 
+    configure(app.config["JSON_BACKEND"])
+    app.json_encoder = AppJSONEncoder
+    app.json_decoder = AppJSONDecoder
+    init_match_rules(app)
+    init_metrics(app)
+    init_profiling(app)
+
     configure_logging(app)
     oidc.init_app(app)
     app.register_blueprint(api_blueprint)
-    app.register_blueprint(migration_commands.migration_blueprint)
+    if os.getenv("FLASK_RUN_FROM_CLI") == "true":
+        # only the `flask` command needs the migration commands
+        from fhir_migrations import commands as migration_commands
+
+        app.register_blueprint(migration_commands.migration_blueprint)
     return app
 
 
+def configure_redis(app):
+    """Keep sessions and OIDC credentials in Redis, if REDIS_URL is set
+
+    Neither client connects until first used, so workers start even while
+    Redis is unreachable; sessions share the caches' connection pool.
+    """
+    url = app.config.get("REDIS_URL")
+    if not url:
+        return
+    app.config.setdefault("SESSION_REDIS", redis_connection(url))
+    app.config.setdefault(
+        "OIDC_CREDENTIALS_STORE", RedisStore(url, namespace="oidc_store")
+    )
+
+
 def configure_logging(app):
     app.logger  # must call to initialize prior to config or it'll replace
-    logging_config.fileConfig("logging.ini", disable_existing_loggers=False)
+    logging_config.fileConfig(
+        app.config["LOGGING_CONFIG"], disable_existing_loggers=False
+    )
 
     # Overwrite logging.ini if necessary on prod, etc.
     app.logger.setLevel(getattr(logging, app.config["LOG_LEVEL"].upper()))
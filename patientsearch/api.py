@@ -1,7 +1,12 @@
 from datetime import datetime
+import hashlib
+import hmac
 from flask import (
     Blueprint,
+    Response,
     current_app,
+    g,
+    has_app_context,
     jsonify,
     make_response,
     redirect,
@@ -10,25 +15,47 @@ from flask import (
     session,
     send_from_directory,
 )
-from flask.json import JSONEncoder
+from flask.json import dumps as json_dumps
 import jwt
-import requests
 from werkzeug.exceptions import Unauthorized, Forbidden
+from werkzeug.urls import url_decode, url_encode
 from copy import deepcopy
 
 from patientsearch.audit import audit_entry, audit_HAPI_change
 from patientsearch.models import (
     BearerAuth,
+    HAPI_conditional_create,
+    HAPI_read,
     HAPI_request,
+    HAPI_search,
+    HAPI_stream,
     add_identifier_to_resource_type,
     external_request,
+    external_request_async,
+    gather_upstream,
     internal_patient_search,
     new_resource_hook,
-    sync_bundle,
+    patient_as_search_params,
+    sync_bundle_entries,
     restore_patient,
 )
 from patientsearch.extensions import oidc
+from patientsearch.jsoncodec import AppJSONEncoder
 from patientsearch.jsonify_abort import jsonify_abort
+from patientsearch.metrics import metrics_snapshot, timed_auth
+from patientsearch.models.async_upstream import run_upstream
+from patientsearch.models.bundle_transform import assign_ids, transform_bundle
+from patientsearch.models.cache import get_cache
+from patientsearch.models.sync import (
+    HAPI_update,
+    cached_resource,
+    patient_search_key,
+    resource_cache,
+    search_cache,
+)
+from patientsearch.models.http_client import upstream_session
+from patientsearch.models.single_flight import single_flight
+from patientsearch.stats import stats_snapshot
 
 api_blueprint = Blueprint("patientsearch-api", __name__)
 
@@ -47,6 +74,10 @@ def refresh_session():
 def terminate_session():
     """Terminate logged in session; logout without response"""
     token = oidc.user_loggedin and oidc.get_access_token()
+    if token:
+        cache = get_cache("tokens", "TOKEN_CACHE")
+        if cache:
+            cache.delete(token_cache_key(token))
     if token and oidc.validate_token(token):
         # Direct POST to Keycloak necessary to clear KC domain browser cookie
         logout_uri = oidc.client_secrets["userinfo_uri"].replace("userinfo", "logout")
@@ -55,51 +86,126 @@ def terminate_session():
             "client_secret": oidc.client_secrets["client_secret"],
             "refresh_token": oidc.get_refresh_token(),
         }
-        requests.post(logout_uri, auth=BearerAuth(token), data=data, timeout=30)
+        upstream_session("OIDC").post(
+            logout_uri, auth=BearerAuth(token), data=data, timeout=30
+        )
 
     oidc.logout()  # clears local cookie only
     session.clear()
 
 
-def validate_auth():
-    """Verify state of auth token, raise 401 if inadequate
+def token_cache_key(token):
+    """Cache key for given token; a digest, as tokens must never be stored"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
-    :returns: access token, if valid
-    """
-    try:
-        token = oidc.get_access_token()
-    except TypeError:
-        # raised when the token isn't accessible to the oidc lib
-        raise Unauthorized("oidc access token inaccessible")
 
-    if not oidc.validate_token(token):
-        raise Unauthorized(
-            "Your COSRI session timed out. "
-            "Please refresh your browser to enter your user name and password "
-            "to log back in."
+def token_ttl(token, max_age):
+    """Seconds to cache details of given token: until `exp`, at most max_age"""
+    try:
+        claims = jwt.decode(
+            token, options={"verify_signature": False, "verify_aud": False}
         )
+    except jwt.exceptions.DecodeError:
+        return 0
+    expires_in = claims.get("exp", 0) - datetime.now().timestamp()
+    return max(min(expires_in, max_age), 0)
 
-    # Enforce role requirement if set in application config
+
+def role_decision(token):
+    """Check token's roles against REQUIRED_ROLES
+
+    :returns: dict with `authorized` set, and the `roles` found when checked
+    """
     required = current_app.config.get("REQUIRED_ROLES", [])
     if not required:
-        return token
+        return {"authorized": True}
 
     dict_token = jwt.decode(
         token,
         options={"verify_signature": False, "verify_aud": False},
     )
     user_has = dict_token.get("realm_access", {}).get("roles", [])
-    if set(required).intersection(set(user_has)):
+    return {
+        "authorized": bool(set(required).intersection(set(user_has))),
+        "roles": user_has,
+    }
+
+
+def validate_auth():
+    """Verify state of auth token, raise 401 if inadequate
+
+    Successful validations (and the role decision) are cached by token
+    digest when TOKEN_CACHE_TTL is set, until the token's `exp` or the
+    configured maximum age, whichever comes first; sparing a round trip to
+    the token introspection endpoint on every request.
+
+    :returns: access token, if valid
+    """
+    with timed_auth():
+        return _validate_auth()
+
+
+def _validate_auth():
+    try:
+        token = oidc.get_access_token()
+    except TypeError:
+        # raised when the token isn't accessible to the oidc lib
+        raise Unauthorized("oidc access token inaccessible")
+
+    # without credentials there's no token; left to validate_token to reject
+    cache = get_cache("tokens", "TOKEN_CACHE") if token else None
+    decision = cache.get(token_cache_key(token)) if cache else None
+    if decision is None:
+        if not oidc.validate_token(token):
+            raise Unauthorized(
+                "Your COSRI session timed out. "
+                "Please refresh your browser to enter your user name and password "
+                "to log back in."
+            )
+        # Enforce role requirement if set in application config
+        decision = role_decision(token)
+        ttl = token_ttl(token, cache.ttl) if cache else 0
+        if ttl:
+            cache.set(token_cache_key(token), decision, ttl=ttl)
+
+    if decision["authorized"]:
         return token
 
+    required = current_app.config.get("REQUIRED_ROLES", [])
     current_app.logger.warn(
-        f"User's roles: {user_has}  don't include any from REQUIRED_ROLES: {required}"
+        f"User's roles: {decision['roles']}  don't include any from "
+        f"REQUIRED_ROLES: {required}"
     )
     raise Forbidden("User lacks adequate 'role'; can't continue")
 
 
 def current_user_info(token):
-    """Safe wrapper to lookup logged in user's info for DEA and logging"""
+    """Safe wrapper to lookup logged in user's info for DEA and logging
+
+    Memoized per request (on `flask.g`) and, when USER_INFO_CACHE_TTL is
+    set, across requests by token digest until the token's `exp`; saving
+    repeated trips to the OIDC credentials store or userinfo endpoint.
+    """
+    key = token_cache_key(token) if token else None
+    memo = g.setdefault("user_info", {}) if has_app_context() else {}
+    if key in memo:
+        return dict(memo[key])
+
+    cache = get_cache("user_info", "USER_INFO_CACHE") if key else None
+    info = cache.get(key) if cache else None
+    if info is None:
+        info = lookup_user_info()
+        complete = "unknown" not in info.values()
+        ttl = token_ttl(token, cache.ttl) if cache and complete else 0
+        if ttl:
+            cache.set(key, info, ttl=ttl)
+    if key:
+        memo[key] = info
+    return dict(info)
+
+
+def lookup_user_info():
+    """Lookup logged in user's info from the OIDC provider"""
     try:
         username = oidc.user_getfield("preferred_username")
     except Exception:
@@ -139,18 +245,29 @@ def user_info():
     return jsonify(user_info)
 
 
+class SettingsJSONEncoder(AppJSONEncoder):
+    """Encode settings without a JSON representation, i.e. timedelta, as str"""
+
+    def default(self, obj):
+        return str(obj)
+
+
+def jsonify_settings(settings):
+    """``jsonify`` settings, with SettingsJSONEncoder
+
+    The app's encoder is shared by all requests (and threads), so it's passed
+    explicitly rather than swapped on the app.
+    """
+    return current_app.response_class(
+        json_dumps(settings, cls=SettingsJSONEncoder) + "\n",
+        mimetype=current_app.config["JSONIFY_MIMETYPE"],
+    )
+
+
 @api_blueprint.route("/settings", defaults={"config_key": None})
 @api_blueprint.route("/settings/<string:config_key>")
 def config_settings(config_key):
     """Non-secret application settings"""
-
-    # workaround no JSON representation for datetime.timedelta
-    class CustomJSONEncoder(JSONEncoder):
-        def default(self, obj):
-            return str(obj)
-
-    current_app.json_encoder = CustomJSONEncoder
-
     # return selective keys - not all can be be viewed by users, e.g.secret key
     blacklist = ("SECRET", "KEY", "TOKEN", "CREDENTIALS")
 
@@ -161,7 +278,7 @@ def config_settings(config_key):
                 jsonify_abort(
                     status_code=400, messag=f"Configuration key {key} not available"
                 )
-        return jsonify({key: current_app.config.get(key)})
+        return jsonify_settings({key: current_app.config.get(key)})
 
     config_settings = {}
     for key in current_app.config:
@@ -170,7 +287,7 @@ def config_settings(config_key):
             continue
         config_settings[key] = current_app.config.get(key)
 
-    return jsonify(config_settings)
+    return jsonify_settings(config_settings)
 
 
 @api_blueprint.route("/validate_token", methods=["GET"])
@@ -202,6 +319,37 @@ def validate_token():
     )
 
 
+@api_blueprint.route("/stats", defaults={"name": None}, methods=["GET"])
+@api_blueprint.route("/stats/<string:name>", methods=["GET"])
+def stats(name):
+    """Runtime counters for this worker process, such as connection reuse
+
+    :param name: Optional, restrict results to the named stats provider
+    """
+    validate_auth()
+    try:
+        return jsonify(stats_snapshot(name))
+    except KeyError:
+        return jsonify_abort(status_code=404, message=f"no stats named {name}")
+
+
+@api_blueprint.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics, aggregated over all worker processes
+
+    For scrapers rather than users, presenting METRICS_TOKEN as a bearer
+    token; not served unless METRICS_TOKEN is configured.
+    """
+    token = current_app.config.get("METRICS_TOKEN")
+    if not token:
+        return jsonify_abort(status_code=404, message="Metrics not configured")
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+        return jsonify_abort(status_code=401, message="Unauthorized")
+    body, content_type = metrics_snapshot()
+    return Response(body, content_type=content_type)
+
+
 @api_blueprint.route("/favicon.ico")
 def favicon():
     favicon = "_".join((current_app.config.get("PROJECT_NAME"), "favicon.ico"))
@@ -225,11 +373,42 @@ def bundle_getpages():
     """
     token = validate_auth()
     try:
+        if current_app.config.get("FHIR_PASSTHROUGH"):
+            return passthrough(HAPI_stream(token=token, params=request.args))
         return jsonify(HAPI_request(token=token, method="GET", params=request.args))
     except (RuntimeError, ValueError) as error:
         return jsonify_abort(status_code=400, message=str(error))
 
 
+def passthrough(upstream):
+    """Relay streaming HAPI response to the client, without parsing the body
+
+    Bytes are relayed as received, still compressed when the client
+    accepts HAPI's `Content-Encoding`, otherwise decoded on the fly.
+
+    :param upstream: ``requests.Response`` as returned from ``HAPI_stream``
+    """
+    headers = {}
+    for header in ("Content-Type", "ETag", "Last-Modified"):
+        if header in upstream.headers:
+            headers[header] = upstream.headers[header]
+
+    encoding = upstream.headers.get("Content-Encoding")
+    if not encoding or encoding in request.headers.get("Accept-Encoding", ""):
+        # relay bytes exactly as sent, no decompression
+        body = upstream.raw.stream(64 * 1024, decode_content=False)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if "Content-Length" in upstream.headers:
+            headers["Content-Length"] = upstream.headers["Content-Length"]
+    else:
+        body = upstream.iter_content(64 * 1024)
+
+    response = Response(body, status=upstream.status_code, headers=headers)
+    response.call_on_close(upstream.close)
+    return response
+
+
 @api_blueprint.route("/fhir/<string:resource_type>", methods=["GET"])
 def resource_bundle(resource_type):
     """Query HAPI for resource_type and return as JSON FHIR Bundle
@@ -243,27 +422,145 @@ def resource_bundle(resource_type):
 
     """
     token = validate_auth()
+    params = search_params_from_args(resource_type, request.args)
+
+    try:
+        if current_app.config.get("FHIR_PASSTHROUGH") and not search_cache():
+            return passthrough(
+                HAPI_stream(token=token, resource_type=resource_type, params=params)
+            )
+        return jsonify(
+            HAPI_search(token=token, resource_type=resource_type, params=params)
+        )
+    except (RuntimeError, ValueError) as error:
+        return jsonify_abort(status_code=400, message=str(error))
+
+
+def search_params_from_args(resource_type, args):
+    """Generate HAPI search params from request args, per store configuration
+
+    :param resource_type: The FHIR Resource type, i.e. `Patient`
+    :param args: query string arguments (`MultiDict`) from the client
+    :returns: dictionary of search params to pass to HAPI
+
+    """
     # Check for the store's configurations
     active_patient_flag = current_app.config.get("ACTIVE_PATIENT_FLAG")
-    params = dict(deepcopy(request.args))
+    params = dict(deepcopy(args))
 
     # Override if the search is specifically for inactive objects
-    if request.args.get("inactive_search") in {"true", "1"}:
+    if args.get("inactive_search") in {"true", "1"}:
         del params["inactive_search"]
     elif active_patient_flag and resource_type == "Patient":
         params["active"] = "true"
+    return params
 
+
+def parse_batch_query(query):
+    """Parse relative FHIR URL from a batch, i.e. `Patient?_count=5`
+
+    :returns: tuple (resource_type, resource_id, params)
+    """
+    if not isinstance(query, str):
+        raise ValueError(f"batch query must be a relative URL string: {query}")
+    path, _, query_string = query.partition("?")
+    parts = path.strip("/").split("/")
+    if len(parts) > 2 or not parts[0].isalpha():
+        raise ValueError(f"unsupported batch query: {query}")
+
+    resource_type = parts[0]
+    resource_id = parts[1] if len(parts) == 2 else None
+    args = url_decode(query_string)
+    params = search_params_from_args(resource_type, args) if not resource_id else {}
+    return resource_type, resource_id, params
+
+
+def batch_entry(token, query):
+    """Execute single (GET) query from a batch; return batch-response entry"""
     try:
-        return jsonify(
-            HAPI_request(
-                token=token,
-                method="GET",
-                resource_type=resource_type,
-                params=params,
+        resource_type, resource_id, params = parse_batch_query(query)
+        if resource_id:
+            result = HAPI_read(
+                token=token, resource_type=resource_type, resource_id=resource_id
+            )
+        else:
+            result = HAPI_search(
+                token=token, resource_type=resource_type, params=params
             )
-        )
     except (RuntimeError, ValueError) as error:
-        return jsonify_abort(status_code=400, message=str(error))
+        return {
+            "response": {
+                "status": "400 Bad Request",
+                "outcome": {
+                    "resourceType": "OperationOutcome",
+                    "issue": [
+                        {
+                            "severity": "error",
+                            "code": "processing",
+                            "diagnostics": str(error),
+                        }
+                    ],
+                },
+            }
+        }
+    return {"resource": result, "response": {"status": "200 OK"}}
+
+
+@api_blueprint.route("/fhir/_batch", methods=["POST"])
+def batch():
+    """Execute several FHIR queries in one round trip
+
+    Saves the client a request (and token validation) per query, such as
+    the Patient, Practitioner and CareTeam lookups needed on page load.
+
+    NB not decorated with `@oidc.require_login` as that does an implicit
+    redirect.  Client should watch for 401 and redirect appropriately.
+
+    :param request.body: JSON list of relative FHIR URLs (or an object with
+      the list under `queries`), i.e. ``["Patient?_count=5", "Practitioner/8"]``
+    :returns: FHIR Bundle of type `batch-response`, with one entry per query
+      in the order given; failed queries include an `OperationOutcome`
+
+    """
+    token = validate_auth()
+    body = request.get_json(silent=True)
+    queries = body.get("queries") if isinstance(body, dict) else body
+    if not isinstance(queries, list) or not queries:
+        return jsonify_abort(status_code=400, message="missing list of `queries`")
+    max_queries = current_app.config.get("FHIR_BATCH_MAX_QUERIES")
+    if max_queries and len(queries) > max_queries:
+        return jsonify_abort(
+            status_code=400, message=f"batch limited to {max_queries} queries"
+        )
+
+    if current_app.config.get("FHIR_BATCH_MODE") == "bundle":
+        # Delegate to HAPI as a single FHIR `batch` Bundle
+        try:
+            entries = []
+            for query in queries:
+                resource_type, resource_id, params = parse_batch_query(query)
+                url = "/".join(filter(None, (resource_type, resource_id)))
+                if params:
+                    url = "?".join((url, url_encode(params)))
+                entries.append({"request": {"method": "GET", "url": url}})
+            return jsonify(
+                HAPI_request(
+                    token=token,
+                    method="POST",
+                    resource={
+                        "resourceType": "Bundle",
+                        "type": "batch",
+                        "entry": entries,
+                    },
+                )
+            )
+        except (RuntimeError, ValueError) as error:
+            return jsonify_abort(status_code=400, message=str(error))
+
+    entries = gather_upstream(*(run_upstream(batch_entry, token, q) for q in queries))
+    return jsonify(
+        {"resourceType": "Bundle", "type": "batch-response", "entry": entries}
+    )
 
 
 @api_blueprint.route("/fhir/<string:resource_type>", methods=["POST", "PUT"])
@@ -334,18 +631,18 @@ def update_resource_by_id(resource_type, resource_id):
     active_patient_flag = current_app.config.get("ACTIVE_PATIENT_FLAG")
     params = dict(deepcopy(request.args))  # Necessary on ImmutableMultiDict
     resource = request.get_json()
+    # Current version, when at hand, to PATCH only the difference
+    original = cached_resource(resource_type, resource_id)
 
     # This portion of code is only invoked when restoring a patient
     # and returns 500 error if patient's phone number is already in use
     if resource_type == "Patient" and active_patient_flag:
         try:
             # Get our patient in order to access his phone number
-            patient = HAPI_request(
-                method="GET",
-                resource_type=resource_type,
-                token=token,
-                resource_id=resource_id,
+            patient = HAPI_read(
+                token=token, resource_type=resource_type, resource_id=resource_id
             )
+            original = deepcopy(patient)
             telecom = patient.get("telecom")
             if telecom:
                 # Assuming there is one telecom, looking for phone number among active patients
@@ -413,12 +710,12 @@ def update_resource_by_id(resource_type, resource_id):
                 resource_id=resource_id,
             )
         return jsonify(
-            HAPI_request(
-                method=method,
+            HAPI_update(
+                token=token,
                 resource_type=resource_type,
                 resource_id=resource_id,
                 resource=resource,
-                token=token,
+                original=original,
             )
         )
 
@@ -468,13 +765,14 @@ def resource_by_id(resource_type, resource_id):
     """
     token = validate_auth()
     try:
-        return jsonify(
-            HAPI_request(
-                method="GET",
-                resource_type=resource_type,
-                resource_id=resource_id,
-                token=token,
+        if current_app.config.get("FHIR_PASSTHROUGH") and not resource_cache():
+            return passthrough(
+                HAPI_stream(
+                    token=token, resource_type=resource_type, resource_id=resource_id
+                )
             )
+        return jsonify(
+            HAPI_read(token=token, resource_type=resource_type, resource_id=resource_id)
         )
     except (RuntimeError, ValueError) as error:
         return jsonify_abort(status_code=400, message=str(error))
@@ -529,29 +827,128 @@ def external_search(resource_type):
 
     """
     token = validate_auth()
+    params = dict(deepcopy(request.args))  # Necessary on ImmutableMultiDict
+    if current_app.config.get("ACTIVE_PATIENT_FLAG") and resource_type == "Patient":
+        # Only consider active external patients
+        params["active"] = "true"
+
+    user = current_user_info(token)
+    args = request.args.copy()
+
+    def search():
+        return external_search_outcome(token, resource_type, params, args)
+
+    if current_app.config.get("EXTERNAL_SEARCH_SINGLE_FLIGHT"):
+        # Identical searches in flight (double clicks, several tabs or
+        # clinicians) share one PDMP request and sync
+        key = "|".join(
+            (resource_type, url_encode(params, sort=True), str(user.get("DEA")))
+        )
+        outcome = single_flight(f"external_search:{key}", search)
+    else:
+        outcome = search()
+
+    # Audit for every caller, including those sharing another's search
+    extra = {"tags": ["search"], "patient": dict(args), "user": user}
+    if outcome.get("subject.id"):
+        extra["patient"]["subject.id"] = outcome["subject.id"]
+    for message, level in outcome["audit"]:
+        audit_entry(message, extra=extra, level=level)
+
+    if "error" in outcome:
+        return jsonify_abort(status_code=400, message=outcome["error"])
+    return jsonify(outcome["bundle"])
+
+
+def concurrent_lookup(token, resource_type, params, args):
+    """Request PDMP search and the internal patient search concurrently
+
+    The internal search, for the patient named in the request args, is
+    speculative: it spares a sequential HAPI round trip when the PDMP finds
+    no match, and ``external_search`` looks the patient up by those args.
+    PDMP matches are synced by their own demographics, which seldom yield
+    the same search params (the PDMP's name case, given names, etc. differ
+    from the request's), so those are generally searched afresh.
+
+    :returns: tuple of (PDMP search bundle, prefetched internal searches
+      keyed by ``patient_search_key``)
+
+    """
+    reactivate_patient = current_app.config.get("REACTIVATE_PATIENT")
+    try:
+        patient = resource_from_args(resource_type, args)
+    except ValueError:
+        # not enough for an internal search; as without concurrency
+        return external_request(token, resource_type, params), {}
+
+    external_bundle, internal_bundle = gather_upstream(
+        # the user is only accessible here, on the request thread
+        external_request_async(
+            token, resource_type, params, user_info=current_user_info(token)
+        ),
+        run_upstream(internal_patient_search, token, patient, not reactivate_patient),
+        return_exceptions=True,
+    )
+    if isinstance(external_bundle, Exception):
+        raise external_bundle
+    if isinstance(internal_bundle, Exception):
+        # repeated, raising as usual, should it be needed
+        return external_bundle, {}
+    return external_bundle, {
+        patient_search_key(patient, not reactivate_patient): internal_bundle
+    }
+
+
+def external_search_outcome(token, resource_type, params, args):
+    """Search external source, syncing matches with the internal store
+
+    Implementation of ``external_search``, returning the outcome rather
+    than a response, so concurrent identical searches may share it.
+
+    :param params: search params for the external source
+    :param args: the request's query string arguments
+    :returns: dict with the tagged external search ``bundle``, or an
+      ``error`` message; the ``subject.id`` of the local patient, when
+      synced; and the ``audit`` entries, (message, level) pairs, due for
+      each caller
+
+    """
     active_patient_flag = current_app.config.get("ACTIVE_PATIENT_FLAG")
     reactivate_patient = current_app.config.get("REACTIVATE_PATIENT")
     only_create_patient_if_found_external = current_app.config.get(
         "ONLY_CREATE_PATIENT_IF_FOUND_EXTERNAL"
     )
+    outcome = {"audit": []}
 
-    params = dict(deepcopy(request.args))  # Necessary on ImmutableMultiDict
-    if active_patient_flag and resource_type == "Patient":
-        # Only consider active external patients
-        params["active"] = "true"
+    def abort(message):
+        outcome["error"] = message
+        return outcome
 
-    # Tag any matching results with identifier naming source
+    # Internal lookup, run alongside the PDMP request in concurrent mode
+    prefetched = {}
     try:
-        external_search_bundle = add_identifier_to_resource_type(
-            bundle=external_request(token, resource_type, params),
-            resource_type=resource_type,
-            identifier={
-                "system": "https://github.com/uwcirg/script-fhir-facade",
-                "value": "found",
-            },
-        )
+        if (
+            current_app.config.get("EXTERNAL_SEARCH_CONCURRENT")
+            and resource_type == "Patient"
+        ):
+            external_bundle, prefetched = concurrent_lookup(
+                token, resource_type, params, args
+            )
+        else:
+            external_bundle = external_request(token, resource_type, params)
     except (RuntimeError, ValueError) as error:
-        return jsonify_abort(status_code=400, message=str(error))
+        return abort(str(error))
+
+    # Tag any matching results with identifier naming source
+    external_search_bundle = add_identifier_to_resource_type(
+        bundle=external_bundle,
+        resource_type=resource_type,
+        identifier={
+            "system": "https://github.com/uwcirg/script-fhir-facade",
+            "value": "found",
+        },
+        in_place=True,
+    )
 
     external_match_count = (
         len(external_search_bundle["entry"])
@@ -559,48 +956,78 @@ def external_search(resource_type):
         else 0
     )
 
-    extra = {
-        "tags": ["search"],
-        "patient": dict(request.args.copy()),
-        "user": current_user_info(token),
-    }
-
+    allow_local_creation = not (
+        only_create_patient_if_found_external and not external_match_count
+    )
     if external_match_count:
         # Merge result details with internal resources
         try:
-            local_fhir_patient = sync_bundle(
-                token, external_search_bundle, active_patient_flag
+            synced_patients = sync_bundle_entries(
+                token, external_search_bundle, active_patient_flag, prefetched
             )
         except ValueError:
-            return jsonify_abort(message="Error in local sync", status_code=400)
+            return abort("Error in local sync")
+        local_fhir_patient = synced_patients[0] if synced_patients else None
         if local_fhir_patient:
-            extra["patient"]["subject.id"] = local_fhir_patient["id"]
+            outcome["subject.id"] = local_fhir_patient["id"]
     else:
         # See if local match already exists
-        patient = resource_from_args(resource_type, request.args)
+        patient = resource_from_args(resource_type, args)
+        local_fhir_patient = None
+        created = False
+        search_params = patient_as_search_params(patient, not reactivate_patient)
+        known = prefetched.get(patient_search_key(patient, not reactivate_patient))
+        conditional = (
+            allow_local_creation
+            and search_params
+            and current_app.config.get("CONDITIONAL_PATIENT_WRITES")
+            and not (known and known["total"])
+        )
         try:
-            internal_bundle = internal_patient_search(
-                token, patient, not reactivate_patient
-            )
+            if conditional:
+                # Find or create in one round trip; several matches fall
+                # through to the search below
+                new_patient = new_resource_hook(deepcopy(patient))
+                if active_patient_flag:
+                    new_patient["active"] = True
+                local_fhir_patient, created = HAPI_conditional_create(
+                    token, new_patient, search_params
+                )
+            if local_fhir_patient is None:
+                internal_bundle = internal_patient_search(
+                    token,
+                    patient,
+                    not reactivate_patient,
+                    # conditional create found several matches; search afresh
+                    prefetched=None if conditional else prefetched,
+                )
+                if internal_bundle["total"] > 0:
+                    local_fhir_patient = internal_bundle["entry"][0]["resource"]
+                if internal_bundle["total"] > 1:
+                    outcome["audit"].append(
+                        (
+                            f"found multiple internal matches ({patient}), return first",
+                            "warn",
+                        )
+                    )
         except (RuntimeError, ValueError) as error:
-            return jsonify_abort(status_code=400, message=str(error))
-        local_fhir_patient = None
-        if internal_bundle["total"] > 0:
-            local_fhir_patient = internal_bundle["entry"][0]["resource"]
+            return abort(str(error))
+
+        if created:
+            audit_HAPI_change(
+                user_info=current_user_info(token),
+                method="POST",
+                resource_type="Patient",
+                resource=new_patient,
+            )
+            outcome["audit"].append(
+                ("PDMP search failed; create new patient from search params", "info")
+            )
+        elif local_fhir_patient:
             active = local_fhir_patient.get("active", True)
             if reactivate_patient and not active:
                 local_fhir_patient = restore_patient(token, local_fhir_patient)
 
-        if internal_bundle["total"] > 1:
-            audit_entry(
-                f"found multiple internal matches ({patient}), return first",
-                extra=extra,
-                level="warn",
-            )
-
-    allow_local_creation = not (
-        only_create_patient_if_found_external and not external_match_count
-    )
     if not local_fhir_patient and allow_local_creation:
         # Add at this time in the local (HAPI) store
         try:
@@ -619,23 +1046,27 @@ def external_search(resource_type):
                 token=token, method=method, resource_type="Patient", resource=patient
             )
         except (RuntimeError, ValueError) as error:
-            return jsonify_abort(status_code=400, message=str(error))
-        audit_entry(
-            "PDMP search failed; create new patient from search params", extra=extra
+            return abort(str(error))
+        outcome["audit"].append(
+            ("PDMP search failed; create new patient from search params", "info")
         )
 
     # TODO: handle multiple patient results
     if external_match_count > 1:
-        audit_entry("multiple patients returned from PDMP", extra=extra, level="warn")
+        outcome["audit"].append(("multiple patients returned from PDMP", "warn"))
 
     if external_match_count:
-        external_search_bundle["entry"][0]["resource"].setdefault(
-            "id", local_fhir_patient["id"]
+        # every entry was synchronized; return each with its internal id
+        transform_bundle(
+            external_search_bundle,
+            assign_ids([patient["id"] for patient in synced_patients]),
+            in_place=True,
         )
 
     message = "PDMP found match" if external_match_count else "fEMR found match"
-    audit_entry(message, extra=extra)
-    return jsonify(external_search_bundle)
+    outcome["audit"].append((message, "info"))
+    outcome["bundle"] = external_search_bundle
+    return outcome
 
 
 @api_blueprint.route("/logout", methods=["GET"])
@@ -7,14 +7,21 @@ from flask import current_app, has_app_context
 import logging
 
 from patientsearch.logserverhandler import LogServerHandler
+from patientsearch.stats import register_stats
 
 EVENT_LOG_NAME = "cosri_patientsearch_event_logger"
 
 
 def audit_log_init(app):
     log_server_handler = LogServerHandler(
-        jwt=app.config["LOGSERVER_TOKEN"], url=app.config["LOGSERVER_URL"]
+        jwt=app.config["LOGSERVER_TOKEN"],
+        url=app.config["LOGSERVER_URL"],
+        queue_size=app.config["LOGSERVER_QUEUE_SIZE"],
+        batch_size=app.config["LOGSERVER_BATCH_SIZE"],
+        overflow=app.config["LOGSERVER_OVERFLOW"],
+        flush_interval=app.config["LOGSERVER_FLUSH_INTERVAL"],
     )
+    register_stats("logserver", log_server_handler.stats)
     event_logger = logging.getLogger(EVENT_LOG_NAME)
     event_logger.setLevel(logging.INFO)
     event_logger.addHandler(log_server_handler)
@@ -1,9 +1,6 @@
 import json
 import os
-from urllib.parse import urlparse
-
-import redis
-from redis_dict import RedisDict
+import tempfile
 
 
 def load_json_config(potential_json_string):
@@ -87,22 +84,28 @@ SITE_ID = os.getenv("SITE_ID")
 
 SESSION_TYPE = os.getenv("SESSION_TYPE", "filesystem")
 
+# With REDIS_URL, sessions and OIDC credentials are kept in Redis; the
+# clients are built by create_app, and connect on first use
 REDIS_URL = os.environ.get("REDIS_URL")
 if REDIS_URL:
     SESSION_TYPE = "redis"
-    SESSION_REDIS = redis.from_url(REDIS_URL)
-    parts = urlparse(REDIS_URL)
-    OIDC_CREDENTIALS_STORE = RedisDict(
-        namespace="oidc_store",
-        host=parts.hostname,
-        port=parts.port,
-        db=int(parts.path[1:]),
-    )
 
 STATIC_DIR = os.getenv("STATIC_DIR")
 
 LOGSERVER_TOKEN = os.getenv("LOGSERVER_TOKEN")
 LOGSERVER_URL = os.getenv("LOGSERVER_URL")
+# Audit events are queued, and shipped in batches by a background thread
+LOGSERVER_QUEUE_SIZE = int(os.getenv("LOGSERVER_QUEUE_SIZE", "10000"))
+LOGSERVER_BATCH_SIZE = int(os.getenv("LOGSERVER_BATCH_SIZE", "100"))
+# When the queue is full: "drop_oldest", "drop_newest" or "block" (briefly)
+LOGSERVER_OVERFLOW = os.getenv("LOGSERVER_OVERFLOW", "drop_oldest")
+LOGSERVER_FLUSH_INTERVAL = float(os.getenv("LOGSERVER_FLUSH_INTERVAL", "1.0"))
+
+# logging.config file; defaults to the one shipped in the package, rather
+# than whichever the working directory holds
+LOGGING_CONFIG = os.getenv(
+    "LOGGING_CONFIG", os.path.join(os.path.dirname(__file__), "logging.ini")
+)
 
 # NB log level hardcoded at INFO for logserver
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG").upper()
@@ -144,3 +147,150 @@ REACTIVATE_PATIENT = os.getenv("REACTIVATE_PATIENT", "false").lower() == "true"
 ONLY_CREATE_PATIENT_IF_FOUND_EXTERNAL = (
     os.getenv("ONLY_CREATE_PATIENT_IF_FOUND_EXTERNAL", "false").lower() == "true"
 )
+# Create patients via FHIR conditional create (If-None-Exist on the patient's
+# demographics), finding or creating in one HAPI round trip rather than a
+# search followed by a POST
+CONDITIONAL_PATIENT_WRITES = (
+    os.getenv("CONDITIONAL_PATIENT_WRITES", "false").lower() == "true"
+)
+# Identical external searches in flight at once (same params and DEA) share
+# one PDMP request and sync; across workers too when REDIS_URL is set
+EXTERNAL_SEARCH_SINGLE_FLIGHT = (
+    os.getenv("EXTERNAL_SEARCH_SINGLE_FLIGHT", "false").lower() == "true"
+)
+# Run the internal (HAPI) patient lookup alongside the PDMP request in
+# external searches, rather than after it; costs a speculative HAPI search
+# when the PDMP request fails
+EXTERNAL_SEARCH_CONCURRENT = (
+    os.getenv("EXTERNAL_SEARCH_CONCURRENT", "false").lower() == "true"
+)
+# Rules matching patients, as a JSON list of [path, param, prefix]: search
+# param `param` is `prefix` plus the string at JMESPath `path` in the Patient.
+# Unset uses family, given and birthdate (see models/match_rules.py).  i.e.
+# to also match on SSN, append the rule:
+#   ["identifier[?system=='http://hl7.org/fhir/sid/us-ssn'].value | [0]",
+#    "identifier", "http://hl7.org/fhir/sid/us-ssn|"]
+PATIENT_MATCH_RULES = json.loads(os.getenv("PATIENT_MATCH_RULES", "null"))
+# Answer internal patient lookups from a demographic (family, given,
+# birthDate) index where possible, rather than a HAPI search.  Kept current
+# by this service's writes and a delta scan of HAPI every
+# PATIENT_INDEX_SCAN_INTERVAL seconds (0 disables scanning).  Use the
+# "redis" backend to share one index among workers.
+PATIENT_INDEX = os.getenv("PATIENT_INDEX", "false").lower() == "true"
+PATIENT_INDEX_BACKEND = os.getenv("PATIENT_INDEX_BACKEND", "memory")
+PATIENT_INDEX_SCAN_INTERVAL = float(os.getenv("PATIENT_INDEX_SCAN_INTERVAL", "300"))
+# Have the first scan index every Patient in HAPI, rather than only those
+# written from then on.  Scans use the token of the user whose lookup
+# started them; enable only if every user may read all Patients.
+PATIENT_INDEX_FULL_SCAN = (
+    os.getenv("PATIENT_INDEX_FULL_SCAN", "false").lower() == "true"
+)
+
+# Pooled keep-alive connections to upstream services (HAPI, PDMP, Keycloak)
+# Number of per-host pools cached, and connections kept per host
+UPSTREAM_POOL_CONNECTIONS = int(os.getenv("UPSTREAM_POOL_CONNECTIONS", "10"))
+UPSTREAM_POOL_MAXSIZE = int(os.getenv("UPSTREAM_POOL_MAXSIZE", "10"))
+# Block (rather than open extra, non-pooled connections) when a pool is exhausted
+UPSTREAM_POOL_BLOCK = os.getenv("UPSTREAM_POOL_BLOCK", "false").lower() == "true"
+# Per-host overrides of UPSTREAM_POOL_MAXSIZE, keyed by URL prefix
+UPSTREAM_POOL_HOST_LIMITS = json.loads(os.getenv("UPSTREAM_POOL_HOST_LIMITS", "{}"))
+# Upper bound on concurrent upstream calls per worker, for routes fanning out
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))
+# Circuit breakers on HAPI and the PDMP facade: once UPSTREAM_BREAKER_MIN_CALLS
+# calls within UPSTREAM_BREAKER_WINDOW seconds fail (connection error, timeout or
+# 5xx) at UPSTREAM_BREAKER_FAILURE_RATE or more, calls fail fast for
+# UPSTREAM_BREAKER_RESET_TIMEOUT seconds, then a single probe call decides
+# whether the breaker closes again.  State is reported at `/stats/breakers`
+UPSTREAM_BREAKER = os.getenv("UPSTREAM_BREAKER", "false").lower() == "true"
+UPSTREAM_BREAKER_FAILURE_RATE = float(os.getenv("UPSTREAM_BREAKER_FAILURE_RATE", "0.5"))
+UPSTREAM_BREAKER_MIN_CALLS = int(os.getenv("UPSTREAM_BREAKER_MIN_CALLS", "10"))
+UPSTREAM_BREAKER_WINDOW = float(os.getenv("UPSTREAM_BREAKER_WINDOW", "30"))
+UPSTREAM_BREAKER_RESET_TIMEOUT = float(
+    os.getenv("UPSTREAM_BREAKER_RESET_TIMEOUT", "15")
+)
+# Hedged GETs to the same upstreams: a duplicate request is sent when the first
+# isn't answered within the UPSTREAM_HEDGE_PERCENTILE latency of recent calls
+# (at least UPSTREAM_HEDGE_MIN_DELAY seconds); the first answer is used
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "false").lower() == "true"
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95"))
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.05"))
+# Report time spent on auth, HAPI, PDMP and serialization per request, in a
+# Server-Timing response header; visible to every client, so off by default
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+# Bearer token required of Prometheus scrapers of `/metrics`; not served without
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Sampling profiler: profile PROFILE_SAMPLE_RATE (0-1) of requests, and any
+# request with an `X-Profile-Request` header signed with PROFILE_SECRET (see
+# patientsearch.profiling.profile_header).  Folded stacks are written to
+# PROFILE_DIR, keeping the newest PROFILE_MAX_FILES.  Disabled by default.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SECRET = os.getenv("PROFILE_SECRET")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "patientsearch-profiles")
+)
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+# Execution of `/fhir/_batch` queries: "concurrent" (parallel HAPI GETs) or
+# "bundle" (a single FHIR batch Bundle POSTed to HAPI)
+FHIR_BATCH_MODE = os.getenv("FHIR_BATCH_MODE", "concurrent")
+FHIR_BATCH_MAX_QUERIES = int(os.getenv("FHIR_BATCH_MAX_QUERIES", "20"))
+
+# Read-through cache of individual resources (GET /fhir/<type>/<id>), kept
+# current by writes made through this service.  TTL in seconds, 0 disables.
+# Backend "memory" (per worker LRU, bounded by MAXSIZE) or "redis" (shared).
+# NB writes only update the cache of the worker making them; with several
+# workers use the "redis" backend, or other workers serve the old resource
+# for up to RESOURCE_CACHE_TTL seconds.
+RESOURCE_CACHE_TTL = float(os.getenv("RESOURCE_CACHE_TTL", "0"))
+RESOURCE_CACHE_MAXSIZE = int(os.getenv("RESOURCE_CACHE_MAXSIZE", "1024"))
+RESOURCE_CACHE_BACKEND = os.getenv("RESOURCE_CACHE_BACKEND", "memory")
+
+# Stale-while-revalidate cache of search bundles (GET /fhir/<type>), such as
+# the dashboard's Patient query.  Any write made through this service
+# invalidates all cached searches.  Results are served for SEARCH_CACHE_TTL
+# seconds (0 disables), then served stale for up to SEARCH_CACHE_STALE_TTL
+# more while refreshed in the background.  NB with the "memory" backend and
+# several workers, set REDIS_URL so invalidation reaches every worker.
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "0"))
+SEARCH_CACHE_STALE_TTL = float(os.getenv("SEARCH_CACHE_STALE_TTL", "30"))
+SEARCH_CACHE_MAXSIZE = int(os.getenv("SEARCH_CACHE_MAXSIZE", "256"))
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "memory")
+
+# Cache successful token validations (and role decisions) per token digest,
+# for at most TOKEN_CACHE_TTL seconds and never beyond the token's `exp`;
+# 0 disables, validating every request with the OIDC provider
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "0"))
+TOKEN_CACHE_MAXSIZE = int(os.getenv("TOKEN_CACHE_MAXSIZE", "4096"))
+TOKEN_CACHE_BACKEND = os.getenv("TOKEN_CACHE_BACKEND", "memory")
+
+# Cache user info (username, DEA) per token digest across requests, for at
+# most USER_INFO_CACHE_TTL seconds and never beyond the token's `exp`; 0
+# limits memoization to the current request
+USER_INFO_CACHE_TTL = float(os.getenv("USER_INFO_CACHE_TTL", "0"))
+USER_INFO_CACHE_MAXSIZE = int(os.getenv("USER_INFO_CACHE_MAXSIZE", "4096"))
+USER_INFO_CACHE_BACKEND = os.getenv("USER_INFO_CACHE_BACKEND", "memory")
+
+# Cache PDMP (EXTERNAL_FHIR_API) search results per DEA and search params
+# for PDMP_CACHE_TTL seconds; 0 disables.  Keep short, PDMP data changes.
+# The "redis" backend requires PDMP_CACHE_ENCRYPTION_KEY, a Fernet key
+# (see cryptography.fernet.Fernet.generate_key).  Clients skip the cache
+# with the `nocache` search parameter.
+PDMP_CACHE_TTL = float(os.getenv("PDMP_CACHE_TTL", "0"))
+PDMP_CACHE_MAXSIZE = int(os.getenv("PDMP_CACHE_MAXSIZE", "256"))
+PDMP_CACHE_BACKEND = os.getenv("PDMP_CACHE_BACKEND", "memory")
+PDMP_CACHE_ENCRYPTION_KEY = os.getenv("PDMP_CACHE_ENCRYPTION_KEY")
+
+# Relay HAPI's response bytes for plain FHIR GETs (/fhir, /fhir/<type> and
+# /fhir/<type>/<id>) rather than parsing and re-serializing them.  Not
+# applied where a configured cache needs the parsed result.
+FHIR_PASSTHROUGH = os.getenv("FHIR_PASSTHROUGH", "false").lower() == "true"
+
+# Send updates of existing resources as a minimal JSON Patch where the
+# current version is at hand, rather than PUT of the whole resource; falls
+# back to PUT if HAPI doesn't support PATCH
+FHIR_PATCH_WRITES = os.getenv("FHIR_PATCH_WRITES", "false").lower() == "true"
+
+# JSON encoding/decoding backend: "auto" (orjson when installed), "orjson"
+# or "stdlib"
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
@@ -0,0 +1,102 @@
+"""JSON codec
+
+Single point for JSON encoding and decoding on the hot paths (upstream
+responses, flask responses, audit events).  Uses ``orjson`` when installed,
+falling back to the standard library; select explicitly with
+``JSON_BACKEND`` ("orjson" or "stdlib").
+"""
+
+import json
+import time
+
+from flask.json import JSONDecoder, JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+from patientsearch.metrics import add_timing
+
+BACKENDS = ("orjson", "stdlib")
+_backend = "orjson" if orjson else "stdlib"
+
+
+def configure(backend="auto"):
+    """Select JSON backend: "orjson", "stdlib" or "auto" (best available)"""
+    global _backend
+    if backend == "auto":
+        backend = "orjson" if orjson else "stdlib"
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown JSON_BACKEND: {backend}")
+    if backend == "orjson" and not orjson:
+        raise RuntimeError("JSON_BACKEND orjson requested but not installed")
+    _backend = backend
+
+
+def backend():
+    return _backend
+
+
+def loads(data):
+    """Decode JSON from str or bytes"""
+    if _backend == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumpb(obj, default=None, sort_keys=False):
+    """Encode obj as compact JSON bytes"""
+    if _backend == "orjson":
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except orjson.JSONEncodeError:
+            # i.e. integers beyond 64 bits; let the stdlib have a go
+            pass
+    return json.dumps(
+        obj, default=default, sort_keys=sort_keys, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def dumps(obj, default=None, sort_keys=False):
+    """Encode obj as compact JSON str"""
+    return dumpb(obj, default=default, sort_keys=sort_keys).decode("utf-8")
+
+
+class AppJSONEncoder(JSONEncoder):
+    """Flask JSON encoder delegating to the configured backend
+
+    Types outside JSON (dates, UUIDs) are handled by flask's ``default``, so
+    output matches flask's own encoder.  Falls back to flask's
+    implementation for indented (pretty printed) output.
+    """
+
+    def encode(self, o):
+        start = time.perf_counter()
+        try:
+            return self._encode(o)
+        finally:
+            add_timing("serialize", time.perf_counter() - start)
+
+    def _encode(self, o):
+        if _backend != "orjson" or self.indent is not None:
+            return super().encode(o)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(o, default=self.default, option=option).decode("utf-8")
+        except orjson.JSONEncodeError:
+            return super().encode(o)
+
+
+class AppJSONDecoder(JSONDecoder):
+    """Flask JSON decoder delegating to the configured backend"""
+
+    def decode(self, s, *args, **kwargs):
+        if _backend == "orjson":
+            return orjson.loads(s)
+        return super().decode(s, *args, **kwargs)
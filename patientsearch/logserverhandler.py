@@ -1,35 +1,208 @@
-import json
 import logging
+import os
+import queue
+import threading
+import time
+
 from pythonjsonlogger.jsonlogger import JsonFormatter
-import requests
 from requests.exceptions import RequestException
 
+from patientsearch.jsoncodec import dumps
+from patientsearch.metrics import AUDIT_EMIT_LATENCY, timed_upstream
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+def _serialize(log_record, default=None, cls=None, **kwargs):
+    """JsonFormatter ``json_serializer`` delegating to the JSON codec"""
+    if default is None and cls is not None:
+        default = cls().default
+    return dumps(log_record, default=default)
+
 
 class LogServerHandler(logging.Handler):
-    """Specialized logging handler capable of nesting json and passing auth"""
+    """Specialized logging handler capable of nesting json and passing auth
+
+    Events are queued by ``emit`` and shipped from a background thread, in
+    batches, to the log server's ``/events`` endpoint; a slow or unreachable
+    log server never stalls the request thread.
+
+    :param url: log server base URL
+    :param jwt: bearer token for the log server
+    :param queue_size: maximum events held in memory awaiting shipment
+    :param batch_size: maximum events per POST
+    :param overflow: policy when the queue is full; ``drop_oldest`` or
+      ``drop_newest`` discard an event, ``block`` waits up to
+      ``block_timeout`` seconds for room before dropping the new event
+    :param flush_interval: seconds the shipper waits for more events
+    :param timeout: seconds allowed per POST to the log server
+
+    """
 
-    def __init__(self, url, jwt):
+    def __init__(
+        self,
+        url,
+        jwt,
+        queue_size=10000,
+        batch_size=100,
+        overflow="drop_oldest",
+        flush_interval=1.0,
+        block_timeout=1.0,
+        timeout=30,
+    ):
         super().__init__()
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {overflow}")
         self.jwt = jwt
         self.url = f"{url}/events"
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.counts = {"shipped": 0, "dropped": 0, "failed": 0, "batches": 0}
+        self._counts_lock = threading.Lock()
+        self._shipper = None
+        self._shipper_pid = None
+        self._stop = threading.Event()
         self.setFormatter(
-            JsonFormatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+            JsonFormatter(
+                "%(asctime)s %(name)s %(levelname)s %(message)s",
+                json_serializer=_serialize,
+            )
         )
 
+    def _count(self, key, n=1):
+        with self._counts_lock:
+            self.counts[key] += n
+
+    def stats(self):
+        with self._counts_lock:
+            return dict(self.counts, queue_depth=self.queue.qsize())
+
+    def _ensure_shipper(self):
+        """Start shipper thread; again after fork, as threads don't survive"""
+        pid = os.getpid()
+        if self._shipper_pid == pid and self._shipper.is_alive():
+            return
+        with self.lock:
+            if self._shipper_pid == pid and self._shipper.is_alive():
+                return
+            if self._shipper_pid not in (None, pid):
+                # events queued by the parent belong to the parent
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self._stop.clear()
+            self._shipper = threading.Thread(
+                target=self._ship, name="logserver-shipper", daemon=True
+            )
+            self._shipper_pid = pid
+            self._shipper.start()
+
     def emit(self, record):
-        log_entry = self.format(record)
-        log_entry = {"event": json.loads(log_entry)}
+        with AUDIT_EMIT_LATENCY.time():
+            self._enqueue(record)
+
+    def _enqueue(self, record):
+        # queued as serialized JSON, nested as `event` when shipped
+        try:
+            log_entry = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        self._ensure_shipper()
+        try:
+            if self.overflow == "block":
+                self.queue.put(log_entry, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(log_entry)
+            return
+        except queue.Full:
+            if self.overflow != "drop_oldest":
+                self._count("dropped")
+                return
+
+        # drop_oldest: make room, racing other producers at worst drops one more
+        try:
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self._count("dropped")
+        except queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(log_entry)
+        except queue.Full:
+            self._count("dropped")
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _ship(self):
+        while not (self._stop.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._post(batch)
+                self._count("shipped", len(batch))
+            except RequestException as ex:
+                self._count("failed", len(batch))
+                # bootstrap problems - attempt to log to root logger
+                root_logger = logging.getLogger("root")
+                root_logger.error("error submitting message to logserver: %s", self.url)
+                root_logger.exception(ex)
+            finally:
+                self._count("batches")
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _post(self, batch):
+        from patientsearch.models.http_client import upstream_session
+
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.jwt}",
         }
-        try:
-            response = requests.post(
-                url=self.url, headers=headers, json=log_entry, timeout=30
+        body = "[" + ",".join(f'{{"event":{event}}}' for event in batch) + "]"
+        with timed_upstream("LOGSERVER", "POST", "events") as timing:
+            response = upstream_session("LOGSERVER", config={}).post(
+                url=self.url,
+                headers=headers,
+                data=body.encode("utf-8"),
+                timeout=self.timeout,
             )
-            response.raise_for_status()
-        except RequestException as ex:
-            # bootstrap problems - attempt to log to root logger
-            root_logger = logging.getLogger("root")
-            root_logger.error("error submitting message to logserver: %s", self.url)
-            root_logger.exception(ex)
+            timing["status"] = response.status_code
+        response.raise_for_status()
+
+    def flush(self, timeout=None):
+        """Wait for queued events to ship, up to ``timeout`` seconds
+
+        Called by ``logging.shutdown`` on interpreter exit, when the default
+        timeout of ``flush_interval`` plus one POST timeout applies.
+        """
+        if self._shipper_pid != os.getpid() or not self._shipper.is_alive():
+            return
+        if timeout is None:
+            timeout = self.flush_interval + self.timeout
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.queue.all_tasks_done.wait(remaining)
+
+    def close(self):
+        self.flush()
+        self._stop.set()
+        super().close()
@@ -0,0 +1,199 @@
+"""Metrics
+
+Prometheus latency histograms and counters for routes, upstream calls
+(HAPI, PDMP, log server), token validation and audit event queuing,
+exposed by the ``/metrics`` endpoint, to scrapers presenting
+``METRICS_TOKEN`` (without it configured, the endpoint isn't served).
+
+Under gunicorn each worker process keeps its own metrics; with
+``PROMETHEUS_MULTIPROC_DIR`` set (as ``gunicorn.conf.py`` does) they are
+written there and ``/metrics`` reports the aggregate of all workers
+(``prometheus_client`` multiprocess mode).
+
+Time spent per request on auth, HAPI, PDMP and JSON serialization is also
+reported to the client, in a ``Server-Timing`` response header, when
+``SERVER_TIMING`` is enabled.  Concurrent upstream calls each add their
+full duration, so those may sum to more than the request's total.
+
+Resource types come from request URLs; to keep the number of series
+bounded, upstream calls are labelled with theirs only once the upstream
+has answered a request for that type successfully, and ``other`` until then.
+"""
+
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+from flask import has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from requests.exceptions import RequestException
+
+# Upstream calls time out after 30 seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Label of resource types an upstream hasn't (yet) served
+OTHER_RESOURCE_TYPE = "other"
+
+# Server-Timing metric names, in header order, and the upstreams timed as such
+SERVER_TIMINGS = ("auth", "hapi", "pdmp", "serialize")
+UPSTREAM_TIMINGS = {"MAP_API": "hapi", "EXTERNAL_FHIR_API": "pdmp"}
+
+_START = "patientsearch.metrics.start"
+_TIMINGS = "patientsearch.metrics.timings"
+_lock = threading.Lock()
+# (upstream, resource_type) pairs answered successfully, by this process
+_served = set()
+
+REQUEST_LATENCY = Histogram(
+    "patientsearch_request_duration_seconds",
+    "Time serving requests, by route template",
+    ("route", "method", "status"),
+    buckets=BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "patientsearch_upstream_request_duration_seconds",
+    "Time awaiting upstream responses; status 'error' when none came",
+    ("upstream", "verb", "resource_type", "status"),
+    buckets=BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    "patientsearch_upstream_errors",
+    "Upstream calls failing without a response, by exception",
+    ("upstream", "verb", "resource_type", "error"),
+)
+AUTH_LATENCY = Histogram(
+    "patientsearch_auth_duration_seconds",
+    "Time validating access tokens, by outcome",
+    ("outcome",),
+    buckets=BUCKETS,
+)
+AUDIT_EMIT_LATENCY = Histogram(
+    "patientsearch_audit_emit_duration_seconds",
+    "Time queuing audit events for the log server",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1),
+)
+
+
+def add_timing(name, seconds):
+    """Add seconds to the current request's Server-Timing metric name"""
+    if not has_request_context():
+        return
+    # environ rather than `g`; shared with copies of the request context
+    # running upstream calls in other threads
+    timings = request.environ.setdefault(_TIMINGS, {})
+    with _lock:
+        timings[name] = timings.get(name, 0) + seconds
+
+
+def _resource_type_label(upstream, resource_type, status):
+    """Label for resource_type; OTHER_RESOURCE_TYPE unless served by upstream"""
+    if not resource_type:
+        return ""
+    key = (upstream, resource_type)
+    with _lock:
+        if isinstance(status, int) and status < 400:
+            _served.add(key)
+        return resource_type if key in _served else OTHER_RESOURCE_TYPE
+
+
+@contextmanager
+def timed_upstream(upstream, verb, resource_type=None):
+    """Time an upstream call made within the block
+
+    Yields a dict, in which the block sets ``status`` to the response's
+    status code.  Requests exceptions raised from the block are counted as
+    errors; other exceptions (i.e. invalid arguments) aren't recorded.
+    """
+    outcome = {"status": None}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    except RequestException as error:
+        outcome["status"] = "error"
+        UPSTREAM_ERRORS.labels(
+            upstream,
+            verb,
+            _resource_type_label(upstream, resource_type, None),
+            type(error).__name__,
+        ).inc()
+        raise
+    finally:
+        if outcome["status"] is not None:
+            elapsed = time.perf_counter() - start
+            labels = (
+                upstream,
+                verb,
+                _resource_type_label(upstream, resource_type, outcome["status"]),
+            )
+            UPSTREAM_LATENCY.labels(*labels, str(outcome["status"])).observe(elapsed)
+            if upstream in UPSTREAM_TIMINGS:
+                add_timing(UPSTREAM_TIMINGS[upstream], elapsed)
+
+
+@contextmanager
+def timed_auth():
+    """Time token validation; the outcome is the exception raised, if any"""
+    outcome = "authorized"
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as error:
+        outcome = type(error).__name__.lower()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        AUTH_LATENCY.labels(outcome).observe(elapsed)
+        add_timing("auth", elapsed)
+
+
+def server_timing(total):
+    """Server-Timing header value for the current request"""
+    timings = request.environ.get(_TIMINGS, {})
+    metrics = [
+        f"{name};dur={timings.get(name, 0) * 1000:.1f}" for name in SERVER_TIMINGS
+    ]
+    metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+def init_metrics(app):
+    """Time every request to app, and add Server-Timing headers"""
+
+    @app.before_request
+    def start_request_timer():
+        request.environ[_START] = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = request.environ.get(_START)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_LATENCY.labels(
+            route, request.method, str(response.status_code)
+        ).observe(elapsed)
+        if app.config.get("SERVER_TIMING"):
+            response.headers["Server-Timing"] = server_timing(elapsed)
+        return response
+
+
+def metrics_snapshot():
+    """Current metrics in Prometheus text format, and their content type
+
+    Aggregates all worker processes when in multiprocess mode.
+    """
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
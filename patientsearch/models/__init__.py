@@ -1,21 +1,41 @@
+from .async_upstream import (
+    HAPI_request_async,
+    external_request_async,
+    gather_upstream,
+)
 from .bearer_auth import BearerAuth
 from .sync import (
+    HAPI_conditional_create,
+    HAPI_read,
     HAPI_request,
+    HAPI_search,
+    HAPI_stream,
     add_identifier_to_resource_type,
     external_request,
     internal_patient_search,
     new_resource_hook,
+    patient_as_search_params,
     sync_bundle,
+    sync_bundle_entries,
     restore_patient,
 )
 
 __all__ = [
     "BearerAuth",
+    "HAPI_conditional_create",
+    "HAPI_read",
     "HAPI_request",
+    "HAPI_request_async",
+    "HAPI_search",
+    "HAPI_stream",
     "add_identifier_to_resource_type",
     "external_request",
+    "external_request_async",
+    "gather_upstream",
     "internal_patient_search",
     "new_resource_hook",
+    "patient_as_search_params",
     "sync_bundle",
+    "sync_bundle_entries",
     "restore_patient",
 ]
@@ -0,0 +1,183 @@
+"""Asyncio counterparts of the blocking upstream requests
+
+Awaitable versions of ``HAPI_request`` and ``external_request``, for routes
+needing several upstream calls at once.  The HTTP exchange itself still runs
+on the pooled ``requests`` sessions, dispatched to a bounded per-process
+executor; callers await results, so N independent calls cost roughly the
+slowest one rather than the sum.
+
+Error mapping (``ValueError``/``RuntimeError``) and audit behavior are
+identical to the blocking functions, as those do the actual work.
+
+NB calls run within a copy of the request context, with its own, empty
+``flask.g``; so anything kept there, notably the logged in user flask-oidc
+provides, isn't accessible to them.  The user's info is looked up before
+dispatch, on the request thread, and passed along explicitly.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
+import threading
+
+from flask import (
+    copy_current_request_context,
+    current_app,
+    has_app_context,
+    has_request_context,
+)
+
+from patientsearch.models.sync import HAPI_request, external_request
+from patientsearch.stats import register_stats
+
+DEFAULT_MAX_CONCURRENCY = 16
+
+_lock = threading.Lock()
+_executor = None
+_owner_pid = None
+_in_flight = 0
+_peak_in_flight = 0
+
+
+def upstream_executor():
+    """Return the per-process executor running upstream calls"""
+    global _executor, _owner_pid
+    pid = os.getpid()
+    with _lock:
+        if _executor is None or _owner_pid != pid:
+            max_workers = DEFAULT_MAX_CONCURRENCY
+            if has_app_context():
+                max_workers = int(
+                    current_app.config.get("UPSTREAM_MAX_CONCURRENCY")
+                    or DEFAULT_MAX_CONCURRENCY
+                )
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="upstream"
+            )
+            _owner_pid = pid
+        return _executor
+
+
+def _in_context(fn):
+    """Wrap fn to run within a copy of the caller's flask context
+
+    The copy doesn't share the caller's ``flask.g``; pass what fn needs
+    from it as arguments.
+    """
+    if has_request_context():
+        return copy_current_request_context(fn)
+    if has_app_context():
+        app = current_app._get_current_object()
+
+        def wrapper():
+            with app.app_context():
+                return fn()
+
+        return wrapper
+    return fn
+
+
+def _counted(fn):
+    def wrapper():
+        global _in_flight, _peak_in_flight
+        with _lock:
+            _in_flight += 1
+            _peak_in_flight = max(_peak_in_flight, _in_flight)
+        try:
+            return fn()
+        finally:
+            with _lock:
+                _in_flight -= 1
+
+    return wrapper
+
+
+async def run_upstream(fn, *args, **kwargs):
+    """Await blocking ``fn(*args, **kwargs)`` run on the upstream executor"""
+    call = _counted(_in_context(partial(fn, *args, **kwargs)))
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(upstream_executor(), call)
+
+
+async def HAPI_request_async(
+    token, method, resource_type=None, resource_id=None, resource=None, params=None
+):
+    """Awaitable ``HAPI_request``; same parameters, results and exceptions"""
+    return await run_upstream(
+        HAPI_request,
+        token=token,
+        method=method,
+        resource_type=resource_type,
+        resource_id=resource_id,
+        resource=resource,
+        params=params,
+    )
+
+
+async def external_request_async(token, resource_type, params, user_info=None):
+    """Awaitable ``external_request``; same parameters, results and exceptions
+
+    The logged in user's info, for the DEA sent and the audit, is looked up
+    here, in the caller's context, when not given.
+    """
+    from patientsearch.api import current_user_info
+
+    return await run_upstream(
+        external_request,
+        token=token,
+        resource_type=resource_type,
+        params=params,
+        user_info=user_info or current_user_info(token),
+    )
+
+
+def run_in_background(fn, *args, executor=None, **kwargs):
+    """Run ``fn(*args, **kwargs)`` on the upstream executor, without waiting
+
+    Runs within an app context, as the triggering request may be long gone
+    by the time it executes.  Exceptions are logged, not raised.
+
+    :param executor: executor to run on, rather than the upstream executor
+    :returns: ``concurrent.futures.Future`` of the call
+    """
+    app = current_app._get_current_object()
+
+    def call():
+        with app.app_context():
+            try:
+                return fn(*args, **kwargs)
+            except Exception as error:
+                app.logger.exception(error)
+
+    return (executor or upstream_executor()).submit(_counted(call))
+
+
+def gather_upstream(*awaitables, return_exceptions=False):
+    """Run given awaitables concurrently from blocking code; return results
+
+    Convenience for (synchronous) flask views fanning out to upstreams, i.e.::
+
+        patients, practitioners = gather_upstream(
+            HAPI_request_async(token, "GET", "Patient"),
+            HAPI_request_async(token, "GET", "Practitioner"),
+        )
+
+    :param return_exceptions: as with ``asyncio.gather``, when set, exceptions
+      are returned in place of results rather than raised
+    :returns: list of results, in the order given
+
+    """
+
+    async def gather():
+        return await asyncio.gather(*awaitables, return_exceptions=return_exceptions)
+
+    return asyncio.run(gather())
+
+
+def upstream_concurrency_stats():
+    with _lock:
+        return {"in_flight": _in_flight, "peak_in_flight": _peak_in_flight}
+
+
+register_stats("upstream_concurrency", upstream_concurrency_stats)
@@ -0,0 +1,106 @@
+"""Bundle transformation pipeline
+
+Applies a chain of per-entry transforms to a FHIR Bundle in a single pass,
+without deep copying it.  By default the input is left untouched: only the
+entries (and the parts of their resources) a transform changes are copied,
+everything else is shared with the input.  With ``in_place`` the input is
+modified directly, for bundles nothing else refers to, i.e. freshly parsed
+upstream responses.
+
+A transform is a callable ``transform(index, resource, in_place)``
+returning the resource, or a modified version of it.  Unless ``in_place``,
+it must not modify the given resource, but return a (shallow) copy.
+"""
+
+
+def transform_bundle(bundle, *transforms, in_place=False):
+    """Apply transforms to every entry resource of bundle
+
+    :param transforms: callables, applied in the order given
+    :param in_place: modify bundle rather than returning a new one
+    :returns: the transformed bundle
+
+    """
+    if "entry" not in bundle:
+        return bundle if in_place else dict(bundle)
+
+    entries = bundle["entry"] if in_place else list(bundle["entry"])
+    for index, entry in enumerate(entries):
+        original = entry.get("resource")
+        if original is None:
+            continue
+        resource = original
+        for transform in transforms:
+            resource = transform(index, resource, in_place)
+        if resource is not original:
+            if not in_place:
+                entry = entries[index] = dict(entry)
+            entry["resource"] = resource
+
+    if in_place:
+        return bundle
+    result = dict(bundle)
+    result["entry"] = entries
+    return result
+
+
+def _writable(resource, in_place):
+    return resource if in_place else dict(resource)
+
+
+def tag_identifiers(resource_type, *identifiers):
+    """Transform adding identifiers to resources of type, unless present"""
+
+    def transform(index, resource, in_place):
+        if resource.get("resourceType") != resource_type:
+            return resource
+        existing = resource.get("identifier", [])
+        present = {(i.get("system", ""), i.get("value", "")) for i in existing}
+        missing = [
+            i
+            for i in identifiers
+            if (i.get("system", ""), i.get("value", "")) not in present
+        ]
+        if not missing:
+            return resource
+        resource = _writable(resource, in_place)
+        resource["identifier"] = existing + missing
+        return resource
+
+    return transform
+
+
+def assign_ids(resource_ids, resource_type=None):
+    """Transform setting ids, by entry position, on resources lacking one
+
+    :param resource_ids: ids for the first ``len(resource_ids)`` entries,
+      i.e. those of the matching internal resources
+    :param resource_type: limit to resources of this type
+    """
+
+    def transform(index, resource, in_place):
+        if index >= len(resource_ids) or "id" in resource:
+            return resource
+        if resource_type and resource.get("resourceType") != resource_type:
+            return resource
+        resource = _writable(resource, in_place)
+        resource["id"] = resource_ids[index]
+        return resource
+
+    return transform
+
+
+def strip_fields(*fields, resource_type=None):
+    """Transform removing top level fields, i.e. ``text`` or ``meta``"""
+
+    def transform(index, resource, in_place):
+        if resource_type and resource.get("resourceType") != resource_type:
+            return resource
+        if not any(field in resource for field in fields):
+            return resource
+        resource = _writable(resource, in_place)
+        for field in fields:
+            resource.pop(field, None)
+        return resource
+
+    return transform
@@ -0,0 +1,330 @@
+"""Application side caches of upstream results
+
+Two interchangeable backends with the same small interface (``get``,
+``set``, ``delete``, ``clear``, ``stats``):
+
+- ``TTLCache``: per-process, size bounded LRU with per entry expiry
+- ``RedisCache``: shared by all workers, expiry managed by Redis; size is
+  bounded by the server's ``maxmemory`` / eviction policy
+
+Caches are configured by name prefix, i.e. ``RESOURCE_CACHE_TTL``,
+``RESOURCE_CACHE_MAXSIZE`` and ``RESOURCE_CACHE_BACKEND``, and built lazily
+per application on first use.  A TTL of zero disables the cache.  Redis
+cache values are encrypted (Fernet, from the optional ``cryptography``
+package) when ``<PREFIX>_ENCRYPTION_KEY`` is configured.
+"""
+
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import importlib
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # optional dependency, for encrypted Redis caches
+    Fernet = None
+
+from patientsearch.jsoncodec import dumpb, loads
+from patientsearch.stats import register_stats
+
+_lock = threading.RLock()
+_redis_connections = {}
+
+
+class _LazyModule:
+    """Stand-in for a module, imported on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+# redis (3.x) imports distutils, a quarter second added to every process
+# start; only import it once a Redis URL is actually used
+redis = _LazyModule("redis")
+
+
+def redis_connection(url):
+    """Return lazily connecting, pooled Redis client for the given URL"""
+    with _lock:
+        if url not in _redis_connections:
+            _redis_connections[url] = redis.Redis.from_url(url)
+        return _redis_connections[url]
+
+
+class RedisStore(MutableMapping):
+    """Dict in a Redis namespace (``redis_dict.RedisDict``), built on first use
+
+    Keys and values are strings.  Used for flask-oidc's credentials store,
+    which is configured before Redis need be reachable.
+    """
+
+    def __init__(self, url, namespace):
+        self.url = url
+        self.namespace = namespace
+        self._dict = None
+
+    @property
+    def store(self):
+        with _lock:
+            if self._dict is None:
+                from redis_dict import RedisDict
+
+                pool = redis.ConnectionPool.from_url(self.url, decode_responses=True)
+                self._dict = RedisDict(namespace=self.namespace, connection_pool=pool)
+            return self._dict
+
+    def __getitem__(self, key):
+        return self.store[key]
+
+    def __setitem__(self, key, value):
+        self.store[key] = value
+
+    def __delitem__(self, key):
+        del self.store[key]
+
+    def __contains__(self, key):
+        return key in self.store
+
+    def __iter__(self):
+        return iter(self.store.keys())
+
+    def __len__(self):
+        return len(self.store)
+
+
+def hit_rate(hits, misses):
+    lookups = hits + misses
+    return round(hits / lookups, 3) if lookups else None
+
+
+class TTLCache:
+    """Thread-safe, size bounded LRU cache with per entry expiry"""
+
+    def __init__(self, name, ttl, maxsize=1024):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, record=True):
+        """Return cached value, or None if absent or expired
+
+        :param record: set False to look without counting a hit or miss
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += record
+                return None
+            self._data.move_to_end(key)
+            self.hits += record
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": hit_rate(self.hits, self.misses),
+                "evictions": self.evictions,
+            }
+
+
+class RedisCache:
+    """Cache shared across workers, stored as JSON in a Redis namespace
+
+    Redis errors are logged and treated as cache misses; the cache is an
+    optimization and must never fail the request.
+    """
+
+    def __init__(self, name, ttl, url, encryption_key=None):
+        self.name = name
+        self.ttl = ttl
+        self.prefix = f"patientsearch:{name}:"
+        self.redis = redis_connection(url)
+        self.fernet = Fernet(encryption_key) if encryption_key else None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.errors = 0
+
+    def _error(self, error):
+        with self._lock:
+            self.errors += 1
+        if has_app_context():
+            current_app.logger.warning(f"{self.name} cache unavailable: {error}")
+
+    def get(self, key, record=True):
+        try:
+            value = self.redis.get(self.prefix + key)
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+            value = None
+        if value is not None and self.fernet:
+            try:
+                value = self.fernet.decrypt(value)
+            except InvalidToken:
+                # i.e. written before a key rotation
+                value = None
+        with self._lock:
+            if value is None:
+                self.misses += record
+                return None
+            self.hits += record
+        return loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        value = dumpb(value)
+        if self.fernet:
+            value = self.fernet.encrypt(value)
+        try:
+            self.redis.set(self.prefix + key, value, px=int(ttl * 1000))
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+
+    def delete(self, key):
+        try:
+            self.redis.delete(self.prefix + key)
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+
+    def clear(self):
+        try:
+            for key in self.redis.scan_iter(match=self.prefix + "*"):
+                self.redis.delete(key)
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+
+    def stats(self):
+        return {
+            "backend": "redis",
+            "encrypted": bool(self.fernet),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": hit_rate(self.hits, self.misses),
+            "errors": self.errors,
+        }
+
+
+def get_cache(name, config_prefix, encrypted=False):
+    """Return the named cache for the current app, or None if disabled
+
+    :param name: cache name, used in stats and Redis keys
+    :param config_prefix: prefix of the `_TTL`, `_MAXSIZE`, `_BACKEND` and
+      `_ENCRYPTION_KEY` configuration values, i.e. ``RESOURCE_CACHE``
+    :param encrypted: require encryption of values at rest, i.e. in Redis
+
+    """
+    caches = current_app.extensions.setdefault("patientsearch.caches", {})
+    if name in caches:
+        return caches[name]
+
+    with _lock:
+        if name not in caches:
+            config = current_app.config
+            ttl = float(config.get(f"{config_prefix}_TTL") or 0)
+            cache = None
+            if ttl > 0:
+                if config.get(f"{config_prefix}_BACKEND") == "redis":
+                    if not config.get("REDIS_URL"):
+                        raise RuntimeError(
+                            f"{config_prefix}_BACKEND is redis, without REDIS_URL"
+                        )
+                    key = config.get(f"{config_prefix}_ENCRYPTION_KEY")
+                    if encrypted and not key:
+                        raise RuntimeError(
+                            f"{config_prefix}_BACKEND is redis, without "
+                            f"{config_prefix}_ENCRYPTION_KEY"
+                        )
+                    if key and not Fernet:
+                        raise RuntimeError(
+                            f"{config_prefix}_ENCRYPTION_KEY requires cryptography"
+                        )
+                    cache = RedisCache(name, ttl, config["REDIS_URL"], key)
+                else:
+                    maxsize = int(config.get(f"{config_prefix}_MAXSIZE") or 1024)
+                    cache = TTLCache(name, ttl, maxsize)
+            caches[name] = cache
+    return caches[name]
+
+
+def cache_stats():
+    """Stats of all caches built for the current app"""
+    if not has_app_context():
+        return {}
+    caches = current_app.extensions.get("patientsearch.caches", {})
+    return {name: cache.stats() for name, cache in caches.items() if cache}
+
+
+register_stats("caches", cache_stats)
+
+
+def generation(name):
+    """Current generation number of the named family of cache entries
+
+    Generations invalidate many entries at once: callers include the
+    generation in their cache keys, and ``bump_generation`` orphans every
+    entry built with an older one.  Kept in Redis when ``REDIS_URL`` is
+    configured, so a bump in one worker is seen by all.
+
+    :returns: generation number, or None if it can't be determined (the
+      caller should bypass its cache)
+
+    """
+    url = current_app.config.get("REDIS_URL")
+    if url:
+        try:
+            return int(
+                redis_connection(url).get(f"patientsearch:generation:{name}") or 0
+            )
+        except redis.exceptions.RedisError as error:
+            current_app.logger.warning(f"{name} generation unavailable: {error}")
+            return None
+    generations = current_app.extensions.setdefault("patientsearch.generations", {})
+    return generations.get(name, 0)
+
+
+def bump_generation(name):
+    """Advance generation of the named family, invalidating all its entries"""
+    url = current_app.config.get("REDIS_URL")
+    if url:
+        try:
+            redis_connection(url).incr(f"patientsearch:generation:{name}")
+            return
+        except redis.exceptions.RedisError as error:
+            # the write itself succeeded; entries age out within their TTL
+            current_app.logger.error(f"failed to invalidate {name}: {error}")
+            return
+    with _lock:
+        generations = current_app.extensions.setdefault("patientsearch.generations", {})
+        generations[name] = generations.get(name, 0) + 1
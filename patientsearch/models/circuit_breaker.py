@@ -0,0 +1,283 @@
+"""Circuit breakers and hedged requests for upstream services
+
+A breaker watches the outcome of calls to one upstream.  Once enough calls
+within a sliding window fail (connection errors, timeouts, 5xx responses),
+it opens and further calls fail immediately with ``CircuitOpenError``
+rather than tying up a worker for the full request timeout.  After a
+cool-off period a single probe call is let through (half-open); its
+outcome closes the breaker again or restarts the cool-off.
+
+Hedging sends a duplicate of a GET that hasn't been answered within a
+percentile of recent latencies, and takes whichever answer comes first.
+
+Both are applied by ``GuardedAdapter``, the transport adapter
+``http_client`` mounts on the sessions of guarded upstreams, so every
+call made through ``upstream_session`` is covered.
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Recent latencies kept, and needed before hedging starts
+HEDGE_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MAX_WORKERS = 32
+
+_lock = threading.Lock()
+_executor = None
+_owner_pid = None
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Call rejected without contacting the upstream, its breaker is open
+
+    A ``ConnectionError``, so callers handle it as they would the upstream
+    being unreachable.
+    """
+
+
+class CircuitBreaker:
+    """Failure rate breaker for one upstream
+
+    :param name: upstream name, used in messages
+    :param failure_rate: fraction of failed calls opening the breaker
+    :param min_calls: calls needed within the window before it may open
+    :param window: seconds of call outcomes considered
+    :param reset_timeout: seconds open before a probe call is let through
+
+    """
+
+    def __init__(
+        self, name, failure_rate=0.5, min_calls=10, window=30, reset_timeout=15
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        self._outcomes = deque()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.opened = self.rejected = 0
+
+    def _prune(self, now):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            _, failed = self._outcomes.popleft()
+            self._failures -= failed
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self._failures = 0
+        self.opened += 1
+
+    def allow(self):
+        """Admit a call, or raise ``CircuitOpenError``
+
+        :returns: True when the call is the half-open probe, its outcome
+          must be passed back to ``record``
+
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.name} circuit open")
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.name} circuit half open, probing")
+                self._probing = True
+                return True
+            return False
+
+    def record(self, failed, probe=False):
+        """Record the outcome of an admitted call
+
+        :param failed: True if the upstream failed the call, None when the
+          call failed for reasons of its own (i.e. an invalid request)
+        :param probe: value returned by ``allow`` for the call
+
+        """
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                self._probing = False
+                if failed:
+                    self._open(now)
+                elif failed is not None:
+                    self.state = CLOSED
+                return
+            if failed is None or self.state != CLOSED:
+                return
+            self._outcomes.append((now, bool(failed)))
+            self._failures += bool(failed)
+            self._prune(now)
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and self._failures >= calls * self.failure_rate:
+                self._open(now)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            calls = len(self._outcomes)
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(self.reset_timeout - (now - self._opened_at), 0)
+            return {
+                "state": self.state,
+                "calls": calls,
+                "failures": self._failures,
+                "failure_rate": round(self._failures / calls, 3) if calls else 0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "retry_in": retry_in,
+            }
+
+
+class Hedge:
+    """Latency tracking deciding when to send a duplicate GET
+
+    :param percentile: latency percentile (of recent calls) after which a
+      duplicate request is sent
+    :param min_delay: lower bound on that delay, in seconds
+
+    """
+
+    def __init__(self, percentile=95, min_delay=0.05):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self._latencies = deque(maxlen=HEDGE_SAMPLES)
+        self._lock = threading.Lock()
+        self.hedged = self.wins = 0
+
+    def observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def count_hedged(self):
+        with self._lock:
+            self.hedged += 1
+
+    def count_win(self):
+        """Count a duplicate request answering before the first"""
+        with self._lock:
+            self.wins += 1
+
+    def delay(self):
+        """Seconds to wait on the first request, None until enough samples"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        index = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
+
+    def stats(self):
+        return {"hedged": self.hedged, "hedge_wins": self.wins, "delay": self.delay()}
+
+
+def hedge_executor():
+    """Return the per-process executor sending hedged requests"""
+    global _executor, _owner_pid
+    pid = os.getpid()
+    with _lock:
+        if _executor is None or _owner_pid != pid:
+            _executor = ThreadPoolExecutor(
+                max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge"
+            )
+            _owner_pid = pid
+        return _executor
+
+
+def _discard(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+class GuardedAdapter(HTTPAdapter):
+    """Transport adapter applying a breaker, and optionally hedging GETs
+
+    :param breaker: ``CircuitBreaker`` of the upstream, may be shared by
+      several adapters, or None
+    :param hedge: ``Hedge`` of the upstream, or None to never hedge
+
+    """
+
+    def __init__(self, breaker=None, hedge=None, **kwargs):
+        self.breaker = breaker
+        self.hedge = hedge
+        super().__init__(**kwargs)
+
+    def _attempt(self, request, kwargs, probe=False):
+        start = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if self.breaker:
+                self.breaker.record(True, probe)
+            raise
+        except Exception:
+            if self.breaker:
+                self.breaker.record(None, probe)
+            raise
+        failed = response.status_code >= 500
+        if self.breaker:
+            self.breaker.record(failed, probe)
+        if self.hedge and not failed:
+            self.hedge.observe(time.monotonic() - start)
+        return response
+
+    def send(self, request, **kwargs):
+        probe = self.breaker.allow() if self.breaker else False
+        if self.hedge and request.method == "GET" and not probe:
+            delay = self.hedge.delay()
+            if delay is not None:
+                return self._hedged(request, kwargs, delay)
+        return self._attempt(request, kwargs, probe)
+
+    def _hedged(self, request, kwargs, delay):
+        executor = hedge_executor()
+        primary = executor.submit(self._attempt, request, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        self.hedge.count_hedged()
+        hedge = executor.submit(self._attempt, request.copy(), kwargs)
+        pending = {primary, hedge}
+        winner = error = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                elif winner is None:
+                    winner = future
+                else:
+                    future.result().close()
+        # the slower response is closed once it arrives
+        for future in pending:
+            future.add_done_callback(_discard)
+        if winner is None:
+            raise error
+        if winner is hedge:
+            self.hedge.count_win()
+        return winner.result()
@@ -0,0 +1,183 @@
+"""Pooled keep-alive HTTP sessions for upstream services
+
+Each named upstream (``MAP_API``, ``EXTERNAL_FHIR_API``, ``OIDC``,
+``LOGSERVER``) gets one ``requests.Session`` per worker process, so
+consecutive calls reuse established TCP/TLS connections rather than
+opening a new one per request.  Sessions are shared by all threads of the
+process (threaded gunicorn workers, the upstream executor); they're fully
+mounted before being handed out, and never modified after.  Nor do they
+keep cookies: one set in reply to one user's request would be sent on
+every other's.
+
+Sessions of ``GUARDED_UPSTREAMS`` may also get a circuit breaker and
+hedged GETs, see ``circuit_breaker``.
+"""
+
+from http.cookiejar import DefaultCookiePolicy
+import os
+import threading
+
+from flask import current_app, has_app_context
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from patientsearch.models.circuit_breaker import CircuitBreaker, GuardedAdapter, Hedge
+from patientsearch.stats import register_stats
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+# Upstreams eligible for circuit breakers and hedging
+GUARDED_UPSTREAMS = ("MAP_API", "EXTERNAL_FHIR_API")
+
+_lock = threading.Lock()
+_sessions = {}
+_owner_pid = None
+
+
+def _pool_config(config):
+    if config is None:
+        config = current_app.config if has_app_context() else {}
+    return {
+        "pool_connections": int(
+            config.get("UPSTREAM_POOL_CONNECTIONS") or DEFAULT_POOL_CONNECTIONS
+        ),
+        "pool_maxsize": int(
+            config.get("UPSTREAM_POOL_MAXSIZE") or DEFAULT_POOL_MAXSIZE
+        ),
+        "pool_block": bool(config.get("UPSTREAM_POOL_BLOCK", False)),
+        "host_limits": config.get("UPSTREAM_POOL_HOST_LIMITS") or {},
+    }
+
+
+def _guard(upstream, config):
+    """Breaker and hedge for the named upstream, each None when not enabled"""
+    if config is None:
+        config = current_app.config if has_app_context() else {}
+    if upstream not in GUARDED_UPSTREAMS:
+        return None, None
+    breaker = hedge = None
+    if config.get("UPSTREAM_BREAKER"):
+        breaker = CircuitBreaker(
+            upstream,
+            failure_rate=float(config.get("UPSTREAM_BREAKER_FAILURE_RATE") or 0.5),
+            min_calls=int(config.get("UPSTREAM_BREAKER_MIN_CALLS") or 10),
+            window=float(config.get("UPSTREAM_BREAKER_WINDOW") or 30),
+            reset_timeout=float(config.get("UPSTREAM_BREAKER_RESET_TIMEOUT") or 15),
+        )
+    if config.get("UPSTREAM_HEDGE"):
+        hedge = Hedge(
+            percentile=float(config.get("UPSTREAM_HEDGE_PERCENTILE") or 95),
+            min_delay=float(config.get("UPSTREAM_HEDGE_MIN_DELAY") or 0),
+        )
+    return breaker, hedge
+
+
+def _build_session(upstream, config):
+    settings = _pool_config(config)
+    breaker, hedge = _guard(upstream, config)
+
+    def adapter(**kwargs):
+        if breaker or hedge:
+            return GuardedAdapter(breaker=breaker, hedge=hedge, **kwargs)
+        return HTTPAdapter(**kwargs)
+
+    session = Session()
+    # shared by all users; accept and send no cookies
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    default = adapter(
+        pool_connections=settings["pool_connections"],
+        pool_maxsize=settings["pool_maxsize"],
+        pool_block=settings["pool_block"],
+    )
+    session.mount("http://", default)
+    session.mount("https://", default)
+
+    # Dedicated adapters for hosts with their own connection limit, keyed by
+    # URL prefix, i.e. {"https://hapi.example.org/": 20}
+    for prefix, maxsize in settings["host_limits"].items():
+        session.mount(
+            prefix,
+            adapter(
+                pool_connections=1,
+                pool_maxsize=int(maxsize),
+                pool_block=settings["pool_block"],
+            ),
+        )
+    return session
+
+
+def upstream_session(upstream, config=None):
+    """Return the pooled session for the named upstream
+
+    Sessions are created lazily on first use, and discarded if the process
+    forked since (i.e. gunicorn preload), as pooled sockets can't be shared
+    between workers.
+
+    :param upstream: name of upstream, typically its config key, ``MAP_API``
+    :param config: optional mapping to read pool and breaker settings from;
+      defaults to ``current_app.config`` when an app context is available
+
+    """
+    global _owner_pid
+    pid = os.getpid()
+    with _lock:
+        if _owner_pid != pid:
+            _sessions.clear()
+            _owner_pid = pid
+        session = _sessions.get(upstream)
+        if session is None:
+            session = _sessions[upstream] = _build_session(upstream, config)
+        return session
+
+
+def close_sessions():
+    """Close all pooled sessions, releasing their connections"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def connection_stats():
+    """Connection reuse counters for each upstream session in this process
+
+    ``requests`` counts requests sent, ``connections`` counts connections
+    opened; the difference is the number of requests served on a reused
+    (keep-alive) connection.
+    """
+    results = {}
+    with _lock:
+        sessions = list(_sessions.items())
+    for upstream, session in sessions:
+        counts = {"hosts": 0, "requests": 0, "connections": 0}
+        for adapter in set(session.adapters.values()):
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                counts["hosts"] += 1
+                counts["requests"] += pool.num_requests
+                counts["connections"] += pool.num_connections
+        counts["reused"] = max(counts["requests"] - counts["connections"], 0)
+        results[upstream] = counts
+    return results
+
+
+def breaker_stats():
+    """Breaker state and hedging counters of each guarded upstream session"""
+    results = {}
+    with _lock:
+        sessions = list(_sessions.items())
+    for upstream, session in sessions:
+        adapter = session.get_adapter("https://")
+        breaker = getattr(adapter, "breaker", None)
+        hedge = getattr(adapter, "hedge", None)
+        if breaker or hedge:
+            results[upstream] = dict(
+                breaker.stats() if breaker else {}, **(hedge.stats() if hedge else {})
+            )
+    return results
+
+
+register_stats("connections", connection_stats)
+register_stats("breakers", breaker_stats)
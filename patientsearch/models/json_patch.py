@@ -0,0 +1,40 @@
+"""Minimal JSON Patch (RFC 6902) between two JSON documents"""
+
+
+def _pointer(path, token):
+    return f"{path}/{str(token).replace('~', '~0').replace('/', '~1')}"
+
+
+def diff(old, new, path=""):
+    """List of JSON Patch operations transforming old into new
+
+    Objects are compared key by key and equal length arrays element by
+    element; arrays only size at the end get ``add`` operations for the
+    new elements.  Anything else changed is replaced as a whole.
+    """
+    if old == new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": _pointer(path, key)})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": _pointer(path, key), "value": value})
+            else:
+                ops.extend(diff(old[key], value, _pointer(path, key)))
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        if len(old) == len(new):
+            ops = []
+            for index, (before, after) in enumerate(zip(old, new)):
+                ops.extend(diff(before, after, _pointer(path, index)))
+            return ops
+        size = len(old)
+        if size < len(new) and new[:size] == old:
+            return [
+                {"op": "add", "path": _pointer(path, "-"), "value": value}
+                for value in new[size:]
+            ]
+    return [{"op": "replace", "path": path, "value": new}]
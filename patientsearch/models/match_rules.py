@@ -0,0 +1,72 @@
+"""Patient match rules: resource fields identifying a Patient for search
+
+Each rule is a ``(path, param, prefix)`` triple; ``path`` is a JMESPath
+expression into the Patient resource, and a string found there becomes the
+search parameter ``param`` with ``prefix`` prepended.  When several rules
+name the same ``param`` the last match wins, letting rules list fallbacks
+first.
+
+Rules come from ``PATIENT_MATCH_RULES`` and are compiled once, at app
+creation, into a single JMESPath multiselect expression; extracting the
+search params takes one pass over the resource.
+"""
+
+from flask import current_app
+import jmespath
+
+# Note FHIR uses list for 'name' and 'given', common parameter use defines just one
+DEFAULT_MATCH_RULES = (
+    ("name.family", "family", ""),
+    ("name[0].family", "family", ""),
+    ("name.given", "given", ""),
+    ("name.given[0]", "given", ""),
+    ("name[0].given[0]", "given", ""),
+    ("birthDate", "birthdate", "eq"),
+)
+
+# Added when considering only active patients
+ACTIVE_RULE = ("active", "active", "")
+
+
+class MatchRules:
+    """Compiled set of match rules"""
+
+    def __init__(self, rules):
+        self.rules = []
+        for rule in rules:
+            if len(rule) != 3 or not all(isinstance(part, str) for part in rule):
+                raise ValueError(f"match rule not (path, param, prefix): {rule}")
+            self.rules.append(tuple(rule))
+        if not self.rules:
+            raise ValueError("at least one match rule required")
+        self.expression = jmespath.compile(
+            "{"
+            + ", ".join(f"r{i}: {path}" for i, (path, _, _) in enumerate(self.rules))
+            + "}"
+        )
+
+    def search_params(self, resource):
+        """Extract search params from resource, in one pass"""
+        matches = self.expression.search(resource)
+        params = {}
+        for i, (_, param, prefix) in enumerate(self.rules):
+            match = matches[f"r{i}"]
+            if match and isinstance(match, str):
+                params[param] = prefix + match
+        return params
+
+
+def init_match_rules(app):
+    """Compile configured match rules for app; raises on invalid rules"""
+    rules = app.config.get("PATIENT_MATCH_RULES") or DEFAULT_MATCH_RULES
+    app.extensions["patientsearch.match_rules"] = {
+        False: MatchRules(rules),
+        True: MatchRules(list(rules) + [ACTIVE_RULE]),
+    }
+
+
+def match_rules(active_only=False):
+    """Compiled match rules of the current app"""
+    if "patientsearch.match_rules" not in current_app.extensions:
+        init_match_rules(current_app)
+    return current_app.extensions["patientsearch.match_rules"][active_only]
@@ -0,0 +1,418 @@
+"""Demographic blocking index of internal (HAPI) patients
+
+Answers "does this patient exist locally" without a HAPI string search.
+Patients are indexed by a block of normalized family name, first given
+name and birthDate, mapping to the ids (and versionIds) of the Patients
+sharing those demographics.
+
+Patients are found under every given name, but only by exact (case and
+accent insensitive) family and given names; unlike a HAPI string search,
+which also matches by prefix, i.e. ``given=luke`` finding "Lukas".
+
+The index is kept current by this service's writes (see
+``sync._write_through``) and by a periodic ``_lastUpdated`` delta scan of
+HAPI, catching writes made elsewhere.  Only hits are trusted, and each hit
+is confirmed against the resource read back; on a miss or a stale entry
+the caller falls back to searching HAPI.
+
+Scans run in the background, on their own single thread, with the access
+token of the user whose lookup started them.  The first scan indexes every
+Patient only with ``PATIENT_INDEX_FULL_SCAN``, for deployments where every
+user may read all Patients; otherwise it just marks where the delta scans
+start.
+
+Two backends, as with the caches: per-process memory, or Redis (shared
+by all workers) when ``PATIENT_INDEX_BACKEND`` is ``redis``.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import json
+import os
+import threading
+import time
+import unicodedata
+from urllib.parse import parse_qsl, urlsplit
+
+from flask import current_app, has_app_context
+
+from patientsearch.models.cache import redis, redis_connection
+from patientsearch.stats import register_stats
+
+_lock = threading.RLock()
+_scan_executor = None
+_scan_owner_pid = None
+
+# patient_as_search_params() terms answered by the index
+BLOCK_PARAMS = {"family", "given", "birthdate"}
+SCAN_PAGE_SIZE = 500
+
+
+def _normalize(value):
+    """Case and accent insensitive form, as HAPI compares strings"""
+    decomposed = unicodedata.normalize("NFKD", value.strip())
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def demographic_block(family, given, birth_date):
+    """Index key for given demographics, None if any is missing"""
+    if not (family and given and birth_date):
+        return None
+    return "|".join((_normalize(family), _normalize(given), birth_date.strip()))
+
+
+def patient_blocks(patient):
+    """Index keys for a Patient resource, one per family and given name pair
+
+    A patient is found under each of its given names, as a HAPI ``given``
+    search finds it by any of them.
+    """
+    names = patient.get("name") or []
+    if isinstance(names, dict):
+        names = [names]
+    blocks = set()
+    for name in names:
+        given = name.get("given") or []
+        if isinstance(given, str):
+            given = [given]
+        for first in given:
+            block = demographic_block(
+                name.get("family"), first, patient.get("birthDate")
+            )
+            if block:
+                blocks.add(block)
+    return blocks
+
+
+def params_block(params):
+    """Index key for patient search params, None if not answerable by index"""
+    if set(params) != BLOCK_PARAMS or not params["birthdate"].startswith("eq"):
+        return None
+    return demographic_block(params["family"], params["given"], params["birthdate"][2:])
+
+
+def _version(patient):
+    return patient.get("meta", {}).get("versionId", "")
+
+
+class MemoryPatientIndex:
+    """Per-process index"""
+
+    def __init__(self):
+        self._blocks = {}
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._scan_mark = None
+        self._scan_claimed = 0
+        self.hits = self.misses = 0
+
+    def add(self, blocks, patient_id, version):
+        with self._lock:
+            for previous in self._ids.get(patient_id, set()) - blocks:
+                self._blocks.get(previous, {}).pop(patient_id, None)
+            for block in blocks:
+                self._blocks.setdefault(block, {})[patient_id] = version
+            self._ids[patient_id] = set(blocks)
+
+    def remove(self, patient_id):
+        with self._lock:
+            for block in self._ids.pop(patient_id, set()):
+                self._blocks.get(block, {}).pop(patient_id, None)
+
+    def lookup(self, block):
+        with self._lock:
+            found = dict(self._blocks.get(block, {}))
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    def scan_mark(self):
+        return self._scan_mark
+
+    def set_scan_mark(self, mark):
+        self._scan_mark = mark
+
+    def claim_scan(self, interval):
+        """True if caller should scan now; at most one per interval"""
+        with self._lock:
+            now = time.monotonic()
+            if self._scan_claimed and now - self._scan_claimed < interval:
+                return False
+            self._scan_claimed = now
+            return True
+
+    def stats(self):
+        with self._lock:
+            size = len(self._ids)
+        return {
+            "backend": "memory",
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "scanned_through": self._scan_mark,
+        }
+
+
+class RedisPatientIndex:
+    """Index shared by all workers
+
+    One hash per block (id -> versionId) plus a hash of id -> blocks (a
+    JSON list), to move patients whose demographics change.  Redis errors
+    are logged and treated as misses.
+    """
+
+    def __init__(self, url):
+        self.redis = redis_connection(url)
+        self.prefix = "patientsearch:patient_index:"
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.errors = 0
+
+    def _error(self, error):
+        with self._lock:
+            self.errors += 1
+        if has_app_context():
+            current_app.logger.warning(f"patient index unavailable: {error}")
+
+    def _blocks_of(self, patient_id):
+        blocks = self.redis.hget(self.prefix + "ids", patient_id)
+        return set(json.loads(blocks)) if blocks else set()
+
+    def add(self, blocks, patient_id, version):
+        try:
+            previous = self._blocks_of(patient_id)
+            pipe = self.redis.pipeline()
+            for block in previous - blocks:
+                pipe.hdel(self.prefix + "block:" + block, patient_id)
+            for block in blocks:
+                pipe.hset(self.prefix + "block:" + block, patient_id, version)
+            pipe.hset(self.prefix + "ids", patient_id, json.dumps(sorted(blocks)))
+            pipe.execute()
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+
+    def remove(self, patient_id):
+        try:
+            for block in self._blocks_of(patient_id):
+                self.redis.hdel(self.prefix + "block:" + block, patient_id)
+            self.redis.hdel(self.prefix + "ids", patient_id)
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+
+    def lookup(self, block):
+        try:
+            found = self.redis.hgetall(self.prefix + "block:" + block)
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+            found = {}
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return {k.decode("utf-8"): v.decode("utf-8") for k, v in found.items()}
+
+    def scan_mark(self):
+        try:
+            mark = self.redis.get(self.prefix + "scanned_through")
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+            return None
+        return mark.decode("utf-8") if mark else None
+
+    def set_scan_mark(self, mark):
+        try:
+            self.redis.set(self.prefix + "scanned_through", mark)
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+
+    def claim_scan(self, interval):
+        """True if caller should scan now; one worker per interval"""
+        try:
+            return bool(
+                self.redis.set(
+                    self.prefix + "scan_lock", 1, nx=True, px=int(interval * 1000)
+                )
+            )
+        except redis.exceptions.RedisError as error:
+            self._error(error)
+            return False
+
+    def stats(self):
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "scanned_through": self.scan_mark(),
+        }
+
+
+def patient_index():
+    """Return the patient index for the current app, None if disabled"""
+    extensions = current_app.extensions
+    if "patientsearch.patient_index" in extensions:
+        return extensions["patientsearch.patient_index"]
+
+    with _lock:
+        if "patientsearch.patient_index" not in extensions:
+            config = current_app.config
+            index = None
+            if config.get("PATIENT_INDEX"):
+                if config.get("PATIENT_INDEX_BACKEND") == "redis":
+                    if not config.get("REDIS_URL"):
+                        raise RuntimeError(
+                            "PATIENT_INDEX_BACKEND is redis, without REDIS_URL"
+                        )
+                    index = RedisPatientIndex(config["REDIS_URL"])
+                else:
+                    index = MemoryPatientIndex()
+            extensions["patientsearch.patient_index"] = index
+    return extensions["patientsearch.patient_index"]
+
+
+def index_patient(patient):
+    """Add or move given Patient in the index, if enabled"""
+    index = patient_index()
+    if not index or not patient.get("id"):
+        return
+    blocks = patient_blocks(patient)
+    if blocks:
+        index.add(blocks, patient["id"], _version(patient))
+    else:
+        index.remove(patient["id"])
+
+
+def unindex_patient(patient_id):
+    """Drop given Patient id from the index, if enabled"""
+    index = patient_index()
+    if index:
+        index.remove(patient_id)
+
+
+def scan_executor():
+    """Return the per-process executor running index scans, one at a time
+
+    Apart from the upstream executor, so a long scan never holds threads
+    requests are waiting on.
+    """
+    global _scan_executor, _scan_owner_pid
+    pid = os.getpid()
+    with _lock:
+        if _scan_executor is None or _scan_owner_pid != pid:
+            _scan_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="patient_index_scan"
+            )
+            _scan_owner_pid = pid
+        return _scan_executor
+
+
+def scan(token):
+    """Index Patients changed in HAPI since the previous scan
+
+    Pages through ``Patient?_lastUpdated=ge<mark>``, where mark is the
+    latest ``meta.lastUpdated`` seen so far.  The first scan indexes all
+    Patients with ``PATIENT_INDEX_FULL_SCAN``, else only marks the time.
+    """
+    from patientsearch.models.sync import HAPI_request
+
+    index = patient_index()
+    mark = index.scan_mark()
+    if not mark and not current_app.config.get("PATIENT_INDEX_FULL_SCAN"):
+        index.set_scan_mark(datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+        return
+    params = {"_count": SCAN_PAGE_SIZE}
+    if mark:
+        params["_lastUpdated"] = f"ge{mark}"
+    bundle = HAPI_request(
+        token=token, method="GET", resource_type="Patient", params=params
+    )
+    while True:
+        for entry in bundle.get("entry", []):
+            patient = entry.get("resource", {})
+            if patient.get("resourceType") != "Patient":
+                continue
+            index_patient(patient)
+            updated = patient.get("meta", {}).get("lastUpdated")
+            if updated and (mark is None or updated > mark):
+                mark = updated
+        next_url = next(
+            (
+                link["url"]
+                for link in bundle.get("link", [])
+                if link["relation"] == "next"
+            ),
+            None,
+        )
+        if not next_url:
+            break
+        bundle = HAPI_request(
+            token=token, method="GET", params=dict(parse_qsl(urlsplit(next_url).query))
+        )
+    if mark:
+        index.set_scan_mark(mark)
+
+
+def lookup(token, params):
+    """Internal patient search Bundle answered by the index
+
+    Starts a background delta scan when one is due.
+
+    :param params: search params, from ``patient_as_search_params``
+    :returns: searchset Bundle of the matching Patients, or None when the
+      index can't answer (disabled, miss, or stale) and HAPI must be searched
+
+    """
+    from patientsearch.models.async_upstream import run_in_background
+    from patientsearch.models.sync import HAPI_read
+
+    index = patient_index()
+    if not index:
+        return None
+    interval = current_app.config.get("PATIENT_INDEX_SCAN_INTERVAL") or 0
+    if interval and index.claim_scan(interval):
+        run_in_background(scan, token, executor=scan_executor())
+
+    block = params_block(params)
+    if not block:
+        return None
+    found = index.lookup(block)
+    if not found:
+        return None
+
+    entries = []
+    for patient_id in sorted(found, key=lambda i: (len(i), i)):
+        try:
+            patient = HAPI_read(token, "Patient", patient_id)
+        except ValueError:
+            # i.e. deleted elsewhere
+            index.remove(patient_id)
+            return None
+        if block not in patient_blocks(patient):
+            # demographics changed elsewhere
+            index_patient(patient)
+            return None
+        indexed = found[patient_id]
+        if indexed.isdigit() and _version(patient).isdigit():
+            if int(_version(patient)) < int(indexed):
+                # read served from a stale resource cache
+                return None
+        entries.append({"resource": patient, "search": {"mode": "match"}})
+
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": len(entries),
+        "entry": entries,
+    }
+
+
+def patient_index_stats():
+    if not has_app_context():
+        return {}
+    index = current_app.extensions.get("patientsearch.patient_index")
+    return index.stats() if index else {}
+
+
+register_stats("patient_index", patient_index_stats)
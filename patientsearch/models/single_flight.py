@@ -0,0 +1,146 @@
+"""Single-flight execution of identical concurrent calls
+
+Callers naming the same key while a call is in flight wait for it and
+share its result, rather than repeating the work.  Within a process
+followers wait on the leader's thread; with ``REDIS_URL`` configured,
+followers in other workers wait on a Redis lock held by the leader and
+read the result it publishes.
+
+Only concurrent calls are coalesced, results are not cached beyond the
+flight; results must be JSON serializable to be shared across workers.
+"""
+
+from copy import deepcopy
+import hashlib
+import threading
+import time
+from uuid import uuid4
+
+from flask import current_app
+
+from patientsearch.jsoncodec import dumpb, loads
+from patientsearch.models.cache import redis, redis_connection
+from patientsearch.stats import register_stats
+
+# Seconds a published result remains readable by followers
+RESULT_TTL = 10
+# Seconds between checks by followers in other workers
+POLL_INTERVAL = 0.05
+
+_lock = threading.Lock()
+_flights = {}
+_counts = {"leaders": 0, "followers": 0}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _count(key):
+    with _lock:
+        _counts[key] += 1
+
+
+def single_flight(key, fn, timeout=30):
+    """Call ``fn()``, or share the result of an identical call in flight
+
+    :param key: identifies identical calls
+    :param timeout: seconds to wait on another's call before giving up and
+      calling ``fn`` anyway; also bounds how long the Redis lock is held
+    :returns: result of ``fn``; followers get a copy.  Exceptions raised by
+      the leader are raised in its in-process followers too
+
+    """
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        _count("followers")
+        if not flight.done.wait(timeout):
+            return fn()
+        if flight.error is not None:
+            raise flight.error
+        return deepcopy(flight.result)
+
+    try:
+        url = current_app.config.get("REDIS_URL")
+        if url:
+            flight.result = _redis_flight(url, key, fn, timeout)
+        else:
+            _count("leaders")
+            flight.result = fn()
+        return flight.result
+    except Exception as error:
+        flight.error = error
+        raise
+    finally:
+        with _lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def _redis_flight(url, key, fn, timeout):
+    """Lead, or follow a leader in another worker, via Redis"""
+    connection = redis_connection(url)
+    prefix = "patientsearch:single_flight:" + hashlib.sha256(key.encode()).hexdigest()
+    lock = prefix + ":lock"
+    flight_id = uuid4().hex
+    try:
+        leader = connection.set(lock, flight_id, nx=True, px=int(timeout * 1000))
+        if not leader:
+            flight_id = (connection.get(lock) or b"").decode("utf-8")
+    except redis.exceptions.RedisError as error:
+        current_app.logger.warning(f"single flight unavailable: {error}")
+        _count("leaders")
+        return fn()
+
+    if leader:
+        _count("leaders")
+        try:
+            result = fn()
+            try:
+                connection.set(
+                    f"{prefix}:result:{flight_id}", dumpb(result), px=RESULT_TTL * 1000
+                )
+            except redis.exceptions.RedisError as error:
+                current_app.logger.warning(f"single flight unavailable: {error}")
+            return result
+        finally:
+            try:
+                if connection.get(lock) == flight_id.encode("utf-8"):
+                    connection.delete(lock)
+            except redis.exceptions.RedisError:
+                pass  # expires on its own
+
+    _count("followers")
+    deadline = time.monotonic() + timeout
+    try:
+        while flight_id and time.monotonic() < deadline:
+            value = connection.get(f"{prefix}:result:{flight_id}")
+            if value is not None:
+                return loads(value)
+            if not connection.exists(lock):
+                # one more look; the leader publishes before releasing
+                value = connection.get(f"{prefix}:result:{flight_id}")
+                if value is not None:
+                    return loads(value)
+                break
+            time.sleep(POLL_INTERVAL)
+    except redis.exceptions.RedisError as error:
+        current_app.logger.warning(f"single flight unavailable: {error}")
+    # leader failed, or took too long
+    return fn()
+
+
+def single_flight_stats():
+    with _lock:
+        return dict(_counts, in_flight=len(_flights))
+
+
+register_stats("single_flight", single_flight_stats)
@@ -1,55 +1,47 @@
 """Manages synchronization of Model data, between external and internal stores"""
 
 from copy import deepcopy
+import hashlib
 from json.decoder import JSONDecodeError
+import threading
+import time
+from urllib.parse import urlencode
+from uuid import uuid4
 
 from flask import current_app
-from jmespath import search as json_search
 import requests
 
 from patientsearch.audit import audit_entry, audit_HAPI_change
+from patientsearch.jsoncodec import dumpb, loads
+from patientsearch.metrics import timed_upstream
 from patientsearch.models.bearer_auth import BearerAuth
+from patientsearch.models.bundle_transform import tag_identifiers, transform_bundle
+from patientsearch.models.cache import bump_generation, generation, get_cache
+from patientsearch.models.http_client import upstream_session
+from patientsearch.models.json_patch import diff
+from patientsearch.models.match_rules import match_rules
+from patientsearch.models.patient_index import (
+    index_patient,
+    lookup as index_lookup,
+    unindex_patient,
+)
 
 
-def add_identifier_to_resource_type(bundle, resource_type, identifier):
-    result = deepcopy(bundle)
-    if "entry" not in result:
-        return result
+def add_identifier_to_resource_type(bundle, resource_type, identifier, in_place=False):
+    """Add identifier to each resource of type in bundle, unless present
 
-    for entry in result["entry"]:
-        resource = entry["resource"]
-        if resource.get("resourceType") != resource_type:
-            continue
-        identifiers = resource.get("identifier", [])
-        found = False
-        for i in identifiers:
-            if (
-                i.get("system", "") == identifier.system
-                and i.get("value", "") == identifier.value
-            ):
-                found = True
-                break
-        if not found:
-            identifiers.append(identifier)
-            resource["identifier"] = identifiers
-    return result
-
-
-def HAPI_request(
-    token, method, resource_type=None, resource_id=None, resource=None, params=None
-):
-    """Execute HAPI request on configured system - return JSON
-
-    :param token: validated JWT to include in request for auth
-    :param method: HTTP verb, POST, PUT, GET, DELETE
-    :param resource_type: String naming desired such as ``Patient``
-    :param resource_id: Optional, used when requesting specific resource
-    :param resource: FHIR resource used in PUT/POST
-    :param params: Optional additional search parameters
+    :param in_place: modify given bundle; by default it is left untouched,
+      see ``transform_bundle``
+    :returns: the bundle with identifiers added
 
     """
-    from patientsearch.api import current_user_info
+    return transform_bundle(
+        bundle, tag_identifiers(resource_type, identifier), in_place=in_place
+    )
 
+
+def HAPI_url(resource_type=None, resource_id=None):
+    """Build URL on configured HAPI system for given type and id"""
     url = current_app.config.get("MAP_API")
     if resource_type:
         url = url + resource_type
@@ -58,46 +50,122 @@ def HAPI_request(
         if not resource_type:
             raise ValueError("resource_type required when requesting by id")
         url = "/".join((url, str(resource_id)))
+    return url
 
-    VERB = method.upper()
-    if VERB == "GET":
-        # By default, HAPI caches search results for 60000 milliseconds,
-        # meaning new patients won't immediately appear in results.
-        # Disable caching until we find the need and safe use cases
-        headers = {"Cache-Control": "no-cache"}
-        try:
-            resp = requests.get(
-                url, auth=BearerAuth(token), headers=headers, params=params, timeout=30
+
+def HAPI_stream(token, resource_type=None, resource_id=None, params=None):
+    """Execute HAPI GET, returning the response with its body unread
+
+    For routes relaying HAPI's response unchanged, sparing a JSON decode
+    and re-encode of the body.  The caller must close the response.
+    Raises as ``HAPI_request`` does.
+
+    :returns: ``requests.Response`` opened in streaming mode
+    """
+    url = HAPI_url(resource_type, resource_id)
+    # See HAPI_request regarding Cache-Control
+    headers = {"Cache-Control": "no-cache"}
+    try:
+        with timed_upstream("MAP_API", "GET", resource_type) as timing:
+            resp = upstream_session("MAP_API").get(
+                url,
+                auth=BearerAuth(token),
+                headers=headers,
+                params=params,
+                stream=True,
+                timeout=30,
             )
-        except requests.exceptions.ConnectionError as error:
-            current_app.logger.exception(error)
-            raise RuntimeError("EMR FHIR store inaccessible")
-    elif VERB == "POST":
-        resp = requests.post(
-            url, auth=BearerAuth(token), params=params, json=resource, timeout=30
-        )
-    elif VERB == "PUT":
-        resp = requests.put(
-            url, auth=BearerAuth(token), params=params, json=resource, timeout=30
-        )
-    elif VERB == "DELETE":
-        # Only enable deletion of resource by id
-        if not resource_id:
-            raise ValueError("'resource_id' required for DELETE")
-        resp = requests.delete(url, auth=BearerAuth(token), timeout=30)
-    else:
-        raise ValueError(f"Invalid HTTP method: {method}")
+            timing["status"] = resp.status_code
+    except requests.exceptions.ConnectionError as error:
+        current_app.logger.exception(error)
+        raise RuntimeError("EMR FHIR store inaccessible")
 
     try:
         resp.raise_for_status()
     except requests.exceptions.HTTPError as err:
+        resp.close()
         current_app.logger.exception(err)
         audit_entry(
-            f"Failed HAPI call ({method} {resource_type} {resource_id} {resource} {params}): {err}",
+            f"Failed HAPI call (GET {resource_type} {resource_id} None {params}): {err}",
             extra={"tags": ["Internal", "Exception", resource_type]},
             level="error",
         )
         raise ValueError(err)
+    return resp
+
+
+def HAPI_request(
+    token,
+    method,
+    resource_type=None,
+    resource_id=None,
+    resource=None,
+    params=None,
+    headers=None,
+):
+    """Execute HAPI request on configured system - return JSON
+
+    :param token: validated JWT to include in request for auth
+    :param method: HTTP verb, POST, PUT, GET, DELETE
+    :param resource_type: String naming desired such as ``Patient``
+    :param resource_id: Optional, used when requesting specific resource
+    :param resource: FHIR resource used in PUT/POST
+    :param params: Optional additional search parameters
+    :param headers: Optional additional request headers
+
+    """
+    from patientsearch.api import current_user_info
+
+    url = HAPI_url(resource_type, resource_id)
+    session = upstream_session("MAP_API")
+    headers = dict(headers or {})
+    VERB = method.upper()
+    try:
+        with timed_upstream("MAP_API", VERB, resource_type) as timing:
+            if VERB == "GET":
+                # By default, HAPI caches search results for 60000 milliseconds,
+                # meaning new patients won't immediately appear in results.
+                # Disable caching until we find the need and safe use cases
+                headers.setdefault("Cache-Control", "no-cache")
+                resp = session.get(
+                    url,
+                    auth=BearerAuth(token),
+                    headers=headers,
+                    params=params,
+                    timeout=30,
+                )
+            elif VERB == "POST":
+                resp = session.post(
+                    url,
+                    auth=BearerAuth(token),
+                    headers=headers,
+                    params=params,
+                    json=resource,
+                    timeout=30,
+                )
+            elif VERB == "PUT":
+                resp = session.put(
+                    url,
+                    auth=BearerAuth(token),
+                    headers=headers,
+                    params=params,
+                    json=resource,
+                    timeout=30,
+                )
+            elif VERB == "DELETE":
+                # Only enable deletion of resource by id
+                if not resource_id:
+                    raise ValueError("'resource_id' required for DELETE")
+                resp = session.delete(url, auth=BearerAuth(token), timeout=30)
+            else:
+                raise ValueError(f"Invalid HTTP method: {method}")
+            timing["status"] = resp.status_code
+    except requests.exceptions.ConnectionError as error:
+        # includes CircuitOpenError, when HAPI's breaker is open
+        current_app.logger.exception(error)
+        raise RuntimeError("EMR FHIR store inaccessible")
+
+    _raise_for_status(resp, method, resource_type, resource_id, resource, params)
 
     # Fencing out - too much noise.  All API endpoints should audit when appropriate
     if False and VERB != "GET":
@@ -108,15 +176,364 @@ def HAPI_request(
             resource_type=resource_type,
             resource_id=resource_id,
         )
-    return resp.json()
+    result = loads(resp.content)
+    if VERB != "GET":
+        _write_through(VERB, resource_type, resource_id, resource, result)
+    return result
+
+
+def _raise_for_status(resp, method, resource_type, resource_id, resource, params):
+    """Audit and raise ValueError on failed HAPI response"""
+    try:
+        resp.raise_for_status()
+    except requests.exceptions.HTTPError as err:
+        current_app.logger.exception(err)
+        audit_entry(
+            f"Failed HAPI call ({method} {resource_type} {resource_id} {resource} {params}): {err}",
+            extra={"tags": ["Internal", "Exception", resource_type]},
+            level="error",
+        )
+        raise ValueError(err)
+
+
+def HAPI_conditional_create(token, resource, search_params):
+    """POST resource to HAPI unless a resource matching search_params exists
+
+    FHIR conditional create (``If-None-Exist``); finds or creates in a
+    single round trip.
+
+    :param resource: FHIR resource to create, if no match is found
+    :param search_params: search identifying existing matches, i.e. from
+      ``patient_as_search_params``; must not be empty
+    :returns: tuple of (resource, created) with the created or single
+      matching resource; ``(None, False)`` when several resources match,
+      leaving the caller to resolve the duplicates
+
+    """
+    if not search_params:
+        raise ValueError("conditional create requires search parameters")
+    resource_type = resource["resourceType"]
+    headers = {
+        "If-None-Exist": urlencode(search_params),
+        "Prefer": "return=representation",
+    }
+    try:
+        with timed_upstream("MAP_API", "POST", resource_type) as timing:
+            resp = upstream_session("MAP_API").post(
+                HAPI_url(resource_type),
+                auth=BearerAuth(token),
+                headers=headers,
+                json=resource,
+                timeout=30,
+            )
+            timing["status"] = resp.status_code
+    except requests.exceptions.ConnectionError as error:
+        current_app.logger.exception(error)
+        raise RuntimeError("EMR FHIR store inaccessible")
+    if resp.status_code == 412:
+        # Precondition Failed: more than one match
+        return None, False
+    _raise_for_status(resp, "POST", resource_type, None, resource, search_params)
+
+    created = resp.status_code == 201
+    if resp.content:
+        result = loads(resp.content)
+    else:
+        result = HAPI_read(token, *_location_key(resp.headers["Location"]).split("/"))
+    if created:
+        _write_through("POST", resource_type, None, resource, result)
+    elif resource_type == "Patient":
+        index_patient(result)
+    return result, created
+
+
+# Statuses on PATCH telling the server doesn't support it
+PATCH_UNSUPPORTED = (405, 415, 501)
+# Statuses on PATCH telling the resource changed since read (failed `test`)
+PATCH_CONFLICT = (409, 412, 422)
+_patch_unsupported = set()
+
+
+def HAPI_update(
+    token, resource_type, resource_id, resource, original=None, params=None
+):
+    """Update resource on HAPI, as a minimal JSON Patch when possible
+
+    With ``FHIR_PATCH_WRITES`` configured and the ``original`` resource
+    given, only the difference is sent, as an HTTP PATCH guarded by a
+    ``test`` of the original's versionId.  Falls back to PUT of the whole
+    resource when the server doesn't support PATCH, or when the resource
+    changed since ``original`` was read (as PUT has always overwritten).
+
+    :param resource: resource as it should be stored
+    :param original: resource as last read, without modifications
+    :returns: the updated resource, as ``HAPI_request`` does
+
+    """
+    url = HAPI_url(resource_type, resource_id)
+    if (
+        current_app.config.get("FHIR_PATCH_WRITES")
+        and original
+        and current_app.config.get("MAP_API") not in _patch_unsupported
+    ):
+        ignored = ("meta", "text")
+        patch = diff(
+            {k: v for k, v in original.items() if k not in ignored},
+            {k: v for k, v in resource.items() if k not in ignored},
+        )
+        version = original.get("meta", {}).get("versionId")
+        if patch and version:
+            patch.insert(0, {"op": "test", "path": "/meta/versionId", "value": version})
+            headers = {
+                "Content-Type": "application/json-patch+json",
+                "Prefer": "return=representation",
+            }
+            try:
+                with timed_upstream("MAP_API", "PATCH", resource_type) as timing:
+                    resp = upstream_session("MAP_API").patch(
+                        url,
+                        auth=BearerAuth(token),
+                        headers=headers,
+                        params=params,
+                        data=dumpb(patch),
+                        timeout=30,
+                    )
+                    timing["status"] = resp.status_code
+            except requests.exceptions.ConnectionError as error:
+                current_app.logger.exception(error)
+                raise RuntimeError("EMR FHIR store inaccessible")
+            if resp.status_code in PATCH_UNSUPPORTED:
+                current_app.logger.warning(f"PATCH unsupported ({resp.status_code})")
+                _patch_unsupported.add(current_app.config.get("MAP_API"))
+            elif resp.status_code not in PATCH_CONFLICT:
+                _raise_for_status(
+                    resp, "PATCH", resource_type, resource_id, patch, params
+                )
+                result = loads(resp.content)
+                _write_through("PATCH", resource_type, resource_id, patch, result)
+                return result
+
+    return HAPI_request(
+        token=token,
+        method="PUT",
+        resource_type=resource_type,
+        resource_id=resource_id,
+        resource=resource,
+        params=params,
+    )
+
+
+def resource_cache():
+    """Read-through cache of individual resources, None when disabled"""
+    return get_cache("resources", "RESOURCE_CACHE")
+
+
+def _version(resource):
+    version = resource.get("meta", {}).get("versionId", "")
+    return int(version) if version.isdigit() else 0
+
+
+def cache_resource(resource):
+    """Write given resource through to the resource cache
+
+    Ignored if the cache already holds a newer version, as can happen when
+    responses to concurrent writes arrive out of order.
+    """
+    cache = resource_cache()
+    if not cache or not resource.get("id") or not resource.get("resourceType"):
+        return
+    key = f"{resource['resourceType']}/{resource['id']}"
+    cached = cache.get(key, record=False)
+    if cached and _version(cached) > _version(resource):
+        return
+    cache.set(key, resource)
+
+
+def _read_only_batch(resource):
+    """True if resource is a batch Bundle made up entirely of reads"""
+    return (
+        isinstance(resource, dict)
+        and resource.get("resourceType") == "Bundle"
+        and resource.get("type") == "batch"
+        and all(
+            e.get("request", {}).get("method") == "GET"
+            for e in resource.get("entry", [])
+        )
+    )
+
+
+def _location_key(location):
+    """Cache key, ``type/id``, from a response location (minus any history)"""
+    path = location.split("/_history")[0].rstrip("/")
+    return "/".join(path.split("/")[-2:])
+
+
+def _index_write(method, resource_type, resource_id, result):
+    """Keep the patient index current with writes made through HAPI_request"""
+    if method == "DELETE":
+        if resource_type == "Patient":
+            unindex_patient(resource_id)
+        return
+    if not isinstance(result, dict):
+        return
+    if result.get("resourceType") == "Patient":
+        index_patient(result)
+    elif result.get("type") in ("batch-response", "transaction-response"):
+        for entry in result.get("entry", []):
+            if entry.get("resource", {}).get("resourceType") == "Patient":
+                index_patient(entry["resource"])
+
+
+def _write_through(method, resource_type, resource_id, resource, result):
+    """Keep caches current with writes made through HAPI_request"""
+    if _read_only_batch(resource):
+        return
+    if search_cache():
+        # any write may change any search result, i.e. via _include
+        bump_generation("searches")
+    _index_write(method, resource_type, resource_id, result)
+
+    cache = resource_cache()
+    if not cache:
+        return
+    if isinstance(result, dict) and result.get("type") in (
+        "batch-response",
+        "transaction-response",
+    ):
+        for entry in result.get("entry", []):
+            written = entry.get("resource")
+            if written and written.get("resourceType") != "Bundle":
+                cache_resource(written)
+            elif entry.get("response", {}).get("location"):
+                cache.delete(_location_key(entry["response"]["location"]))
+        return
+    if not resource_type:
+        return
+    if method == "DELETE":
+        cache.delete(f"{resource_type}/{resource_id}")
+    elif isinstance(result, dict) and result.get("resourceType") == resource_type:
+        cache_resource(result)
+    elif resource_id:
+        cache.delete(f"{resource_type}/{resource_id}")
+
+
+def search_cache():
+    """Stale-while-revalidate cache of search bundles, None when disabled"""
+    return get_cache("searches", "SEARCH_CACHE")
 
 
-def external_request(token, resource_type, params):
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+
+def _search_key(resource_type, params):
+    query = urlencode(sorted((params or {}).items()), doseq=True)
+    return f"{resource_type}?{query}"
+
+
+def _cache_search(key, gen, bundle):
+    fresh = current_app.config.get("SEARCH_CACHE_TTL")
+    stale = current_app.config.get("SEARCH_CACHE_STALE_TTL") or 0
+    search_cache().set(
+        f"{gen}:{key}",
+        {"fresh_until": time.time() + fresh, "bundle": bundle},
+        ttl=fresh + stale,
+    )
+
+
+def _revalidate(token, resource_type, params, key, gen):
+    try:
+        bundle = HAPI_request(
+            token=token, method="GET", resource_type=resource_type, params=params
+        )
+        if generation("searches") == gen:
+            _cache_search(key, gen, bundle)
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+
+def HAPI_search(token, resource_type, params):
+    """Search HAPI, via the stale-while-revalidate search cache when enabled
+
+    Fresh entries are served directly.  Stale entries are served while a
+    single background request refreshes them.  Writes made through this
+    service invalidate every cached search (see ``_write_through``), so a
+    newly created patient shows up on the next request.
+
+    :param params: search parameters, already normalized by the caller, i.e.
+      including the ``ACTIVE_PATIENT_FLAG`` rewrite
+    :returns: search Bundle
+
+    """
+    cache = search_cache()
+    gen = generation("searches") if cache else None
+    if gen is None:
+        return HAPI_request(
+            token=token, method="GET", resource_type=resource_type, params=params
+        )
+
+    from patientsearch.models.async_upstream import run_in_background
+
+    key = _search_key(resource_type, params)
+    cached = cache.get(f"{gen}:{key}")
+    if cached is not None:
+        if cached["fresh_until"] < time.time():
+            with _revalidating_lock:
+                start = key not in _revalidating
+                _revalidating.add(key)
+            if start:
+                run_in_background(
+                    _revalidate, token, resource_type, dict(params), key, gen
+                )
+        return cached["bundle"]
+
+    bundle = HAPI_request(
+        token=token, method="GET", resource_type=resource_type, params=params
+    )
+    _cache_search(key, gen, bundle)
+    return bundle
+
+
+def HAPI_read(token, resource_type, resource_id):
+    """Read single resource from HAPI, via the resource cache when enabled
+
+    Returns a copy, safe for the caller to modify.
+    """
+    cache = resource_cache()
+    key = f"{resource_type}/{resource_id}"
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        return deepcopy(cached)
+
+    resource = HAPI_request(
+        token=token,
+        method="GET",
+        resource_type=resource_type,
+        resource_id=resource_id,
+    )
+    if cache:
+        cache_resource(resource)
+        resource = deepcopy(resource)
+    return resource
+
+
+def cached_resource(resource_type, resource_id):
+    """Copy of resource held by the resource cache, None if not cached"""
+    cache = resource_cache()
+    cached = cache.get(f"{resource_type}/{resource_id}") if cache else None
+    return deepcopy(cached) if cached is not None else None
+
+
+def external_request(token, resource_type, params, user_info=None):
     """Execute request on configured "external" system - return JSON
 
     :param token: validated JWT to include in request for auth
     :param resource_type: String naming desired such as ``Patient``
     :param params: Search parameters
+    :param user_info: logged in user's info, as from ``current_user_info``;
+      looked up when not given.  Required off the request thread, where the
+      user (held on the request's ``flask.g``) isn't accessible
 
     """
     from patientsearch.api import current_user_info
@@ -126,18 +543,48 @@ def external_request(token, resource_type, params):
     if not current_app.config.get("EXTERNAL_FHIR_API"):
         raise ValueError("config var EXTERNAL_FHIR_API not defined; can't continue")
 
-    user = current_user_info(token)
+    user = user_info or current_user_info(token)
     if "DEA" not in user:
         raise ValueError("DEA not found")
     search_params = dict(deepcopy(params))  # Necessary on ImmutableMultiDict
+    bypass_cache = search_params.pop("nocache", "false").lower() != "false"
     search_params["DEA"] = user.get("DEA")
+
+    cache = pdmp_cache()
+    if cache:
+        key = hashlib.sha256(
+            _search_key(resource_type, search_params).encode("utf-8")
+        ).hexdigest()
+        cached = None if bypass_cache else cache.get(key)
+        if cached is not None:
+            audit_entry(
+                "PDMP search served from cache",
+                extra={
+                    "tags": ["PDMP", "search", "cache"],
+                    "patient": params,
+                    "user": user,
+                },
+            )
+            return deepcopy(cached)
+
     url = current_app.config.get("EXTERNAL_FHIR_API") + resource_type
-    resp = requests.get(url, auth=BearerAuth(token), params=search_params, timeout=30)
+    try:
+        with timed_upstream("EXTERNAL_FHIR_API", "GET", resource_type) as timing:
+            resp = upstream_session("EXTERNAL_FHIR_API").get(
+                url, auth=BearerAuth(token), params=search_params, timeout=30
+            )
+            timing["status"] = resp.status_code
+    except requests.exceptions.ConnectionError as error:
+        # includes CircuitOpenError, when the PDMP breaker is open
+        extra = {"tags": ["PDMP", "search", "error"], "patient": params, "user": user}
+        audit_entry(f"PDMP inaccessible: {error}", extra=extra, level="error")
+        current_app.logger.exception(error)
+        raise RuntimeError("PDMP inaccessible")
     try:
         resp.raise_for_status()
     except requests.exceptions.HTTPError as err:
         try:
-            msg = resp.json().get("message") or err
+            msg = loads(resp.content).get("message") or err
         except JSONDecodeError:
             msg = resp.text or err
         extra = {"tags": ["PDMP", "search", "error"], "patient": params, "user": user}
@@ -145,39 +592,143 @@ def external_request(token, resource_type, params):
         current_app.logger.exception(err)
         raise RuntimeError(msg)
 
-    return resp.json()
+    result = loads(resp.content)
+    if cache:
+        cache.set(key, deepcopy(result))
+    return result
+
+
+def pdmp_cache():
+    """Short lived cache of PDMP search results, None when disabled"""
+    return get_cache("pdmp", "PDMP_CACHE", encrypted=True)
 
 
-def sync_bundle(token, bundle, consider_active=False):
+def sync_bundle(token, bundle, consider_active=False, prefetched=None):
     """Given FHIR bundle, insert or update all contained resources
 
     :param token: valid JWT token for use in auth calls
     :param bundle: bundle of FHIR resources to sync
+    :param prefetched: results of internal patient searches already made,
+      keyed by ``patient_search_key``; reused rather than repeated
 
     Expecting to receive a bundle of FHIR resources from an external
     source, to be synchronized with the internal backing store, namely
-    HAPI.
+    HAPI.  See ``sync_bundle_entries``.
+
+    :returns: synchronized resource for the first entry in bundle
+
+    """
+    synced = sync_bundle_entries(token, bundle, consider_active, prefetched)
+    return synced[0] if synced else None
 
-    :returns: synchronized resource if only one in bundle
+
+def sync_bundle_entries(token, bundle, consider_active=False, prefetched=None):
+    """Insert or update all resources of bundle, as ``sync_bundle`` does
+
+    A bundle holding several patients is synchronized in a single HAPI
+    transaction, see ``sync_patients``.
+
+    :returns: list of synchronized resources, one per bundle entry, in
+      order; i.e. for assigning each entry its internal id
 
     """
     if bundle.get("resourceType") != "Bundle":
         raise ValueError(f"Expected bundle; can't process {bundle.get('resourceType')}")
 
-    for entry in bundle.get("entry"):
+    patients = []
+    for entry in bundle.get("entry") or []:
         resource = entry["resource"]
         # Restrict to what is expected for now
         if resource["resourceType"] != "Patient":
             raise ValueError(f"Can't sync resourceType {resource['resourceType']}")
+        patients.append(resource)
 
-        patient = sync_patient(token, resource, consider_active)
-        # TODO handle multiple external matches (if it ever happens!)
-        # currently returning first
-        return patient
+    if len(patients) == 1:
+        return [sync_patient(token, patients[0], consider_active, prefetched)]
+    if not patients:
+        return []
+    return sync_patients(token, patients, consider_active, prefetched)
 
 
-def _merge_patient(src_patient, internal_patient, token, consider_active=False):
-    """Helper used to push details from src into internal patient"""
+def sync_patients(token, patients, consider_active=False, prefetched=None):
+    """Sync several patient resources - one HAPI transaction for all writes
+
+    Internal matches are searched for concurrently, then every insert and
+    update needed is submitted as a single ``transaction`` Bundle, so the
+    number of HAPI round trips doesn't grow with the number of patients.
+    Patients matching the same internal patient (or, when new, the same
+    search parameters) are written once.
+
+    :returns: list of synchronized patients, in the order given
+
+    """
+    from patientsearch.models.async_upstream import gather_upstream, run_upstream
+
+    searches = gather_upstream(
+        *(
+            run_upstream(internal_patient_search, token, p, prefetched=prefetched)
+            for p in patients
+        )
+    )
+
+    # per patient, its synchronized resource or index of the entry writing it
+    results = []
+    planned = {}
+    entries = []
+    for patient, internal_search in zip(patients, searches):
+        match_count = internal_search["total"]
+        if match_count > 0:
+            if match_count > 1:
+                current_app.logger.warning(
+                    f"expected ONE matching patient, found {match_count}"
+                )
+            internal_patient = internal_search["entry"][0]["resource"]
+            key = f"Patient/{internal_patient['id']}"
+            if key not in planned:
+                updated = _updated_patient(patient, internal_patient, consider_active)
+                planned[key] = internal_patient if updated is None else len(entries)
+                if updated is not None:
+                    entries.append(
+                        {"resource": updated, "request": {"method": "PUT", "url": key}}
+                    )
+        else:
+            key = _search_key("Patient", patient_as_search_params(patient))
+            if key not in planned:
+                patient = new_resource_hook(resource=patient)
+                if consider_active:
+                    patient["active"] = True
+                planned[key] = len(entries)
+                entries.append(
+                    {
+                        "fullUrl": f"urn:uuid:{uuid4()}",
+                        "resource": patient,
+                        "request": {"method": "POST", "url": "Patient"},
+                    }
+                )
+        results.append(planned[key])
+
+    if not entries:
+        return results
+
+    response = HAPI_request(
+        token=token,
+        method="POST",
+        resource={"resourceType": "Bundle", "type": "transaction", "entry": entries},
+        headers={"Prefer": "return=representation"},
+    )
+    written = [
+        entry.get("resource")
+        or HAPI_read(token, *_location_key(entry["response"]["location"]).split("/"))
+        for entry in response.get("entry", [])
+    ]
+    return [written[r] if isinstance(r, int) else r for r in results]
+
+
+def _updated_patient(src_patient, internal_patient, consider_active=False):
+    """Push details from src into internal patient
+
+    :returns: the updated internal patient, or None if no update is needed
+    """
     # TODO consider additional patient attributes beyond identifiers
 
     def different(src, dest):
@@ -199,68 +750,75 @@ def _merge_patient(src_patient, internal_patient, token, consider_active=False):
     if not different(src_patient, internal_patient):
         # If patient is active, proceed. If not, re-activate
         if not consider_active or internal_patient.get("active", False):
-            return internal_patient
+            return None
 
-        params = patient_as_search_params(internal_patient)
         # Ensure it is active
         internal_patient["active"] = True
-        return HAPI_request(
-            token=token,
-            method="PUT",
-            params=params,
-            resource_type="Patient",
-            resource=internal_patient,
-            resource_id=internal_patient["id"],
-        )
+        return internal_patient
     else:
         internal_patient["identifier"] = src_patient["identifier"]
-        params = patient_as_search_params(internal_patient)
         # Ensure it is active, skip if active parameter is not considered
         if consider_active:
             internal_patient["active"] = True
-        return HAPI_request(
-            token=token,
-            method="PUT",
-            params=params,
-            resource_type="Patient",
-            resource=internal_patient,
-            resource_id=internal_patient["id"],
-        )
+        return internal_patient
 
 
-def patient_as_search_params(patient, active_only=False):
-    """Generate HAPI search params from patient resource"""
-
-    # Use same parameters sent to external src looking for existing Patient
-    # Note FHIR uses list for 'name' and 'given', common parameter use defines just one
-    search_map = (
-        ("name.family", "family", ""),
-        ("name[0].family", "family", ""),
-        ("name.given", "given", ""),
-        ("name.given[0]", "given", ""),
-        ("name[0].given[0]", "given", ""),
-        ("birthDate", "birthdate", "eq"),
+def _merge_patient(src_patient, internal_patient, token, consider_active=False):
+    """Helper used to push details from src into internal patient"""
+    original = deepcopy(internal_patient)
+    updated = _updated_patient(src_patient, internal_patient, consider_active)
+    if updated is None:
+        return internal_patient
+
+    params = patient_as_search_params(updated)
+    return HAPI_update(
+        token=token,
+        resource_type="Patient",
+        resource_id=updated["id"],
+        resource=updated,
+        original=original,
+        params=params,
     )
-    if active_only:
-        # Change the search params if we are considering only active patients in search
-        search_map = search_map + (("active", True, ""),)
 
-    search_params = {}
 
-    for path, queryterm, compstr in search_map:
-        match = json_search(path, patient)
-        if match and isinstance(match, str):
-            search_params[queryterm] = compstr + match
-    return search_params
+def patient_as_search_params(patient, active_only=False):
+    """Generate HAPI search params from patient resource
+
+    Uses the same parameters sent to external src looking for existing
+    Patient, as defined by the configured match rules (see ``match_rules``)
+    """
+    return match_rules(active_only).search_params(patient)
+
 
+def patient_search_key(patient, active_only=False):
+    """Key of the internal search for patient, as used by ``prefetched``"""
+    return _search_key("Patient", patient_as_search_params(patient, active_only))
 
-def internal_patient_search(token, patient, active_only=False):
-    """Look up given patient from "internal" HAPI store, returns bundle"""
-    params = patient_as_search_params(patient, active_only)
 
-    return HAPI_request(
+def internal_patient_search(token, patient, active_only=False, prefetched=None):
+    """Look up given patient from "internal" HAPI store, returns bundle
+
+    Answered by the patient index when enabled and holding a match,
+    otherwise by a HAPI search.
+
+    :param prefetched: results of searches already made, keyed by
+      ``patient_search_key``
+    """
+    params = patient_as_search_params(patient, active_only)
+    if prefetched:
+        bundle = prefetched.get(_search_key("Patient", params))
+        if bundle is not None:
+            return bundle
+    bundle = index_lookup(token, params)
+    if bundle is not None:
+        return bundle
+
+    bundle = HAPI_request(
         token=token, method="GET", resource_type="Patient", params=params
     )
+    for entry in bundle.get("entry", []):
+        index_patient(entry["resource"])
+    return bundle
 
 
 def new_resource_hook(resource):
@@ -284,10 +842,41 @@ def new_resource_hook(resource):
     return resource
 
 
-def sync_patient(token, patient, consider_active=False):
-    """Sync single patient resource - insert or update as needed"""
+def sync_patient(token, patient, consider_active=False, prefetched=None):
+    """Sync single patient resource - insert or update as needed
+
+    With ``CONDITIONAL_PATIENT_WRITES`` configured, a conditional create
+    finds or inserts the patient in one round trip; a second is only needed
+    to update an existing patient out of sync.  Several matches fall back
+    to the search below, which warns and merges into the first.
+
+    :param prefetched: results of internal searches already made, see
+      ``internal_patient_search``
+    """
+    params = patient_as_search_params(patient)
+    known = (prefetched or {}).get(_search_key("Patient", params))
+    if (
+        current_app.config.get("CONDITIONAL_PATIENT_WRITES")
+        and params
+        and not (known and known["total"])
+    ):
+        new_patient = new_resource_hook(resource=deepcopy(patient))
+        if consider_active:
+            new_patient["active"] = True
+        internal_patient, created = HAPI_conditional_create(token, new_patient, params)
+        if created:
+            return internal_patient
+        if internal_patient is not None:
+            return _merge_patient(
+                src_patient=patient,
+                internal_patient=internal_patient,
+                token=token,
+                consider_active=consider_active,
+            )
+        # several matches; search afresh
+        prefetched = None
 
-    internal_search = internal_patient_search(token, patient)
+    internal_search = internal_patient_search(token, patient, prefetched=prefetched)
 
     # If found, return the Patient, merging if necessary
     match_count = internal_search["total"]
@@ -323,12 +912,13 @@ def restore_patient(token, patient):
     # If the patient is already active, bail
     if patient.get("active", False):
         return patient
+    original = deepcopy(patient)
     patient["active"] = True
 
-    return HAPI_request(
+    return HAPI_update(
         token=token,
-        method="PUT",
         resource_type="Patient",
-        resource=patient,
         resource_id=patient["id"],
+        resource=patient,
+        original=original,
     )
@@ -0,0 +1,173 @@
+"""Profiling
+
+Opt-in sampling profiler for individual requests, to see where a slow
+request in production spent its time.  A fraction (``PROFILE_SAMPLE_RATE``)
+of requests is profiled, as is any request carrying a valid
+``X-Profile-Request`` header, signed with ``PROFILE_SECRET`` (see
+``profile_header``).
+
+While a profiled request runs, a background thread samples the stack of the
+thread serving it every ``PROFILE_INTERVAL`` seconds.  The samples are
+written as folded stacks (one ``frame;frame;... count`` line per distinct
+stack, as read by flamegraph.pl and speedscope) to a file named for the
+route, in ``PROFILE_DIR``; only the newest ``PROFILE_MAX_FILES`` are kept.
+Work a request hands to other threads (i.e. concurrent upstream lookups)
+is sampled only as the request thread waiting on it.
+
+When neither a sample rate nor a secret is configured, no request hooks
+are registered at all.
+"""
+
+from collections import Counter
+from datetime import datetime
+import hashlib
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import request
+
+PROFILE_HEADER = "X-Profile-Request"
+
+_SAMPLER = "patientsearch.profiling.sampler"
+
+
+def _signature(secret, expires):
+    return hmac.new(
+        secret.encode("utf-8"), str(expires).encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+
+
+def profile_header(secret, ttl=300):
+    """``X-Profile-Request`` header value, valid for ttl seconds"""
+    expires = int(time.time() + ttl)
+    return f"{expires}.{_signature(secret, expires)}"
+
+
+def valid_profile_header(value, secret):
+    """True if value is an unexpired ``profile_header`` signed with secret"""
+    expires, _, signature = value.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(secret, expires))
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Samples the stack of a thread, until stopped
+
+    :param thread_id: ident of the thread to sample
+    :param interval: seconds between samples
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+def route_slug(rule):
+    """File name friendly form of a route template, e.g. ``fhir_resource_type``"""
+    if rule is None:
+        return "unmatched"
+    slug = re.sub(r"<(?:[^:>]+:)?([^>]+)>", r"\1", rule)
+    return re.sub(r"[^A-Za-z0-9]+", "_", slug).strip("_") or "root"
+
+
+def write_profile(directory, route, stacks, max_files):
+    """Write folded stacks for route to directory, keeping max_files newest
+
+    :returns: path of the file written
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S.%f")
+    path = os.path.join(
+        directory,
+        f"{route_slug(route)}.{stamp}.{os.getpid()}.{threading.get_ident()}.folded",
+    )
+    with open(path, "w") as folded:
+        for stack, count in stacks.items():
+            folded.write(f"{stack} {count}\n")
+
+    profiles = [
+        entry for entry in os.scandir(directory) if entry.name.endswith(".folded")
+    ]
+    if len(profiles) > max_files:
+        profiles.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in profiles[: len(profiles) - max_files]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # pruned concurrently, by another worker
+                pass
+    return path
+
+
+def init_profiling(app):
+    """Profile sampled or signed requests to app, if so configured"""
+    sample_rate = app.config.get("PROFILE_SAMPLE_RATE") or 0
+    secret = app.config.get("PROFILE_SECRET")
+    if not sample_rate and not secret:
+        return
+
+    def wanted():
+        if sample_rate and random.random() < sample_rate:
+            return True
+        header = request.headers.get(PROFILE_HEADER)
+        return bool(secret and header and valid_profile_header(header, secret))
+
+    @app.before_request
+    def start_profile():
+        if wanted():
+            request.environ[_SAMPLER] = Sampler(
+                threading.get_ident(), app.config["PROFILE_INTERVAL"]
+            ).start()
+
+    @app.teardown_request
+    def stop_profile(exc):
+        sampler = request.environ.pop(_SAMPLER, None)
+        if sampler is None:
+            return
+        stacks = sampler.stop()
+        if not stacks:
+            return
+        route = request.url_rule.rule if request.url_rule else None
+        try:
+            path = write_profile(
+                app.config["PROFILE_DIR"],
+                route,
+                stacks,
+                app.config["PROFILE_MAX_FILES"],
+            )
+        except OSError as error:
+            app.logger.warning(f"request profile not written: {error}")
+            return
+        app.logger.info(f"request profile written to {path}")
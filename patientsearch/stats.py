@@ -0,0 +1,24 @@
+"""Stats
+
+minimal registry of runtime counters, exposed via the ``/stats`` endpoint
+"""
+
+_providers = {}
+
+
+def register_stats(name, provider):
+    """Register callable returning a JSON serializable dict of counters
+
+    :param name: key under which the provider's counters are reported
+    :param provider: zero argument callable, invoked on each snapshot
+    """
+    _providers[name] = provider
+
+
+def stats_snapshot(name=None):
+    """Return current counters from all (or the one named) providers"""
+    if name is not None:
+        if name not in _providers:
+            raise KeyError(name)
+        return {name: _providers[name]()}
+    return {key: provider() for key, provider in _providers.items()}
@@ -1,13 +1,50 @@
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
 import jwt
 import pytest
+import requests
+import threading
+import time
 from datetime import datetime, timedelta
+from flask import g
 from patientsearch import create_app
 
 SECRET = "nonsense-testing-key"
 
 
+class mock_response:
+    """Wrap data in response like object"""
+
+    def __init__(self, data=None, status_code=200, headers=None):
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+    @property
+    def content(self):
+        return json.dumps(self.data).encode("utf-8")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"status {self.status_code}")
+
+
+@pytest.fixture(autouse=True)
+def session_file_dir(monkeypatch, tmp_path):
+    """Keep filesystem sessions of every app created by tests out of the tree"""
+    monkeypatch.setattr(
+        "patientsearch.config.SESSION_FILE_DIR",
+        str(tmp_path / "flask_session"),
+        raising=False,
+    )
+
+
 @pytest.fixture()
-def app():
+def app(session_file_dir):
     return create_app(testing=True)
 
 
@@ -34,3 +71,85 @@ def generate_jwt(email="fake@testy.org", sub="fake-subject", roles=None):
 @pytest.fixture()
 def faux_token():
     return generate_jwt()
+
+
+@pytest.fixture()
+def oidc_user(app, mocker):
+    """Logged in user's id token, kept on ``flask.g`` as flask-oidc does
+
+    Only accessible within the request (and its context) that set it; not
+    from copies of the context run on other threads.
+    """
+    id_token = {"preferred_username": "test-user", "DEA": "FD7654321"}
+
+    def set_id_token():
+        g.oidc_id_token = id_token
+
+    app.before_request(set_id_token)
+    mocker.patch(
+        "patientsearch.extensions.oidc.user_getfield",
+        side_effect=lambda field: g.oidc_id_token[field],
+    )
+    return id_token
+
+
+BUNDLE = {"resourceType": "Bundle", "type": "searchset", "total": 0}
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        upstream = self.server
+        with upstream.lock:
+            upstream.hits += 1
+            stall, upstream.stall = upstream.stall, 0
+        time.sleep(stall)
+        status, body = (
+            upstream.responder(self.path)
+            if upstream.responder
+            else (upstream.status, upstream.body)
+        )
+        body = json.dumps(body).encode("utf-8")
+        if upstream.gzip:
+            body = gzip.compress(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/fhir+json;charset=utf-8")
+        for name, value in upstream.headers.items():
+            self.send_header(name, value)
+        if upstream.gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def upstream():
+    """Local keep-alive upstream (HAPI, PDMP) answering GETs with FHIR JSON
+
+    Set while running: ``status`` and ``body`` of replies, or a
+    ``responder(path)`` returning both; extra ``headers``; ``gzip`` to
+    compress bodies; ``stall`` to delay the next request that many seconds.
+    ``hits`` counts requests; ``url`` is the base URL.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UpstreamHandler)
+    server.lock = threading.Lock()
+    server.hits = 0
+    server.stall = 0
+    server.status = 200
+    server.body = BUNDLE
+    server.responder = None
+    server.headers = {}
+    server.gzip = False
+    # clients may drop connections (i.e. the loser of a hedged request)
+    server.handle_error = lambda request, address: None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_port}/"
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,72 @@
+import threading
+import time
+
+from pytest import raises
+
+from conftest import mock_response
+from patientsearch.models import (
+    HAPI_request_async,
+    external_request_async,
+    gather_upstream,
+)
+
+
+def test_concurrent_fan_out(client, mocker, faux_token):
+    """Awaited calls overlap rather than run back to back"""
+    threads = set()
+
+    def slow_get(*args, **kwargs):
+        threads.add(threading.get_ident())
+        time.sleep(0.2)
+        return mock_response({"resourceType": "Bundle", "url": args[-1]})
+
+    mocker.patch("requests.Session.get", side_effect=slow_get)
+
+    start = time.perf_counter()
+    results = gather_upstream(
+        *(
+            HAPI_request_async(faux_token, "GET", resource_type=rt)
+            for rt in ("Patient", "Practitioner", "CareTeam", "ServiceRequest")
+        )
+    )
+    elapsed = time.perf_counter() - start
+
+    assert [r["url"].rsplit("/", 1)[-1] for r in results] == [
+        "Patient",
+        "Practitioner",
+        "CareTeam",
+        "ServiceRequest",
+    ]
+    assert len(threads) == 4
+    assert elapsed < 0.6
+
+
+def test_error_mapping(client, mocker, faux_token):
+    mocker.patch(
+        "requests.Session.get", return_value=mock_response({}, status_code=500)
+    )
+    with raises(ValueError):
+        gather_upstream(HAPI_request_async(faux_token, "GET", resource_type="Patient"))
+
+    results = gather_upstream(
+        HAPI_request_async(faux_token, "GET", resource_type="Patient"),
+        return_exceptions=True,
+    )
+    assert isinstance(results[0], ValueError)
+
+
+def test_external_requires_config(client, faux_token):
+    client.application.config["EXTERNAL_FHIR_API"] = ""
+    with raises(ValueError):
+        gather_upstream(external_request_async(faux_token, "Patient", {}))
+
+
+def test_external_request_user(client, mocker, faux_token, oidc_user):
+    """The logged in user's DEA is sent, though the request runs off thread"""
+    get = mocker.patch(
+        "requests.Session.get",
+        return_value=mock_response({"resourceType": "Bundle", "total": 0}),
+    )
+    client.application.preprocess_request()  # as flask-oidc, sets the user on g
+    gather_upstream(external_request_async(faux_token, "Patient", {}))
+    assert get.call_args.kwargs["params"]["DEA"] == oidc_user["DEA"]
@@ -0,0 +1,72 @@
+from pytest import fixture, raises
+
+from conftest import mock_response
+from patientsearch.api import parse_batch_query
+
+
+@fixture
+def authorized(mocker, faux_token):
+    return mocker.patch("patientsearch.api.validate_auth", return_value=faux_token)
+
+
+def test_parse_batch_query(app):
+    app.config["ACTIVE_PATIENT_FLAG"] = True
+    assert parse_batch_query("Patient?_count=5") == (
+        "Patient",
+        None,
+        {"_count": "5", "active": "true"},
+    )
+    assert parse_batch_query("Patient?inactive_search=true") == ("Patient", None, {})
+    assert parse_batch_query("/Practitioner/8") == ("Practitioner", "8", {})
+    with raises(ValueError):
+        parse_batch_query("Patient/8/_history/1")
+    with raises(ValueError):
+        parse_batch_query({"resourceType": "Patient"})
+
+
+def test_concurrent_batch(client, mocker, authorized):
+    def get(url, **kwargs):
+        return mock_response({"resourceType": "Bundle", "url": url})
+
+    hapi_get = mocker.patch("requests.Session.get", side_effect=get)
+    response = client.post(
+        "/fhir/_batch", json={"queries": ["Patient?_count=5", "Practitioner/8"]}
+    )
+
+    assert response.status_code == 200
+    assert authorized.call_count == 1
+    assert hapi_get.call_count == 2
+    assert response.json["type"] == "batch-response"
+    entries = response.json["entry"]
+    assert entries[0]["resource"]["url"] == "http://mock-MAP-API/Patient"
+    assert entries[1]["resource"]["url"] == "http://mock-MAP-API/Practitioner/8"
+
+
+def test_batch_partial_failure(client, authorized):
+    response = client.post("/fhir/_batch", json=["Patient", "not/a/valid/query"])
+    assert response.status_code == 200
+    assert response.json["entry"][1]["response"]["status"] == "400 Bad Request"
+
+
+def test_bundle_batch(client, mocker, authorized):
+    client.application.config["FHIR_BATCH_MODE"] = "bundle"
+    hapi_post = mocker.patch(
+        "requests.Session.post",
+        return_value=mock_response({"type": "batch-response"}),
+    )
+    response = client.post("/fhir/_batch", json=["Patient?_count=5", "CareTeam/3"])
+
+    assert response.json == {"type": "batch-response"}
+    assert hapi_post.call_count == 1
+    sent = hapi_post.call_args.kwargs["json"]
+    assert sent["type"] == "batch"
+    assert [e["request"]["url"] for e in sent["entry"]] == [
+        "Patient?_count=5",
+        "CareTeam/3",
+    ]
+
+
+def test_batch_requires_queries(client, authorized):
+    assert client.post("/fhir/_batch", json={}).status_code == 400
+    too_many = ["Patient"] * 21
+    assert client.post("/fhir/_batch", json=too_many).status_code == 400
@@ -0,0 +1,65 @@
+from copy import deepcopy
+
+from patientsearch.models.bundle_transform import (
+    assign_ids,
+    strip_fields,
+    tag_identifiers,
+    transform_bundle,
+)
+
+FOUND = {"system": "https://github.com/uwcirg/script-fhir-facade", "value": "found"}
+
+
+def bundle():
+    return {
+        "resourceType": "Bundle",
+        "entry": [
+            {"resource": {"resourceType": "Patient", "text": {"div": "luke"}}},
+            {"resource": {"resourceType": "Patient", "identifier": [FOUND]}},
+            {"resource": {"resourceType": "Practitioner"}},
+        ],
+    }
+
+
+def test_structural_sharing():
+    original = bundle()
+    pristine = deepcopy(original)
+    result = transform_bundle(original, tag_identifiers("Patient", FOUND))
+
+    assert original == pristine
+    assert result["entry"][0]["resource"]["identifier"] == [FOUND]
+    # untouched entries are shared, not copied
+    assert result["entry"][1] is original["entry"][1]
+    assert result["entry"][2] is original["entry"][2]
+    assert (
+        result["entry"][0]["resource"]["text"]
+        is original["entry"][0]["resource"]["text"]
+    )
+
+
+def test_in_place_chain():
+    original = bundle()
+    result = transform_bundle(
+        original,
+        tag_identifiers("Patient", FOUND),
+        strip_fields("text"),
+        assign_ids(["8", "9"], resource_type="Patient"),
+        in_place=True,
+    )
+    assert result is original
+    first, second, third = (e["resource"] for e in original["entry"])
+    assert first == {"resourceType": "Patient", "identifier": [FOUND], "id": "8"}
+    assert second == {"resourceType": "Patient", "identifier": [FOUND], "id": "9"}
+    assert third == {"resourceType": "Practitioner"}
+
+
+def test_assign_ids_keeps_existing():
+    original = {"entry": [{"resource": {"resourceType": "Patient", "id": "1"}}]}
+    result = transform_bundle(original, assign_ids(["8"]))
+    assert result["entry"][0]["resource"]["id"] == "1"
+
+
+def test_no_entries():
+    assert transform_bundle({"resourceType": "Bundle"}, strip_fields("text")) == {
+        "resourceType": "Bundle"
+    }
@@ -0,0 +1,222 @@
+import time
+
+from pytest import fixture, raises
+
+from conftest import mock_response
+from patientsearch.models import HAPI_read, HAPI_request, HAPI_search, external_request
+from patientsearch.models.cache import TTLCache, get_cache
+
+
+@fixture
+def patient():
+    return {
+        "resourceType": "Patient",
+        "id": "8",
+        "meta": {"versionId": "2"},
+        "name": [{"family": "Skywalker", "given": ["Luke"]}],
+    }
+
+
+@fixture
+def cached_app(app):
+    app.config["RESOURCE_CACHE_TTL"] = 60
+    return app
+
+
+def test_ttl_cache_expiry():
+    cache = TTLCache("test", ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache("test", ttl=60, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # touch, making `b` least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_disabled_by_default(app):
+    assert get_cache("resources", "RESOURCE_CACHE") is None
+
+
+def test_read_through(cached_app, mocker, faux_token, patient):
+    hapi_get = mocker.patch("requests.Session.get", return_value=mock_response(patient))
+    assert HAPI_read(faux_token, "Patient", "8") == patient
+    result = HAPI_read(faux_token, "Patient", "8")
+    assert result == patient
+    assert hapi_get.call_count == 1
+
+    # callers get a copy; modifications don't leak into the cache
+    result["active"] = False
+    assert "active" not in HAPI_read(faux_token, "Patient", "8")
+
+
+def test_write_through(cached_app, mocker, faux_token, patient):
+    mocker.patch("requests.Session.get", return_value=mock_response(patient))
+    HAPI_read(faux_token, "Patient", "8")
+
+    updated = dict(patient, active=True, meta={"versionId": "3"})
+    mocker.patch("requests.Session.put", return_value=mock_response(updated))
+    HAPI_request(
+        faux_token, "PUT", resource_type="Patient", resource_id="8", resource=updated
+    )
+    assert HAPI_read(faux_token, "Patient", "8") == updated
+
+
+def test_delete_invalidates(cached_app, mocker, faux_token, patient):
+    hapi_get = mocker.patch("requests.Session.get", return_value=mock_response(patient))
+    HAPI_read(faux_token, "Patient", "8")
+
+    mocker.patch(
+        "requests.Session.delete",
+        return_value=mock_response({"resourceType": "OperationOutcome"}),
+    )
+    HAPI_request(faux_token, "DELETE", resource_type="Patient", resource_id="8")
+    HAPI_read(faux_token, "Patient", "8")
+    assert hapi_get.call_count == 2
+
+
+def test_transaction_write_through(cached_app, mocker, faux_token, patient):
+    hapi_get = mocker.patch("requests.Session.get", return_value=mock_response(patient))
+    HAPI_read(faux_token, "Patient", "8")
+
+    updated = dict(patient, active=True, meta={"versionId": "3"})
+    transaction_response = {
+        "resourceType": "Bundle",
+        "type": "transaction-response",
+        "entry": [
+            {"resource": updated},
+            {"response": {"location": "Patient/9/_history/4"}},
+        ],
+    }
+    mocker.patch(
+        "requests.Session.post", return_value=mock_response(transaction_response)
+    )
+    HAPI_request(
+        faux_token, "POST", resource={"resourceType": "Bundle", "type": "transaction"}
+    )
+    assert HAPI_read(faux_token, "Patient", "8") == updated
+    assert hapi_get.call_count == 1
+
+
+@fixture
+def search_cached_app(app):
+    app.config["SEARCH_CACHE_TTL"] = 60
+    app.config["SEARCH_CACHE_STALE_TTL"] = 60
+    return app
+
+
+def bundle(total):
+    return {"resourceType": "Bundle", "type": "searchset", "total": total}
+
+
+def test_search_cache_hit(search_cached_app, mocker, faux_token):
+    hapi_get = mocker.patch(
+        "requests.Session.get", return_value=mock_response(bundle(1))
+    )
+    params = {"_count": "20", "active": "true"}
+    assert HAPI_search(faux_token, "Patient", params) == bundle(1)
+    # parameter order is irrelevant to the cache key
+    assert HAPI_search(faux_token, "Patient", dict(reversed(params.items()))) == bundle(
+        1
+    )
+    assert hapi_get.call_count == 1
+
+
+def test_stale_while_revalidate(search_cached_app, mocker, faux_token):
+    search_cached_app.config["SEARCH_CACHE_TTL"] = 0.01
+    hapi_get = mocker.patch(
+        "requests.Session.get", return_value=mock_response(bundle(1))
+    )
+    HAPI_search(faux_token, "Patient", {})
+    time.sleep(0.02)
+
+    hapi_get.return_value = mock_response(bundle(2))
+    # stale result served immediately, refreshed in the background
+    assert HAPI_search(faux_token, "Patient", {}) == bundle(1)
+    for _ in range(100):
+        if hapi_get.call_count == 2:
+            break
+        time.sleep(0.01)
+    assert hapi_get.call_count == 2
+    time.sleep(0.01)
+    assert HAPI_search(faux_token, "Patient", {}) == bundle(2)
+
+
+def test_write_invalidates_searches(search_cached_app, mocker, faux_token, patient):
+    hapi_get = mocker.patch(
+        "requests.Session.get", return_value=mock_response(bundle(1))
+    )
+    HAPI_search(faux_token, "Patient", {})
+
+    mocker.patch("requests.Session.post", return_value=mock_response(patient))
+    HAPI_request(faux_token, "POST", resource_type="Patient", resource=patient)
+
+    hapi_get.return_value = mock_response(bundle(2))
+    assert HAPI_search(faux_token, "Patient", {}) == bundle(2)
+    assert hapi_get.call_count == 2
+
+
+def test_read_only_batch_keeps_searches(search_cached_app, mocker, faux_token):
+    hapi_get = mocker.patch(
+        "requests.Session.get", return_value=mock_response(bundle(1))
+    )
+    HAPI_search(faux_token, "Patient", {})
+
+    mocker.patch("requests.Session.post", return_value=mock_response({}))
+    batch = {
+        "resourceType": "Bundle",
+        "type": "batch",
+        "entry": [{"request": {"method": "GET", "url": "Patient"}}],
+    }
+    HAPI_request(faux_token, "POST", resource=batch)
+
+    HAPI_search(faux_token, "Patient", {})
+    assert hapi_get.call_count == 1
+
+
+@fixture
+def pdmp_cached_app(app, mocker):
+    app.config["PDMP_CACHE_TTL"] = 60
+    mocker.patch("patientsearch.api.current_user_info", return_value={"DEA": "FD1"})
+    return app
+
+
+def test_pdmp_cache(pdmp_cached_app, mocker, faux_token):
+    pdmp_get = mocker.patch(
+        "requests.Session.get", return_value=mock_response(bundle(1))
+    )
+    audit = mocker.patch("patientsearch.models.sync.audit_entry")
+
+    params = {"subject:Patient.name.given": "luke"}
+    external_request(faux_token, "Patient", params)
+    result = external_request(faux_token, "Patient", dict(reversed(params.items())))
+    assert result == bundle(1)
+    assert pdmp_get.call_count == 1
+    assert audit.call_args.args[0] == "PDMP search served from cache"
+    assert get_cache("pdmp", "PDMP_CACHE").stats()["hit_rate"] == 0.5
+
+    # callers modify results; the cached copy is unaffected
+    result["total"] = 2
+    assert external_request(faux_token, "Patient", params) == bundle(1)
+
+    external_request(faux_token, "Patient", dict(params, nocache="true"))
+    assert pdmp_get.call_count == 2
+    assert "nocache" not in pdmp_get.call_args.kwargs["params"]
+
+
+def test_pdmp_cache_requires_encryption_in_redis(pdmp_cached_app):
+    pdmp_cached_app.config["PDMP_CACHE_BACKEND"] = "redis"
+    pdmp_cached_app.config["REDIS_URL"] = "redis://localhost:6379/0"
+    with raises(RuntimeError):
+        get_cache("pdmp", "PDMP_CACHE", encrypted=True)
@@ -0,0 +1,159 @@
+import time
+
+from pytest import fixture, mark, raises
+
+from patientsearch.models.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from patientsearch.models.http_client import close_sessions, upstream_session
+from patientsearch.models.sync import (
+    HAPI_conditional_create,
+    HAPI_request,
+    HAPI_update,
+)
+
+
+@fixture(autouse=True)
+def fresh_sessions():
+    close_sessions()
+    yield
+    close_sessions()
+
+
+BREAKER_CONFIG = {
+    "UPSTREAM_BREAKER": True,
+    "UPSTREAM_BREAKER_MIN_CALLS": 4,
+    "UPSTREAM_BREAKER_FAILURE_RATE": 0.5,
+    "UPSTREAM_BREAKER_RESET_TIMEOUT": 0.2,
+}
+
+
+def test_breaker_states():
+    breaker = CircuitBreaker("MAP_API", min_calls=4, reset_timeout=0.05)
+    for failed in (False, True, False):
+        breaker.record(failed, breaker.allow())
+    assert breaker.state == CLOSED
+    breaker.record(True, breaker.allow())
+    assert breaker.state == OPEN
+
+    with raises(CircuitOpenError):
+        breaker.allow()
+    time.sleep(0.06)
+    probe = breaker.allow()
+    assert probe and breaker.state == HALF_OPEN
+    # one probe at a time
+    with raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record(False, probe)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["rejected"] == 2
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("MAP_API", min_calls=1, reset_timeout=0.05)
+    breaker.record(True, breaker.allow())
+    time.sleep(0.06)
+    breaker.record(True, breaker.allow())
+    assert breaker.state == OPEN
+    assert breaker.stats()["opened"] == 2
+
+
+def test_unguarded_upstream():
+    session = upstream_session("OIDC", config=BREAKER_CONFIG)
+    assert not hasattr(session.get_adapter("https://"), "breaker")
+
+
+def test_open_breaker_fails_fast(upstream):
+    session = upstream_session("MAP_API", config=BREAKER_CONFIG)
+    upstream.status = 503
+    for _ in range(4):
+        assert session.get(upstream.url, timeout=5).status_code == 503
+    with raises(CircuitOpenError):
+        session.get(upstream.url, timeout=5)
+    assert upstream.hits == 4
+
+    # half open, probe succeeds
+    upstream.status = 200
+    time.sleep(0.25)
+    assert session.get(upstream.url, timeout=5).status_code == 200
+    assert session.get_adapter(upstream.url).breaker.state == CLOSED
+
+
+def test_open_breaker_inaccessible(app, upstream, faux_token):
+    app.config.update(BREAKER_CONFIG, MAP_API=upstream.url)
+    upstream.status = 503
+    with app.test_request_context():
+        for _ in range(4):
+            with raises(ValueError):
+                HAPI_request(faux_token, "GET", "Patient")
+        with raises(RuntimeError, match="EMR FHIR store inaccessible"):
+            HAPI_request(faux_token, "GET", "Patient")
+    assert upstream.hits == 4
+
+
+PATIENT = {"resourceType": "Patient", "id": "8", "meta": {"versionId": "1"}}
+
+
+def conditional_create(token):
+    return HAPI_conditional_create(token, PATIENT, {"identifier": "x|8"})
+
+
+def patch_update(token):
+    return HAPI_update(
+        token, "Patient", "8", dict(PATIENT, gender="female"), original=PATIENT
+    )
+
+
+@mark.parametrize("write", (conditional_create, patch_update))
+def test_write_open_breaker(app, upstream, faux_token, write):
+    app.config.update(BREAKER_CONFIG, MAP_API=upstream.url, FHIR_PATCH_WRITES=True)
+    upstream.status = 503
+    with app.test_request_context():
+        for _ in range(4):
+            with raises(ValueError):
+                HAPI_request(faux_token, "GET", "Patient")
+        with raises(RuntimeError, match="EMR FHIR store inaccessible"):
+            write(faux_token)
+    assert upstream.hits == 4
+
+
+@mark.parametrize("write", (conditional_create, patch_update))
+def test_write_connection_refused(app, faux_token, write):
+    app.config.update(MAP_API="http://127.0.0.1:1/", FHIR_PATCH_WRITES=True)
+    with app.test_request_context():
+        with raises(RuntimeError, match="EMR FHIR store inaccessible"):
+            write(faux_token)
+
+
+def test_hedged_get(upstream):
+    config = {"UPSTREAM_HEDGE": True, "UPSTREAM_HEDGE_MIN_DELAY": 0.05}
+    session = upstream_session("MAP_API", config=config)
+    hedge = session.get_adapter(upstream.url).hedge
+    for _ in range(20):
+        hedge.observe(0.01)
+
+    upstream.stall = 0.5
+    start = time.monotonic()
+    assert session.get(upstream.url, timeout=5).status_code == 200
+    assert time.monotonic() - start < 0.4
+    assert upstream.hits == 2
+    assert hedge.stats()["hedge_wins"] == 1
+    # let the stalled request finish
+    time.sleep(0.5)
+
+
+def test_breaker_stats(client, mocker, faux_token, upstream):
+    mocker.patch("patientsearch.api.validate_auth", return_value=faux_token)
+    client.application.config.update(BREAKER_CONFIG)
+    with client.application.app_context():
+        upstream_session("MAP_API").get(upstream.url, timeout=5)
+
+    response = client.get("/stats/breakers")
+    assert response.status_code == 200
+    stats = response.json["breakers"]["MAP_API"]
+    assert stats["state"] == CLOSED
+    assert stats["calls"] == 1
@@ -0,0 +1,130 @@
+from copy import deepcopy
+import json
+import os
+import time
+
+from pytest import fixture
+
+from conftest import mock_response
+
+
+def load_json(datadir, filename):
+    with open(os.path.join(datadir, filename), "r") as json_file:
+        return json.load(json_file)
+
+
+@fixture
+def upstreams(mocker, datadir, faux_token):
+    """PDMP and HAPI, each taking 0.2 seconds per request"""
+    mocker.patch("patientsearch.api.validate_auth", return_value=faux_token)
+    mocker.patch(
+        "patientsearch.api.current_user_info", return_value={"DEA": "FD1234567"}
+    )
+    pdmp = load_json(datadir, "external_patient_search.json")
+    internal = load_json(datadir, "internal_patient_match.json")
+
+    def get(url, **kwargs):
+        time.sleep(0.2)
+        return mock_response(pdmp if "EXTERNAL" in url else internal)
+
+    # sync adds the "found" identifier to the internal patient
+    mocker.patch(
+        "requests.Session.put",
+        side_effect=lambda url, json, **kwargs: mock_response(json),
+    )
+    return mocker.patch("requests.Session.get", side_effect=get)
+
+
+SEARCH = (
+    "/external_search/Patient?subject:Patient.name.given=luke"
+    "&subject:Patient.name.family=skywalker&subject:Patient.birthdate=eq1977-01-12"
+)
+
+
+def test_sequential_lookup(client, upstreams):
+    start = time.perf_counter()
+    response = client.put(SEARCH)
+    assert time.perf_counter() - start >= 0.4
+    assert response.status_code == 200
+    assert response.json["entry"][0]["resource"]["id"] == "1102"
+    assert upstreams.call_count == 2
+
+
+def test_concurrent_lookup(client, upstreams):
+    client.application.config["EXTERNAL_SEARCH_CONCURRENT"] = True
+    start = time.perf_counter()
+    response = client.put(SEARCH)
+    assert time.perf_counter() - start < 0.35
+    assert response.json["entry"][0]["resource"]["id"] == "1102"
+    # reused by the sync, only as the PDMP's demographics match the request's
+    assert upstreams.call_count == 2
+
+
+def test_every_match_gets_internal_id(client, mocker, datadir, faux_token):
+    """Each PDMP match is returned with the id of its internal patient"""
+    mocker.patch("patientsearch.api.validate_auth", return_value=faux_token)
+    mocker.patch(
+        "patientsearch.api.current_user_info", return_value={"DEA": "FD1234567"}
+    )
+    pdmp = load_json(datadir, "external_patient_search.json")
+    leia = deepcopy(pdmp["entry"][0])
+    leia["resource"]["name"] = {"family": "organa", "given": ["leia"]}
+    pdmp["entry"].append(leia)
+    internal = load_json(datadir, "internal_patient_match.json")
+
+    def get(url, params=None, **kwargs):
+        if "EXTERNAL" in url:
+            return mock_response(pdmp)
+        if params and params.get("family") == "organa":
+            return mock_response({"resourceType": "Bundle", "total": 0})
+        return mock_response(internal)
+
+    mocker.patch("requests.Session.get", side_effect=get)
+
+    def transaction(url, json, **kwargs):
+        return mock_response(
+            {
+                "resourceType": "Bundle",
+                "type": "transaction-response",
+                "entry": [
+                    {"resource": dict({"id": f"new-{i}"}, **entry["resource"])}
+                    for i, entry in enumerate(json["entry"])
+                ],
+            }
+        )
+
+    mocker.patch("requests.Session.post", side_effect=transaction)
+    mocker.patch(
+        "requests.Session.put",
+        side_effect=lambda url, json, **kwargs: mock_response(json),
+    )
+
+    response = client.put(SEARCH)
+    assert response.status_code == 200
+    ids = [entry["resource"]["id"] for entry in response.json["entry"]]
+    assert ids[0] == "1102"
+    assert ids[1].startswith("new-")
+
+
+def test_concurrent_lookup_user(client, mocker, datadir, faux_token, oidc_user):
+    """The PDMP gets, and the audit records, the logged in user"""
+    client.application.config["EXTERNAL_SEARCH_CONCURRENT"] = True
+    mocker.patch("patientsearch.api.validate_auth", return_value=faux_token)
+    audit = mocker.patch("patientsearch.models.sync.audit_entry")
+    internal = load_json(datadir, "internal_patient_match.json")
+
+    def get(url, **kwargs):
+        if "EXTERNAL" in url:
+            return mock_response({"message": "PDMP down"}, status_code=503)
+        return mock_response(internal)
+
+    get = mocker.patch("requests.Session.get", side_effect=get)
+
+    response = client.put(SEARCH)
+    assert response.status_code == 400
+    (pdmp_call,) = [c for c in get.call_args_list if "EXTERNAL" in c.args[0]]
+    assert pdmp_call.kwargs["params"]["DEA"] == oidc_user["DEA"]
+    assert audit.call_args.kwargs["extra"]["user"] == {
+        "username": oidc_user["preferred_username"],
+        "DEA": oidc_user["DEA"],
+    }
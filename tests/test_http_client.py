@@ -0,0 +1,59 @@
+from pytest import fixture
+
+from patientsearch.models import http_client
+from patientsearch.models.http_client import (
+    close_sessions,
+    connection_stats,
+    upstream_session,
+)
+
+
+@fixture(autouse=True)
+def fresh_sessions():
+    close_sessions()
+    yield
+    close_sessions()
+
+
+def test_session_per_upstream():
+    hapi = upstream_session("MAP_API", config={})
+    assert upstream_session("MAP_API", config={}) is hapi
+    assert upstream_session("EXTERNAL_FHIR_API", config={}) is not hapi
+
+
+def test_session_discarded_after_fork(mocker):
+    hapi = upstream_session("MAP_API", config={})
+    mocker.patch.object(http_client.os, "getpid", return_value=-1)
+    assert upstream_session("MAP_API", config={}) is not hapi
+
+
+def test_host_limits():
+    config = {
+        "UPSTREAM_POOL_MAXSIZE": 4,
+        "UPSTREAM_POOL_HOST_LIMITS": {"https://hapi.example.org/": 20},
+    }
+    session = upstream_session("MAP_API", config=config)
+    assert session.get_adapter("https://hapi.example.org/fhir")._pool_maxsize == 20
+    assert session.get_adapter("https://other.example.org/")._pool_maxsize == 4
+
+
+def test_connection_reuse(upstream):
+    session = upstream_session("MAP_API", config={})
+    for _ in range(5):
+        session.get(upstream.url + "Patient", timeout=5).raise_for_status()
+
+    counts = connection_stats()["MAP_API"]
+    assert counts["requests"] == 5
+    assert counts["connections"] == 1
+    assert counts["reused"] == 4
+
+
+def test_no_cookies_kept(upstream):
+    upstream.headers = {"Set-Cookie": "KC_SESSION=user-1; Path=/"}
+    session = upstream_session("OIDC", config={})
+    session.get(upstream.url + "logout", timeout=5).raise_for_status()
+
+    upstream.headers = {}
+    response = session.get(upstream.url + "userinfo", timeout=5)
+    assert "Cookie" not in response.request.headers
+    assert not session.cookies
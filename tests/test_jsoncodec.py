@@ -0,0 +1,67 @@
+from datetime import datetime
+import json
+import uuid
+
+from flask import jsonify, request
+from pytest import fixture, mark, raises
+
+from patientsearch import jsoncodec
+
+BACKENDS = ["stdlib"] + (["orjson"] if jsoncodec.orjson else [])
+
+
+@fixture(params=BACKENDS)
+def backend(request):
+    previous = jsoncodec.backend()
+    jsoncodec.configure(request.param)
+    yield request.param
+    jsoncodec.configure(previous)
+
+
+def test_unknown_backend():
+    with raises(ValueError):
+        jsoncodec.configure("simplejson")
+
+
+def test_round_trip(backend):
+    data = {"b": [1, 2.5, None, True], "a": "é"}
+    encoded = jsoncodec.dumpb(data, sort_keys=True)
+    assert isinstance(encoded, bytes)
+    assert encoded.index(b'"a"') < encoded.index(b'"b"')
+    assert jsoncodec.loads(encoded) == data
+    assert jsoncodec.loads(encoded.decode("utf-8")) == data
+    assert jsoncodec.loads(jsoncodec.dumps({3: "x"})) == {"3": "x"}
+
+
+def test_big_int_fallback(backend):
+    assert jsoncodec.loads(jsoncodec.dumps({"n": 2**70})) == {"n": 2**70}
+
+
+def test_jsonify_matches_flask(app, backend):
+    """App encoder output equals flask's own, whichever backend"""
+    data = {
+        "when": datetime(2022, 11, 2, 8, 30),
+        "id": uuid.UUID(int=8),
+        "z": 1,
+        "a": [{"y": 2, "x": 1}],
+    }
+    with app.test_request_context():
+        body = jsonify(data).get_data(as_text=True)
+    assert json.loads(body) == {
+        "when": "Wed, 02 Nov 2022 08:30:00 GMT",
+        "id": str(uuid.UUID(int=8)),
+        "z": 1,
+        "a": [{"y": 2, "x": 1}],
+    }
+    # flask sorts keys by default
+    assert body.index('"a"') < body.index('"id"') < body.index('"z"')
+
+
+@mark.parametrize(
+    "payload", ['{"resourceType": "Patient"}', b'{"resourceType": "Patient"}']
+)
+def test_request_json(app, backend, payload):
+    with app.test_request_context(
+        method="POST", data=payload, content_type="application/json"
+    ):
+        assert request.get_json() == {"resourceType": "Patient"}
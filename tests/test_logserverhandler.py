@@ -0,0 +1,113 @@
+import json
+import logging
+import threading
+import time
+
+import requests
+
+from pytest import fixture
+
+from conftest import mock_response
+from patientsearch.logserverhandler import LogServerHandler
+
+
+@fixture
+def logger():
+    logger = logging.getLogger("test_logserverhandler")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_batched_shipping(mocker, logger):
+    batches = []
+
+    def post(url, headers, data, timeout):
+        batches.append(json.loads(data))
+        return mock_response()
+
+    mocker.patch("requests.Session.post", side_effect=post)
+    handler = LogServerHandler(url="http://logs.fake", jwt="token", batch_size=10)
+    logger.addHandler(handler)
+
+    for i in range(25):
+        logger.info("event %d", i, extra={"tags": ["test"]})
+    handler.flush(timeout=5)
+
+    events = [entry["event"] for batch in batches for entry in batch]
+    assert [e["message"] for e in events] == [f"event {i}" for i in range(25)]
+    assert events[0]["tags"] == ["test"]
+    assert all(len(batch) <= 10 for batch in batches)
+    assert handler.stats()["shipped"] == 25
+    assert handler.stats()["queue_depth"] == 0
+
+
+def test_emit_doesnt_wait_on_logserver(mocker, logger):
+    release = threading.Event()
+
+    def stalled_post(**kwargs):
+        release.wait(5)
+        return mock_response()
+
+    mocker.patch("requests.Session.post", side_effect=stalled_post)
+    handler = LogServerHandler(
+        url="http://logs.fake", jwt="token", queue_size=5, batch_size=1
+    )
+    logger.addHandler(handler)
+
+    start = time.perf_counter()
+    for i in range(20):
+        logger.info("event %d", i)
+    assert time.perf_counter() - start < 1
+
+    # at most one batch held by the stalled POST, the queue full, rest dropped
+    stats = handler.stats()
+    assert stats["queue_depth"] in (4, 5)
+    assert stats["queue_depth"] + stats["dropped"] in (19, 20)
+    release.set()
+
+
+def test_drop_newest(mocker, logger):
+    release = threading.Event()
+    shipped = []
+
+    def stalled_post(data, **kwargs):
+        release.wait(5)
+        shipped.extend(entry["event"]["message"] for entry in json.loads(data))
+        return mock_response()
+
+    mocker.patch("requests.Session.post", side_effect=stalled_post)
+    handler = LogServerHandler(
+        url="http://logs.fake",
+        jwt="token",
+        queue_size=2,
+        batch_size=10,
+        overflow="drop_newest",
+        flush_interval=0.01,
+    )
+    logger.addHandler(handler)
+
+    logger.info("first")
+    while handler.stats()["queue_depth"]:
+        pass  # shipper picked up "first", now stalled
+    for message in ("second", "third", "fourth"):
+        logger.info(message)
+    release.set()
+    handler.flush(timeout=5)
+
+    assert shipped == ["first", "second", "third"]
+    assert handler.stats()["dropped"] == 1
+
+
+def test_failed_post_counted(mocker, logger):
+    mocker.patch(
+        "requests.Session.post", side_effect=requests.exceptions.ConnectionError()
+    )
+    handler = LogServerHandler(url="http://logs.fake", jwt="token")
+    logger.addHandler(handler)
+    logger.info("lost")
+    handler.flush(timeout=5)
+    assert handler.stats()["failed"] == 1
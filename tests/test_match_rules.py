@@ -0,0 +1,44 @@
+from pytest import raises
+
+from patientsearch.models import patient_as_search_params
+from patientsearch.models.match_rules import DEFAULT_MATCH_RULES, MatchRules
+
+SSN = "http://hl7.org/fhir/sid/us-ssn"
+
+
+def test_default_rules(app):
+    fhir_patient = {
+        "name": [{"family": "skywalker", "given": ["luke", "l"]}],
+        "birthDate": "1977-01-12",
+    }
+    # common parameter use; single name and given
+    search_patient = {
+        "name": {"family": "skywalker", "given": "luke"},
+        "birthDate": "1977-01-12",
+    }
+    expected = {"family": "skywalker", "given": "luke", "birthdate": "eq1977-01-12"}
+    assert patient_as_search_params(fhir_patient) == expected
+    assert patient_as_search_params(search_patient) == expected
+    assert patient_as_search_params({"name": []}) == {}
+
+
+def test_configured_rules(app):
+    rules = list(DEFAULT_MATCH_RULES) + [
+        [f"identifier[?system=='{SSN}'].value | [0]", "identifier", f"{SSN}|"]
+    ]
+    patient = {
+        "name": [{"family": "skywalker", "given": ["luke"]}],
+        "identifier": [{"system": SSN, "value": "123-45-6789"}],
+    }
+    assert MatchRules(rules).search_params(patient) == {
+        "family": "skywalker",
+        "given": "luke",
+        "identifier": f"{SSN}|123-45-6789",
+    }
+
+
+def test_invalid_rules():
+    with raises(ValueError):
+        MatchRules([("name.family", "family")])
+    with raises(ValueError):
+        MatchRules([])
@@ -0,0 +1,80 @@
+from pytest import fixture
+
+from patientsearch.metrics import OTHER_RESOURCE_TYPE
+
+SCRAPER = {"Authorization": "Bearer scraper"}
+
+
+@fixture
+def hapi_client(client, upstream, mocker, faux_token):
+    mocker.patch("patientsearch.api._validate_auth", return_value=faux_token)
+    client.application.config["MAP_API"] = upstream.url
+    client.application.config["METRICS_TOKEN"] = "scraper"
+    return client
+
+
+def test_server_timing(hapi_client):
+    hapi_client.application.config["SERVER_TIMING"] = True
+    response = hapi_client.get("/fhir/Patient")
+    assert response.status_code == 200
+    timings = dict(
+        metric.split(";dur=")
+        for metric in response.headers["Server-Timing"].split(", ")
+    )
+    assert list(timings) == ["auth", "hapi", "pdmp", "serialize", "total"]
+    assert float(timings["hapi"]) > 0
+    assert float(timings["pdmp"]) == 0
+    assert float(timings["total"]) >= float(timings["hapi"])
+
+
+def test_server_timing_disabled(hapi_client):
+    response = hapi_client.get("/fhir/Patient")
+    assert "Server-Timing" not in response.headers
+
+
+def test_metrics(hapi_client):
+    hapi_client.get("/fhir/Patient")
+    response = hapi_client.get("/metrics", headers=SCRAPER)
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    text = response.get_data(as_text=True)
+    assert (
+        'patientsearch_request_duration_seconds_count{method="GET",'
+        'route="/fhir/<string:resource_type>",status="200"}' in text
+    )
+    assert (
+        'patientsearch_upstream_request_duration_seconds_count{resource_type="Patient",'
+        'status="200",upstream="MAP_API",verb="GET"}' in text
+    )
+    assert 'patientsearch_auth_duration_seconds_count{outcome="authorized"}' in text
+
+
+def test_unknown_resource_types(hapi_client, upstream):
+    """Types the upstream doesn't serve share one label"""
+    upstream.responder = lambda path: (
+        (200, {"resourceType": "Bundle"})
+        if path.startswith("/Practitioner")
+        else (404, {"resourceType": "OperationOutcome"})
+    )
+    hapi_client.get("/fhir/NoSuchType1")
+    hapi_client.get("/fhir/NoSuchType2")
+    hapi_client.get("/fhir/Practitioner")
+    text = hapi_client.get("/metrics", headers=SCRAPER).get_data(as_text=True)
+    assert f'resource_type="{OTHER_RESOURCE_TYPE}",status="404"' in text
+    assert 'resource_type="Practitioner",status="200"' in text
+    assert "NoSuchType" not in text
+
+
+def test_metrics_not_configured(client):
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_token(client):
+    client.application.config["METRICS_TOKEN"] = "scraper"
+    assert client.get("/metrics").status_code == 401
+    assert (
+        client.get("/metrics", headers={"Authorization": "Bearer other"}).status_code
+        == 401
+    )
+    response = client.get("/metrics", headers=SCRAPER)
+    assert response.status_code == 200
@@ -0,0 +1,42 @@
+import gzip
+import json
+
+from pytest import fixture
+
+from conftest import BUNDLE
+
+
+@fixture
+def passthrough_client(client, upstream, mocker, faux_token):
+    mocker.patch("patientsearch.api.validate_auth", return_value=faux_token)
+    upstream.gzip = True
+    upstream.headers = {"ETag": 'W/"3"'}
+    upstream.responder = lambda path: (404 if "Missing" in path else 200, BUNDLE)
+    client.application.config["MAP_API"] = upstream.url
+    client.application.config["FHIR_PASSTHROUGH"] = True
+    return client
+
+
+def test_compressed_passthrough(passthrough_client):
+    response = passthrough_client.get(
+        "/fhir/Patient", headers={"Accept-Encoding": "gzip, deflate"}
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == 'W/"3"'
+    assert response.headers["Content-Type"].startswith("application/fhir+json")
+    assert json.loads(gzip.decompress(response.data)) == BUNDLE
+
+
+def test_decoded_passthrough(passthrough_client):
+    response = passthrough_client.get(
+        "/fhir/Patient/8", headers={"Accept-Encoding": ""}
+    )
+    assert "Content-Encoding" not in response.headers
+    assert json.loads(response.data) == BUNDLE
+
+
+def test_passthrough_error(passthrough_client):
+    response = passthrough_client.get("/fhir/Missing/8")
+    assert response.status_code == 400
+    assert "404" in response.json["message"]
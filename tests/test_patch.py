@@ -0,0 +1,84 @@
+import json
+
+from pytest import fixture
+
+from conftest import mock_response
+from patientsearch.models.json_patch import diff
+from patientsearch.models.sync import HAPI_update, _patch_unsupported
+
+
+@fixture
+def patient():
+    return {
+        "resourceType": "Patient",
+        "id": "8",
+        "meta": {"versionId": "2"},
+        "identifier": [{"system": "http://a", "value": "1"}],
+    }
+
+
+@fixture
+def patch_writes(app):
+    app.config["FHIR_PATCH_WRITES"] = True
+    _patch_unsupported.clear()
+
+
+def test_diff():
+    old = {"a": 1, "b": {"c": [1, 2]}, "d/e": "x", "gone": True}
+    new = {"a": 1, "b": {"c": [1, 2, 3]}, "d/e": "y", "added": [0]}
+    assert diff(old, new) == [
+        {"op": "remove", "path": "/gone"},
+        {"op": "add", "path": "/b/c/-", "value": 3},
+        {"op": "replace", "path": "/d~1e", "value": "y"},
+        {"op": "add", "path": "/added", "value": [0]},
+    ]
+    assert diff({"l": [1, 2]}, {"l": [2]}) == [
+        {"op": "replace", "path": "/l", "value": [2]}
+    ]
+    assert diff(old, old) == []
+
+
+def test_patch_write(patch_writes, mocker, faux_token, patient):
+    updated = dict(patient, active=True)
+    hapi_patch = mocker.patch(
+        "requests.Session.patch", return_value=mock_response(updated)
+    )
+    hapi_put = mocker.patch("requests.Session.put")
+
+    result = HAPI_update(faux_token, "Patient", "8", updated, original=patient)
+    assert result == updated
+    assert hapi_put.call_count == 0
+    assert json.loads(hapi_patch.call_args.kwargs["data"]) == [
+        {"op": "test", "path": "/meta/versionId", "value": "2"},
+        {"op": "add", "path": "/active", "value": True},
+    ]
+
+
+def test_patch_unsupported_falls_back(patch_writes, mocker, faux_token, patient):
+    updated = dict(patient, active=True)
+    hapi_patch = mocker.patch(
+        "requests.Session.patch", return_value=mock_response(None, 405)
+    )
+    hapi_put = mocker.patch("requests.Session.put", return_value=mock_response(updated))
+
+    assert HAPI_update(faux_token, "Patient", "8", updated, patient) == updated
+    assert HAPI_update(faux_token, "Patient", "8", updated, patient) == updated
+    # not attempted again, once found unsupported
+    assert hapi_patch.call_count == 1
+    assert hapi_put.call_count == 2
+
+
+def test_patch_conflict_falls_back(patch_writes, mocker, faux_token, patient):
+    updated = dict(patient, active=True)
+    mocker.patch("requests.Session.patch", return_value=mock_response(None, 412))
+    hapi_put = mocker.patch("requests.Session.put", return_value=mock_response(updated))
+
+    assert HAPI_update(faux_token, "Patient", "8", updated, patient) == updated
+    assert hapi_put.call_args.kwargs["json"] == updated
+
+
+def test_put_without_original(patch_writes, mocker, faux_token, patient):
+    hapi_patch = mocker.patch("requests.Session.patch")
+    mocker.patch("requests.Session.put", return_value=mock_response(patient))
+    HAPI_update(faux_token, "Patient", "8", patient)
+    assert hapi_patch.call_count == 0
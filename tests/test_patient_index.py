@@ -0,0 +1,155 @@
+from pytest import fixture
+
+from conftest import mock_response
+from patientsearch.models import HAPI_request, internal_patient_search
+from patientsearch.models.patient_index import (
+    demographic_block,
+    index_patient,
+    patient_index,
+    scan,
+    scan_executor,
+)
+
+
+def patient(id, family="Skywalker", version="1"):
+    return {
+        "resourceType": "Patient",
+        "id": id,
+        "meta": {"versionId": version, "lastUpdated": f"2021-01-0{id}T00:00:00Z"},
+        "name": [{"family": family, "given": ["Luke"]}],
+        "birthDate": "1977-01-12",
+    }
+
+
+def searchset(*patients, next_url=None):
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": len(patients),
+        "entry": [{"resource": p} for p in patients],
+        "link": [],
+    }
+    if next_url:
+        bundle["link"].append({"relation": "next", "url": next_url})
+    return bundle
+
+
+@fixture
+def indexed_app(app):
+    app.config["PATIENT_INDEX"] = True
+    app.config["PATIENT_INDEX_SCAN_INTERVAL"] = 0
+    return app
+
+
+def test_demographic_block():
+    assert demographic_block(" Núñez ", "JOSÉ", "1980-02-03") == (
+        "nunez|jose|1980-02-03"
+    )
+    assert demographic_block("Nunez", None, "1980-02-03") is None
+
+
+def test_index_disabled_by_default(app):
+    assert patient_index() is None
+
+
+def test_index_hit_skips_search(indexed_app, mocker, faux_token):
+    index_patient(patient("1"))
+    hapi_get = mocker.patch(
+        "requests.Session.get", return_value=mock_response(patient("1"))
+    )
+
+    bundle = internal_patient_search(faux_token, patient("x"))
+    assert bundle["total"] == 1
+    assert bundle["entry"][0]["resource"]["id"] == "1"
+    # a read by id, not a search
+    assert hapi_get.call_args.args[0].endswith("Patient/1")
+    assert hapi_get.call_args.kwargs["params"] is None
+
+
+def test_index_miss_searches_and_learns(indexed_app, mocker, faux_token):
+    hapi_get = mocker.patch(
+        "requests.Session.get", return_value=mock_response(searchset(patient("1")))
+    )
+    internal_patient_search(faux_token, patient("x"))
+    assert hapi_get.call_args.kwargs["params"]["family"] == "Skywalker"
+
+    hapi_get.return_value = mock_response(patient("1"))
+    internal_patient_search(faux_token, patient("x"))
+    assert hapi_get.call_args.args[0].endswith("Patient/1")
+
+
+def test_stale_hit_falls_back(indexed_app, mocker, faux_token):
+    index_patient(patient("1"))
+    # renamed elsewhere, since indexed
+    mocker.patch(
+        "requests.Session.get",
+        side_effect=[
+            mock_response(patient("1", family="Lars", version="2")),
+            mock_response(searchset()),
+        ],
+    )
+    assert internal_patient_search(faux_token, patient("x"))["total"] == 0
+
+
+def test_writes_move_patient(indexed_app, mocker, faux_token):
+    index_patient(patient("1"))
+    renamed = patient("1", family="Lars", version="2")
+    mocker.patch("requests.Session.put", return_value=mock_response(renamed))
+    HAPI_request(
+        faux_token, "PUT", resource_type="Patient", resource_id="1", resource=renamed
+    )
+
+    index = patient_index()
+    assert index.lookup(demographic_block("skywalker", "luke", "1977-01-12")) == {}
+    assert index.lookup(demographic_block("lars", "luke", "1977-01-12")) == {"1": "2"}
+
+
+def test_delta_scan(indexed_app, mocker, faux_token):
+    indexed_app.config["PATIENT_INDEX_FULL_SCAN"] = True
+    hapi_get = mocker.patch(
+        "requests.Session.get",
+        side_effect=[
+            mock_response(
+                searchset(patient("1"), next_url="http://hapi/fhir?_getpages=abc")
+            ),
+            mock_response(searchset(patient("2", family="Lars"))),
+            mock_response(searchset()),
+        ],
+    )
+    scan(faux_token)
+    assert hapi_get.call_args.kwargs["params"] == {"_getpages": "abc"}
+    assert patient_index().stats()["size"] == 2
+    assert patient_index().scan_mark() == "2021-01-02T00:00:00Z"
+
+    scan(faux_token)
+    assert hapi_get.call_args.kwargs["params"]["_lastUpdated"] == (
+        "ge2021-01-02T00:00:00Z"
+    )
+
+
+def test_any_given_name_hits(indexed_app, mocker, faux_token):
+    biggs = patient("1")
+    biggs["name"] = [{"family": "Darklighter", "given": ["Luke", "Biggs"]}]
+    index_patient(biggs)
+    mocker.patch("requests.Session.get", return_value=mock_response(biggs))
+
+    searched = patient("x")
+    searched["name"] = [{"family": "Darklighter", "given": ["Biggs"]}]
+    bundle = internal_patient_search(faux_token, searched)
+    assert [e["resource"]["id"] for e in bundle["entry"]] == ["1"]
+
+
+def test_first_scan_only_marks(indexed_app, mocker, faux_token):
+    hapi_get = mocker.patch("requests.Session.get")
+    scan(faux_token)
+    assert not hapi_get.called
+    assert patient_index().scan_mark()
+
+
+def test_scan_on_own_executor(indexed_app, mocker, faux_token):
+    indexed_app.config["PATIENT_INDEX_SCAN_INTERVAL"] = 60
+    background = mocker.patch("patientsearch.models.async_upstream.run_in_background")
+    mocker.patch("requests.Session.get", return_value=mock_response(searchset()))
+    internal_patient_search(faux_token, patient("x"))
+    assert background.call_args.args == (scan, faux_token)
+    assert background.call_args.kwargs["executor"] is scan_executor()
@@ -0,0 +1,103 @@
+import os
+import time
+
+from pytest import fixture
+
+from patientsearch import create_app
+from patientsearch.profiling import (
+    PROFILE_HEADER,
+    profile_header,
+    route_slug,
+    valid_profile_header,
+)
+
+SECRET = "profile-secret"
+
+
+def profiled_app(monkeypatch, tmp_path, sample_rate=0.0, secret=None, max_files=100):
+    monkeypatch.setattr("patientsearch.config.PROFILE_SAMPLE_RATE", sample_rate)
+    monkeypatch.setattr("patientsearch.config.PROFILE_SECRET", secret)
+    monkeypatch.setattr("patientsearch.config.PROFILE_INTERVAL", 0.001)
+    monkeypatch.setattr("patientsearch.config.PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr("patientsearch.config.PROFILE_MAX_FILES", max_files)
+    app = create_app(testing=True)
+
+    @app.route("/slow/<int:delay>")
+    def slow(delay):
+        time.sleep(delay / 1000)
+        return "done"
+
+    return app
+
+
+@fixture
+def signed_client(monkeypatch, tmp_path):
+    return profiled_app(monkeypatch, tmp_path, secret=SECRET).test_client()
+
+
+def profiles(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".folded"))
+
+
+def test_disabled_registers_nothing(app):
+    hooks = [fn.__name__ for fn in app.before_request_funcs.get(None, [])]
+    assert "start_profile" not in hooks
+    assert "stop_profile" not in [
+        fn.__name__ for fn in app.teardown_request_funcs.get(None, [])
+    ]
+
+
+def test_sampled_request(monkeypatch, tmp_path):
+    client = profiled_app(monkeypatch, tmp_path, sample_rate=1.0).test_client()
+    assert client.get("/slow/50").data == b"done"
+
+    (name,) = profiles(tmp_path)
+    assert name.startswith("slow_delay.")
+    lines = (tmp_path / name).read_text().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert any(line.split(";")[-1].startswith("slow (") for line in lines)
+
+
+def test_signed_request(signed_client, tmp_path):
+    signed_client.get("/slow/20")
+    assert profiles(tmp_path) == []
+
+    signed_client.get("/slow/20", headers={PROFILE_HEADER: profile_header(SECRET)})
+    assert len(profiles(tmp_path)) == 1
+
+
+def test_invalid_signatures(signed_client, tmp_path):
+    for header in (
+        profile_header("wrong secret"),
+        profile_header(SECRET, ttl=-10),
+        "garbage",
+    ):
+        signed_client.get("/slow/20", headers={PROFILE_HEADER: header})
+    assert profiles(tmp_path) == []
+
+
+def test_rotation(monkeypatch, tmp_path):
+    client = profiled_app(
+        monkeypatch, tmp_path, sample_rate=1.0, max_files=2
+    ).test_client()
+    for _ in range(4):
+        client.get("/slow/10")
+    assert len(profiles(tmp_path)) == 2
+
+
+def test_profile_header():
+    header = profile_header(SECRET)
+    assert valid_profile_header(header, SECRET)
+    assert not valid_profile_header(header, "other")
+    expires, signature = header.split(".")
+    assert not valid_profile_header(f"{int(expires) + 1}.{signature}", SECRET)
+
+
+def test_route_slug():
+    assert (
+        route_slug("/fhir/<string:resource_type>/<int:id>") == "fhir_resource_type_id"
+    )
+    assert route_slug("/") == "root"
+    assert route_slug(None) == "unmatched"
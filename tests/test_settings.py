@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from patientsearch.jsoncodec import AppJSONEncoder
+
+
+def test_settings_leave_app_encoder(client):
+    client.application.config["PERMANENT_SESSION_LIFETIME"] = timedelta(hours=1)
+    response = client.get("/settings")
+    assert response.status_code == 200
+    assert response.json["PERMANENT_SESSION_LIFETIME"] == "1:00:00"
+    assert "SECRET_KEY" not in response.json
+    assert client.application.json_encoder is AppJSONEncoder
+
+
+def test_single_setting(client):
+    client.application.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=2)
+    response = client.get("/settings/permanent_session_lifetime")
+    assert response.json == {"PERMANENT_SESSION_LIFETIME": "2 days, 0:00:00"}
@@ -0,0 +1,108 @@
+import threading
+import time
+
+from pytest import fixture, raises
+
+from patientsearch.models.single_flight import single_flight
+
+
+@fixture
+def run_concurrently(app):
+    def run(*calls):
+        results = [None] * len(calls)
+
+        def call(i):
+            with app.app_context():
+                results[i] = calls[i]()
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(len(calls))]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)  # leader first
+        for thread in threads:
+            thread.join()
+        return results
+
+    return run
+
+
+def test_concurrent_calls_share_result(run_concurrently):
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"entry": [1]}
+
+    results = run_concurrently(*(lambda: single_flight("key", slow) for _ in range(3)))
+    assert len(calls) == 1
+    assert results == [{"entry": [1]}] * 3
+    # followers get their own copy
+    assert results[0] is not results[1]
+
+
+def test_distinct_keys_not_shared(run_concurrently):
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+
+    run_concurrently(lambda: single_flight("a", slow), lambda: single_flight("b", slow))
+    assert len(calls) == 2
+
+
+def test_leader_error_shared(app, run_concurrently):
+    def failing():
+        time.sleep(0.1)
+        raise RuntimeError("PDMP down")
+
+    errors = []
+
+    def call():
+        try:
+            single_flight("failing", failing)
+        except RuntimeError as error:
+            errors.append(error)
+
+    run_concurrently(call, call)
+    assert len(errors) == 2
+
+    with app.app_context(), raises(RuntimeError):
+        single_flight("failing", failing)
+
+
+def test_external_search_audits_each_caller(app, mocker, faux_token):
+    app.config["EXTERNAL_SEARCH_SINGLE_FLIGHT"] = True
+    mocker.patch("patientsearch.api.validate_auth", return_value=faux_token)
+    mocker.patch(
+        "patientsearch.api.current_user_info", return_value={"DEA": "FD1234567"}
+    )
+    calls = []
+
+    def outcome(*args):
+        calls.append(1)
+        time.sleep(0.2)
+        return {"audit": [("PDMP found match", "info")], "bundle": {"total": 1}}
+
+    mocker.patch("patientsearch.api.external_search_outcome", side_effect=outcome)
+    audit = mocker.patch("patientsearch.api.audit_entry")
+
+    responses = []
+
+    def search():
+        with app.test_client() as client:
+            responses.append(
+                client.put("/external_search/Patient?subject:Patient.name.given=luke")
+            )
+
+    threads = [threading.Thread(target=search) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert [r.json for r in responses] == [{"total": 1}] * 2
+    assert audit.call_count == 2
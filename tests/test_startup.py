@@ -0,0 +1,27 @@
+from patientsearch import create_app
+from patientsearch.models.cache import RedisStore, redis_connection
+
+UNREACHABLE_REDIS = "redis://127.0.0.1:1/0"
+
+
+def test_create_app_without_redis(monkeypatch):
+    monkeypatch.setattr("patientsearch.config.REDIS_URL", UNREACHABLE_REDIS)
+    monkeypatch.setattr("patientsearch.config.SESSION_TYPE", "redis")
+    app = create_app(testing=True)
+    assert app.config["SESSION_REDIS"] is redis_connection(UNREACHABLE_REDIS)
+    store = app.config["OIDC_CREDENTIALS_STORE"]
+    assert isinstance(store, RedisStore)
+    assert store.namespace == "oidc_store"
+
+
+def test_logging_config_independent_of_cwd(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    assert create_app(testing=True)
+
+
+def test_migration_commands_only_for_cli(monkeypatch):
+    monkeypatch.delenv("FLASK_RUN_FROM_CLI", raising=False)
+    assert "migration" not in create_app(testing=True).blueprints
+
+    monkeypatch.setenv("FLASK_RUN_FROM_CLI", "true")
+    assert "migration" in create_app(testing=True).blueprints
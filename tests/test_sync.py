@@ -3,6 +3,7 @@ import json
 from pytest import fixture
 import os
 
+from conftest import mock_response
 from patientsearch.models import (
     add_identifier_to_resource_type,
     sync_bundle,
@@ -16,22 +17,6 @@ def load_json(datadir, filename):
     return data
 
 
-class mock_response:
-    """Wrap data in response like object"""
-
-    def __init__(self, data, status_code=200):
-        self.data = data
-        self.status_code = status_code
-
-    def json(self):
-        return self.data
-
-    def raise_for_status(self):
-        if self.status_code == 200:
-            return
-        raise Exception("status code ain't 200")
-
-
 @fixture
 def external_patient_search(datadir):
     return load_json(datadir, "external_patient_search.json")
@@ -104,13 +89,13 @@ def test_new_upsert(
 
     # Mock HAPI search failing to find a matching patient
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_miss),
     )
 
     # Mock POST to generate new patient on HAPI
     mocker.patch(
-        "patientsearch.models.sync.requests.post",
+        "requests.Session.post",
         return_value=mock_response(new_patient),
     )
 
@@ -130,13 +115,13 @@ def test_new_active_upsert(
 
     # Mock HAPI search failing to find a matching patient
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_miss),
     )
 
     # Mock POST to generate new patient on HAPI
     mocker.patch(
-        "patientsearch.models.sync.requests.post",
+        "requests.Session.post",
         return_value=mock_response(new_active_patient),
     )
 
@@ -165,7 +150,7 @@ def test_existing(
 
     # Mock HAPI search finding a matching patient
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_match),
     )
 
@@ -184,7 +169,7 @@ def test_active_existing(
 
     # Mock HAPI search finding a matching active patient
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_active_match),
     )
 
@@ -207,7 +192,7 @@ def test_inactive_existing(
 
     # Mock HAPI search finding a matching inactive patient
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_inactive_match),
     )
 
@@ -216,7 +201,7 @@ def test_inactive_existing(
     )
     # Mock POST to put active version of the same patient on HAPI
     mocker.patch(
-        "patientsearch.models.sync.requests.put",
+        "requests.Session.put",
         return_value=mock_response(identified_internal),
     )
 
@@ -235,7 +220,7 @@ def test_active_nonactive_existing(
 
     # Mock HAPI search finding a matching active patient
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_active_match),
     )
 
@@ -254,7 +239,7 @@ def test_inactive_nonactive_existing(
 
     # Mock HAPI search finding a matching inactive patient
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_inactive_match),
     )
 
@@ -270,7 +255,7 @@ def test_existing_modified(
     # Mock HAPI search finding a matching patient (w/o the identifier)
     assert "identifier" not in internal_patient_match["entry"][0]["resource"]
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_match),
     )
 
@@ -286,7 +271,7 @@ def test_existing_modified(
     identified_internal = deepcopy(internal_patient_match["entry"][0]["resource"])
     identified_internal["identifier"] = [found_identifier]
     mocker.patch(
-        "patientsearch.models.sync.requests.put",
+        "requests.Session.put",
         return_value=mock_response(identified_internal),
     )
 
@@ -307,7 +292,7 @@ def test_duplicate(
 
     # Mock HAPI search finding duplicate matching patients
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_duplicate_match),
     )
 
@@ -327,7 +312,7 @@ def test_duplicate_active(
 
     # Mock HAPI search finding duplicate active matching patients
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_duplicate_active_match),
     )
 
@@ -347,7 +332,7 @@ def test_duplicate_inactive(
 
     # Mock HAPI search finding duplicate inactive matching patients
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_duplicate_inactive_match),
     )
 
@@ -367,7 +352,7 @@ def test_restore_inactive_resource(
     """Confirm the patient gets restored"""
     # Mock HAPI search finding a matching inactive patient
     mocker.patch(
-        "patientsearch.models.sync.requests.get",
+        "requests.Session.get",
         return_value=mock_response(internal_patient_inactive_match),
     )
 
@@ -376,7 +361,7 @@ def test_restore_inactive_resource(
     )
     # Mock POST to put active version of the same patient on HAPI
     mocker.patch(
-        "patientsearch.models.sync.requests.put",
+        "requests.Session.put",
         return_value=mock_response(identified_internal),
     )
 
@@ -384,3 +369,112 @@ def test_restore_inactive_resource(
     result = restore_patient(faux_token, active_result)
 
     assert result == internal_patient_active_match["entry"][0]["resource"]
+
+
+def test_multiple_external_matches(
+    client,
+    mocker,
+    faux_token,
+    external_patient_search,
+    internal_patient_miss,
+    internal_patient_match,
+    new_patient,
+):
+    """All patients in bundle synchronized with a single HAPI transaction"""
+    leia = deepcopy(external_patient_search["entry"][0])
+    leia["resource"]["name"] = {"family": "organa", "given": ["leia"]}
+    external_patient_search["entry"].insert(0, leia)
+
+    def search(url, params, **kwargs):
+        if params["family"] == "organa":
+            return mock_response(internal_patient_miss)
+        return mock_response(internal_patient_match)
+
+    hapi_get = mocker.patch("requests.Session.get", side_effect=search)
+    hapi_post = mocker.patch(
+        "requests.Session.post",
+        return_value=mock_response(
+            {
+                "resourceType": "Bundle",
+                "type": "transaction-response",
+                "entry": [{"resource": new_patient}],
+            }
+        ),
+    )
+
+    result = sync_bundle(faux_token, external_patient_search)
+    assert result == new_patient
+    assert hapi_get.call_count == 2
+    assert hapi_post.call_count == 1
+    transaction = hapi_post.call_args.kwargs["json"]
+    assert transaction["type"] == "transaction"
+    # the existing (unmodified) match needs no write
+    assert [e["request"] for e in transaction["entry"]] == [
+        {"method": "POST", "url": "Patient"}
+    ]
+
+
+@fixture
+def conditional_writes(app):
+    app.config["CONDITIONAL_PATIENT_WRITES"] = True
+
+
+def test_conditional_create(
+    client, mocker, faux_token, conditional_writes, external_patient_search, new_patient
+):
+    """Conditional create inserts a new patient in one round trip"""
+    hapi_get = mocker.patch("requests.Session.get")
+    hapi_post = mocker.patch(
+        "requests.Session.post", return_value=mock_response(new_patient, 201)
+    )
+
+    result = sync_bundle(faux_token, external_patient_search)
+    assert result == new_patient
+    assert hapi_get.call_count == 0
+    assert hapi_post.call_count == 1
+    assert hapi_post.call_args.kwargs["headers"]["If-None-Exist"] == (
+        "family=skywalker&given=luke&birthdate=eq1977-01-12"
+    )
+
+
+def test_conditional_create_existing(
+    client,
+    mocker,
+    faux_token,
+    conditional_writes,
+    external_patient_search,
+    internal_patient_match,
+):
+    """Conditional create matching a patient in sync returns it as is"""
+    existing = internal_patient_match["entry"][0]["resource"]
+    hapi_post = mocker.patch(
+        "requests.Session.post", return_value=mock_response(existing)
+    )
+    hapi_put = mocker.patch("requests.Session.put")
+
+    result = sync_bundle(faux_token, external_patient_search)
+    assert result == existing
+    assert hapi_post.call_count == 1
+    assert hapi_put.call_count == 0
+
+
+def test_conditional_create_multiple_matches(
+    client,
+    mocker,
+    faux_token,
+    conditional_writes,
+    external_patient_search,
+    internal_patient_duplicate_match,
+):
+    """Several matches fall back to search, returning the first"""
+    mocker.patch(
+        "requests.Session.post", return_value=mock_response(None, status_code=412)
+    )
+    hapi_get = mocker.patch(
+        "requests.Session.get",
+        return_value=mock_response(internal_patient_duplicate_match),
+    )
+
+    result = sync_bundle(faux_token, external_patient_search)
+    assert result == internal_patient_duplicate_match["entry"][0]["resource"]
+    assert hapi_get.call_count == 1
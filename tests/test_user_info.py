@@ -0,0 +1,44 @@
+from pytest import fixture
+
+from patientsearch.api import current_user_info
+
+
+@fixture
+def oidc(mocker):
+    oidc = mocker.patch("patientsearch.api.oidc")
+    oidc.user_getfield.side_effect = {
+        "preferred_username": "luke",
+        "DEA": "AS1234563",
+    }.get
+    return oidc
+
+
+def test_memoized_per_request(app, oidc, faux_token):
+    expected = {"username": "luke", "DEA": "AS1234563"}
+    for _ in range(4):
+        assert current_user_info(faux_token) == expected
+    assert oidc.user_getfield.call_count == 2
+
+
+# NB a fresh app context per request, as in production; pytest-flask's
+# already pushed context would otherwise share `flask.g` between them
+
+
+def test_cached_across_requests(app, oidc, faux_token):
+    app.config["USER_INFO_CACHE_TTL"] = 60
+    with app.app_context(), app.test_request_context():
+        current_user_info(faux_token)
+    with app.app_context(), app.test_request_context():
+        assert current_user_info(faux_token)["DEA"] == "AS1234563"
+    assert oidc.user_getfield.call_count == 2
+
+
+def test_failed_lookup_not_cached(app, oidc, faux_token):
+    app.config["USER_INFO_CACHE_TTL"] = 60
+    oidc.user_getfield.side_effect = RuntimeError("credentials unavailable")
+    with app.app_context(), app.test_request_context():
+        assert current_user_info(faux_token)["username"] == "unknown"
+
+    oidc.user_getfield.side_effect = {"preferred_username": "luke", "DEA": "x"}.get
+    with app.app_context(), app.test_request_context():
+        assert current_user_info(faux_token)["username"] == "luke"
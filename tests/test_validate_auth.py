@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import jwt
+from pytest import fixture, raises
+from werkzeug.exceptions import Forbidden, Unauthorized
+
+from patientsearch.api import token_ttl, validate_auth
+from patientsearch.models.cache import get_cache
+
+
+def generate_jwt(roles):
+    claims = {
+        "exp": (datetime.utcnow() + timedelta(minutes=5)).timestamp(),
+        "realm_access": {"roles": roles},
+    }
+    return jwt.encode(claims, "nonsense-testing-key", algorithm="HS256").decode()
+
+
+@fixture
+def oidc(mocker):
+    oidc = mocker.patch("patientsearch.api.oidc")
+    oidc.validate_token.return_value = True
+    return oidc
+
+
+@fixture
+def token_cached_app(app):
+    app.config["TOKEN_CACHE_TTL"] = 60
+    return app
+
+
+def test_token_ttl(faux_token):
+    # generated tokens expire in five minutes
+    assert 50 < token_ttl(faux_token, 60) <= 60
+    assert 200 < token_ttl(faux_token, 600) <= 300
+    assert token_ttl("not-a-jwt", 60) == 0
+
+
+def test_uncached(app, oidc, faux_token):
+    oidc.get_access_token.return_value = faux_token
+    assert validate_auth() == faux_token
+    assert validate_auth() == faux_token
+    assert oidc.validate_token.call_count == 2
+
+
+def test_cached_validation(token_cached_app, oidc, faux_token):
+    oidc.get_access_token.return_value = faux_token
+    assert validate_auth() == faux_token
+    assert validate_auth() == faux_token
+    assert oidc.validate_token.call_count == 1
+
+    stats = get_cache("tokens", "TOKEN_CACHE").stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_invalid_not_cached(token_cached_app, oidc, faux_token):
+    oidc.get_access_token.return_value = faux_token
+    oidc.validate_token.return_value = False
+    for _ in range(2):
+        with raises(Unauthorized):
+            validate_auth()
+    assert oidc.validate_token.call_count == 2
+
+
+def test_cached_role_decision(token_cached_app, oidc):
+    token_cached_app.config["REQUIRED_ROLES"] = ["clinician"]
+    oidc.get_access_token.return_value = generate_jwt(roles=["admin"])
+    for _ in range(2):
+        with raises(Forbidden):
+            validate_auth()
+    assert oidc.validate_token.call_count == 1
+
+    oidc.get_access_token.return_value = generate_jwt(roles=["clinician"])
+    validate_auth()
+
+
+def test_unauthenticated_cached(token_cached_app, oidc, client):
+    """Requests without credentials are rejected, not an error"""
+    oidc.get_access_token.return_value = None
+    oidc.validate_token.return_value = False
+    with raises(Unauthorized):
+        validate_auth()
+
+    response = client.get("/validate_token")
+    assert response.status_code == 200
+    assert response.json["valid"] is False